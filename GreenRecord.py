@@ -1,38 +1,63 @@
-import sys
-import cv2
-import numpy as np
-import pyautogui
-import os
-import sounddevice as sd
-from scipy.io.wavfile import write
-from PyQt5 import QtWidgets, QtGui, QtCore
-import os
-import sys
-import numpy as np
-import pyautogui
-import cv2
-import sounddevice as sd
-from scipy.io.wavfile import write
-from PyQt5 import QtWidgets, QtCore
-from moviepy import VideoFileClip, AudioFileClip
-import sys
-import cv2
-import numpy as np
-import pyautogui
 import os
-import sounddevice as sd
-from scipy.io.wavfile import write
-from PyQt5 import QtWidgets, QtGui, QtCore
 import sys
-import numpy as np
-import sounddevice as sd
-from PyQt5 import QtWidgets, QtCore
-from scipy.io.wavfile import write
+import threading
+import time
+import multiprocessing
+from PyQt5 import QtWidgets, QtCore, QtGui
+# Движок записи без Qt; numpy, cv2, sounddevice и модули захвата
+# импортируются только при старте записи (RecordingSession.start)
+from greenrecord.devices import AudioDeviceService
+from greenrecord.encoders import CODECS, PRESETS, SEGMENT_CONTAINER, EncoderSettings
+from greenrecord.segments import ManifestLock, read_manifest, recover_session
+from greenrecord.session import OutputSpec, RecordingSession
+from greenrecord.sinks import find_ffmpeg
 # Default settings
 DEFAULT_AUDIO_FS = 44100 # Default sample rate
 FALLBACK_AUDIO_FS = 22050  # Alternative sample rate if the default fails
 DEFAULT_VIDEO_RESOLUTION = (1920, 1080)  # Video resolution
+DEFAULT_CAPTURE_REGION = (0, 0, 0, 0)  # x, y, width, height; zero size = full screen
 DEFAULT_OUTPUT_DIR = os.path.expanduser("~")  # Default output directory
+DEFAULT_AUDIO_BLOCKSIZE = 1024  # Frames per audio callback
+DEFAULT_AUDIO_LATENCY = 'low'  # sounddevice latency: 'low', 'high' or seconds
+DEFAULT_AUDIO_BUFFER_SECONDS = 2.0  # Ring buffer between the audio callback and the WAV writer
+DEFAULT_EXTRA_AUDIO_DEVICES = []  # More inputs at their own rates, e.g. ['Monitor of Built-in Audio'] for system sound
+DEFAULT_AUDIO_TRACKS = False  # True: every audio device on its own track; False: mixed into one
+DEFAULT_VIDEO_FPS = 20.0  # Target capture frame rate
+DEFAULT_FRAME_QUEUE_SIZE = 4  # Preallocated frame buffers between capture and encoder
+DEFAULT_BACKPRESSURE = 'block'  # block, drop_oldest or drop_newest
+DEFAULT_CAPTURE_BACKEND = None  # None = first available of x11, mss, pyautogui
+DEFAULT_VARIABLE_FRAME_RATE = False  # Skip unchanged frames, timestamps go to a .timecodes.txt file (not with live mux)
+DEFAULT_CHANGE_TILE = 32  # Tile size (px) for change detection
+DEFAULT_VIDEO_CODEC = 'h264'  # h264, mpeg4, mjpeg or ffv1
+DEFAULT_ENCODER_PRESET = 'balanced'  # fast, balanced or small
+DEFAULT_ENCODER_THREADS = 0  # 0 = all cores
+DEFAULT_ENGINE = 'threads'  # 'threads' or 'processes' (capture/convert/encode in separate processes)
+DEFAULT_LIVE_MUX = True  # Mux audio and video into one file through ffmpeg while recording (if installed)
+DEFAULT_SPOOL_MEGABYTES = 1024  # Frames the encoder cannot take in time wait in a file of up to N MB; 0 = off
+DEFAULT_PREVIEW_PORT = None  # Live MJPEG preview at http://127.0.0.1:PORT/ while recording; None = off
+DEFAULT_PREVIEW_FPS = 5.0  # Preview frame rate (the recording is not affected)
+DEFAULT_PREVIEW_WIDTH = 640  # Preview width in pixels
+DEFAULT_SPOOL_DIR = None  # Local directory for that file; None = system temp (not the output directory)
+DEFAULT_PIXEL_FORMAT = 'auto'  # Frames for the encoder: 'auto' (yuv420p when ffmpeg takes it), bgr24, yuv420p, nv12
+DEFAULT_SEGMENT_SECONDS = 0  # Start a new file every N seconds; 0 = one file per recording
+DEFAULT_SEGMENT_MEGABYTES = 0  # Start a new file once a segment reaches N MB; 0 = no size limit
+DEFAULT_RECOVERY_IDLE_SECONDS = 60  # Unfinished sessions are recovered once their manifest has been idle this long
+DEFAULT_ADAPTIVE_QUALITY = False  # Lower preset / fps / size while the machine cannot keep up
+DEFAULT_ADAPTIVE_MIN_FPS = 10.0  # Adaptive quality never goes below this frame rate
+DEFAULT_ADAPTIVE_MIN_SCALE = 50  # ... or this size, in percent (size changes need segments)
+DEFAULT_SHOW_STATS = True  # Live fps / stage timings / drops in the toolbar while recording
+DEFAULT_METRICS_FILE = None  # e.g. "/var/lib/node_exporter/greenrecord.prom"; None = no export
+DEFAULT_METRICS_FORMAT = 'prometheus'  # 'prometheus' (text format) or 'json'
+DEFAULT_METRICS_INTERVAL = 5.0  # Seconds between metrics file updates
+# Extra outputs from the same capture (video only, <name> appended to the file name):
+# (name, region x/y/w/h or None, size w/h or None, fps or None), e.g. ('window', (200, 100, 1280, 720), (640, 360), 10)
+DEFAULT_EXTRA_OUTPUTS = []
+DEFAULT_REPLAY_SECONDS = 30  # Instant replay keeps this many seconds in memory
+DEFAULT_REPLAY_MAX_MEGABYTES = 256  # Upper bound for the replay buffer
+DEFAULT_REPLAY_HOTKEY = "Ctrl+Shift+S"  # Saves the replay while GreenRecord has focus
+DEFAULT_POST_JOBS = ('index', 'thumbnails', 'share')  # After stop: seek index, thumbnail strip, share copy; () = none
+DEFAULT_POST_WORKERS = 2  # Processes for post-processing
+DEFAULT_SHARE_HEIGHT = 720  # Share copies are scaled down to this height
 
 # Локализация
 LANGUAGES = {
@@ -42,6 +67,14 @@ LANGUAGES = {
         'browse': "Browse",
         'audio_sample_rate': "Audio Sample Rate:",
         'video_resolution': "Video Resolution (Width x Height):",
+        'capture_region': "Capture Region (X, Y, Width, Height; 0 = full screen):",
+        'video_codec': "Video Codec:",
+        'encoder_preset': "Encoder Preset:",
+        'encoder_threads': "Encoder Threads (0 = auto):",
+        'segment_length': "Segment Length, s (0 = one file):",
+        'adaptive_quality': "Adapt quality to load",
+        'adaptive_min_fps': "Minimum FPS:",
+        'adaptive_min_scale': "Minimum size, % (below 100 needs segments):",
         'save': "Save",
         'record': "▷",
         'stop': "□",
@@ -57,6 +90,14 @@ LANGUAGES = {
         'browse': "Обзор",
         'audio_sample_rate': "Частота дискретизации аудио:",
         'video_resolution': "Разрешение видео (Ширина x Высота):",
+        'capture_region': "Область захвата (X, Y, Ширина, Высота; 0 = весь экран):",
+        'video_codec': "Видеокодек:",
+        'encoder_preset': "Профиль кодирования:",
+        'encoder_threads': "Потоки кодировщика (0 = авто):",
+        'segment_length': "Длина сегмента, с (0 = один файл):",
+        'adaptive_quality': "Подстраивать качество под нагрузку",
+        'adaptive_min_fps': "Минимальная частота кадров:",
+        'adaptive_min_scale': "Минимальный размер, % (меньше 100 — только с сегментами):",
         'save': "Сохранить",
         'record': "▷",
         'stop': "□",
@@ -73,6 +114,14 @@ LANGUAGES = {
         'browse': "Buscar",
         'audio_sample_rate': "Tasa de muestreo de audio:",
         'video_resolution': "Resolución de Video (Ancho x Alto):",
+        'capture_region': "Región de captura (X, Y, Ancho, Alto; 0 = pantalla completa):",
+        'video_codec': "Códec de video:",
+        'encoder_preset': "Perfil de codificación:",
+        'encoder_threads': "Hilos del codificador (0 = auto):",
+        'segment_length': "Duración del segmento, s (0 = un archivo):",
+        'adaptive_quality': "Ajustar la calidad a la carga",
+        'adaptive_min_fps': "FPS mínimos:",
+        'adaptive_min_scale': "Tamaño mínimo, % (menos de 100 requiere segmentos):",
         'save': "Guardar",
         'record': "▷",
         'stop': "□",
@@ -88,6 +137,14 @@ LANGUAGES = {
         'browse': "Durchsuchen",
         'audio_sample_rate': "Audio-Abtastrate:",
         'video_resolution': "Videoauflösung (Breite x Höhe):",
+        'capture_region': "Aufnahmebereich (X, Y, Breite, Höhe; 0 = ganzer Bildschirm):",
+        'video_codec': "Videocodec:",
+        'encoder_preset': "Encoder-Profil:",
+        'encoder_threads': "Encoder-Threads (0 = automatisch):",
+        'segment_length': "Segmentlänge, s (0 = eine Datei):",
+        'adaptive_quality': "Qualität an die Last anpassen",
+        'adaptive_min_fps': "Minimale FPS:",
+        'adaptive_min_scale': "Minimale Größe, % (unter 100 nur mit Segmenten):",
         'save': "Speichern",
         'record': "▷",
         'stop': "□",
@@ -100,9 +157,13 @@ LANGUAGES = {
 }
 
 class SettingsDialog(QtWidgets.QDialog):
-    def __init__(self, language):
+    def __init__(self, language, video_resolution=DEFAULT_VIDEO_RESOLUTION, capture_region=DEFAULT_CAPTURE_REGION,
+                 encoder=None, segment_seconds=DEFAULT_SEGMENT_SECONDS, audio_fs=DEFAULT_AUDIO_FS,
+                 audio_devices=None, adaptive=(DEFAULT_ADAPTIVE_QUALITY, DEFAULT_ADAPTIVE_MIN_FPS,
+                                               DEFAULT_ADAPTIVE_MIN_SCALE)):
         super().__init__()
         self.language = language
+        self.audio_devices = audio_devices
         self.setWindowTitle(LANGUAGES[self.language]['settings_title'])
         
         self.layout = QtWidgets.QVBoxLayout()
@@ -120,7 +181,12 @@ class SettingsDialog(QtWidgets.QDialog):
         # Качество аудио
         self.audio_fs_label = QtWidgets.QLabel(LANGUAGES[self.language]['audio_sample_rate'])
         self.audio_fs_input = QtWidgets.QSpinBox()
-        self.audio_fs_input.setValue(DEFAULT_AUDIO_FS)
+        self.audio_fs_input.setRange(8000, 192000)
+        self.audio_fs_input.setValue(audio_fs)
+        # Частоты, проверенные для микрофона по умолчанию (из кэша устройств)
+        supported = audio_devices.samplerates() if audio_devices is not None else []
+        if supported:
+            self.audio_fs_input.setToolTip(", ".join(str(rate) for rate in sorted(supported)))
         self.layout.addWidget(self.audio_fs_label)
         self.layout.addWidget(self.audio_fs_input)
 
@@ -128,8 +194,10 @@ class SettingsDialog(QtWidgets.QDialog):
         self.video_res_label = QtWidgets.QLabel(LANGUAGES[self.language]['video_resolution'])
         self.video_width_input = QtWidgets.QSpinBox()
         self.video_height_input = QtWidgets.QSpinBox()
-        self.video_width_input.setValue(DEFAULT_VIDEO_RESOLUTION[0])
-        self.video_height_input.setValue(DEFAULT_VIDEO_RESOLUTION[1])
+        self.video_width_input.setRange(16, 7680)
+        self.video_height_input.setRange(16, 4320)
+        self.video_width_input.setValue(video_resolution[0])
+        self.video_height_input.setValue(video_resolution[1])
         
         width_layout = QtWidgets.QHBoxLayout()
         width_layout.addWidget(self.video_width_input)
@@ -139,6 +207,69 @@ class SettingsDialog(QtWidgets.QDialog):
         self.layout.addWidget(self.video_res_label)
         self.layout.addLayout(width_layout)
 
+        # Область захвата
+        self.region_label = QtWidgets.QLabel(LANGUAGES[self.language]['capture_region'])
+        self.region_inputs = []
+        region_layout = QtWidgets.QHBoxLayout()
+        for value in capture_region:
+            spin_box = QtWidgets.QSpinBox()
+            spin_box.setRange(0, 16384)
+            spin_box.setValue(value)
+            self.region_inputs.append(spin_box)
+            region_layout.addWidget(spin_box)
+
+        self.layout.addWidget(self.region_label)
+        self.layout.addLayout(region_layout)
+
+        # Кодировщик
+        encoder = encoder or EncoderSettings(DEFAULT_VIDEO_CODEC, DEFAULT_ENCODER_PRESET, threads=DEFAULT_ENCODER_THREADS)
+        self.codec_label = QtWidgets.QLabel(LANGUAGES[self.language]['video_codec'])
+        self.codec_combobox = QtWidgets.QComboBox()
+        for name, codec in CODECS.items():
+            self.codec_combobox.addItem(codec.label, name)
+        self.codec_combobox.setCurrentIndex(self.codec_combobox.findData(encoder.codec.name))
+        self.preset_label = QtWidgets.QLabel(LANGUAGES[self.language]['encoder_preset'])
+        self.preset_combobox = QtWidgets.QComboBox()
+        self.preset_combobox.addItems(PRESETS)
+        self.preset_combobox.setCurrentText(encoder.preset)
+        self.threads_label = QtWidgets.QLabel(LANGUAGES[self.language]['encoder_threads'])
+        self.threads_input = QtWidgets.QSpinBox()
+        self.threads_input.setRange(0, 64)
+        self.threads_input.setValue(encoder.threads)
+
+        self.layout.addWidget(self.codec_label)
+        self.layout.addWidget(self.codec_combobox)
+        self.layout.addWidget(self.preset_label)
+        self.layout.addWidget(self.preset_combobox)
+        self.layout.addWidget(self.threads_label)
+        self.layout.addWidget(self.threads_input)
+
+        # Сегменты
+        self.segment_label = QtWidgets.QLabel(LANGUAGES[self.language]['segment_length'])
+        self.segment_input = QtWidgets.QSpinBox()
+        self.segment_input.setRange(0, 24 * 3600)
+        self.segment_input.setValue(segment_seconds)
+        self.layout.addWidget(self.segment_label)
+        self.layout.addWidget(self.segment_input)
+
+        # Адаптивное качество: пределы, ниже которых запись не опускается
+        adaptive_enabled, min_fps, min_scale = adaptive
+        self.adaptive_checkbox = QtWidgets.QCheckBox(LANGUAGES[self.language]['adaptive_quality'])
+        self.adaptive_checkbox.setChecked(adaptive_enabled)
+        self.min_fps_label = QtWidgets.QLabel(LANGUAGES[self.language]['adaptive_min_fps'])
+        self.min_fps_input = QtWidgets.QDoubleSpinBox()
+        self.min_fps_input.setRange(1.0, DEFAULT_VIDEO_FPS)
+        self.min_fps_input.setValue(min_fps)
+        self.min_scale_label = QtWidgets.QLabel(LANGUAGES[self.language]['adaptive_min_scale'])
+        self.min_scale_input = QtWidgets.QSpinBox()
+        self.min_scale_input.setRange(10, 100)
+        self.min_scale_input.setValue(min_scale)
+        self.layout.addWidget(self.adaptive_checkbox)
+        self.layout.addWidget(self.min_fps_label)
+        self.layout.addWidget(self.min_fps_input)
+        self.layout.addWidget(self.min_scale_label)
+        self.layout.addWidget(self.min_scale_input)
+
         # Язык
         self.language_label = QtWidgets.QLabel("Language:")
         self.language_combobox = QtWidgets.QComboBox()
@@ -162,31 +293,22 @@ class SettingsDialog(QtWidgets.QDialog):
 
     def get_settings(self):
         return {
-            'audio_fs': self.audio_fs_input.value(),
+            'audio_fs': self.valid_sample_rate(self.audio_fs_input.value()),
             'video_resolution': (self.video_width_input.value(), self.video_height_input.value()),
+            'capture_region': tuple(spin_box.value() for spin_box in self.region_inputs),
+            'encoder': EncoderSettings(self.codec_combobox.currentData(), self.preset_combobox.currentText(),
+                                       threads=self.threads_input.value()),
+            'segment_seconds': self.segment_input.value(),
+            'adaptive': (self.adaptive_checkbox.isChecked(), self.min_fps_input.value(),
+                         self.min_scale_input.value()),
             'output_dir': self.output_dir_input.text(),
             'language': self.language_combobox.currentText()
         }
-    def get_valid_sample_rate(self):
-        devices = sd.query_devices()
-        valid_sample_rates = []
-        for device in devices:
-            if device['max_input_channels'] > 0:  # Only input devices
-                valid_sample_rates.append(device['default_samplerate'])
-
-        # Choose the first valid sample rate
-        if valid_sample_rates:
-            print(f"Available sample rates: {valid_sample_rates}")
-            # Check if DEFAULT_AUDIO_FS is in valid sample rates
-            if DEFAULT_AUDIO_FS in valid_sample_rates:
-                return DEFAULT_AUDIO_FS
-            # If not, return FALLBACK_AUDIO_FS if it is valid
-            elif FALLBACK_AUDIO_FS in valid_sample_rates:
-                return FALLBACK_AUDIO_FS
-            else:
-                return int(valid_sample_rates[0])  # Use the first available
-        print("No valid sample rate found, defaulting to fall back.")
-        return FALLBACK_AUDIO_FS  # Default to FALLBACK_AUDIO_FS if not found
+    def valid_sample_rate(self, samplerate):
+        # Частота, которую устройство не открывает, заменяется ближайшей проверенной
+        if self.audio_devices is None:
+            return samplerate
+        return self.audio_devices.best_samplerate(samplerate) or samplerate
 
     def update_language(self):
         self.language = self.language_combobox.currentText()
@@ -194,6 +316,14 @@ class SettingsDialog(QtWidgets.QDialog):
         self.output_dir_label.setText(LANGUAGES[self.language]['output_directory'])
         self.audio_fs_label.setText(LANGUAGES[self.language]['audio_sample_rate'])
         self.video_res_label.setText(LANGUAGES[self.language]['video_resolution'])
+        self.region_label.setText(LANGUAGES[self.language]['capture_region'])
+        self.codec_label.setText(LANGUAGES[self.language]['video_codec'])
+        self.preset_label.setText(LANGUAGES[self.language]['encoder_preset'])
+        self.threads_label.setText(LANGUAGES[self.language]['encoder_threads'])
+        self.segment_label.setText(LANGUAGES[self.language]['segment_length'])
+        self.adaptive_checkbox.setText(LANGUAGES[self.language]['adaptive_quality'])
+        self.min_fps_label.setText(LANGUAGES[self.language]['adaptive_min_fps'])
+        self.min_scale_label.setText(LANGUAGES[self.language]['adaptive_min_scale'])
         self.save_button.setText(LANGUAGES[self.language]['save'])
         self.browse_button.setText(LANGUAGES[self.language]['browse'])
         self.language_label.setText("Language:")
@@ -228,51 +358,45 @@ class CountdownWidget(QtWidgets.QWidget):
             QtCore.QCoreApplication.processEvents()
             QtCore.QThread.sleep(1)
         self.hide()  # Hide the countdown after completion
-class AudioThread(QtCore.QThread):
-    audio_recorded = QtCore.pyqtSignal(np.ndarray)
-
-    def __init__(self, sampling_rate):
-        super().__init__()
-        self.sampling_rate = sampling_rate
-        self.recording = True
-
-    def run(self):
-        while self.recording:
-            try:
-                audio_data = sd.rec(int(self.sampling_rate), samplerate=self.sampling_rate, channels=1, dtype='int16')
-                sd.wait()  # Ждем завершения записи
-                self.audio_recorded.emit(audio_data)
-            except Exception as e:
-                print(f"Ошибка записи аудио: {e}")
-                self.recording = False
-
-    def stop_recording(self):
-        self.recording = False
-class VideoThread(QtCore.QThread):
-    def run(self):
-        # Код для записи видео
-        pass
-
 class RecorderApp(QtWidgets.QWidget):
+    devices_ready = QtCore.pyqtSignal()
+    replay_saved = QtCore.pyqtSignal(str, str)
+    post_progress = QtCore.pyqtSignal(int, str, str, float)
+    post_done = QtCore.pyqtSignal(int, str, str, str, str)
+
     def __init__(self):
         super().__init__()
 
         self.recording_video = False
         self.recording_audio = False
         self.is_paused = False
+        self.replaying = False
         self.audio_buffer = []
-        self.audio_thread = None
+        self.session = None
+        self.metrics_exporter = None
+        self.last_captured = 0
+        self.post_processor = None
+        self.post_jobs = {}  # id задачи -> доля выполнения
+        self.post_failed = 0  # Задачи с ошибкой или отменённые
         self.countdown_widget = CountdownWidget()  # Initialize the countdown widget
         self.audio_fs = DEFAULT_AUDIO_FS  # Ensure this is a supported sample rate
         # Default settings
         self.audio_fs = DEFAULT_AUDIO_FS
         self.video_resolution = DEFAULT_VIDEO_RESOLUTION
+        self.capture_region = DEFAULT_CAPTURE_REGION
         self.output_dir = DEFAULT_OUTPUT_DIR
         self.language = 'en'  # Default language
-        self.video_filename = os.path.join(self.output_dir, "Recording.mp4")      
-        self.video_filename = os.path.join(self.output_dir, "Recording.avi")
-        self.audio_filename = os.path.join(self.output_dir, "Recording.wav")
-        self.find_valid_sample_rate()
+        self.encoder = EncoderSettings(DEFAULT_VIDEO_CODEC, DEFAULT_ENCODER_PRESET, threads=DEFAULT_ENCODER_THREADS)
+        self.segment_seconds = DEFAULT_SEGMENT_SECONDS
+        self.adaptive = (DEFAULT_ADAPTIVE_QUALITY, DEFAULT_ADAPTIVE_MIN_FPS, DEFAULT_ADAPTIVE_MIN_SCALE)
+        self.session_base = None
+        # Возможности микрофона сразу берутся из кэша, а проверка устройств идёт
+        # в фоновом потоке и не задерживает запуск
+        self.audio_devices = AudioDeviceService()
+        self.apply_audio_devices()
+        self.devices_ready.connect(self.apply_audio_devices)
+        self.audio_devices.start(self.devices_ready.emit)
+        self.recover_sessions()
         self.setWindowFlags(QtCore.Qt.WindowStaysOnTopHint | QtCore.Qt.FramelessWindowHint)
         self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
         self.setGeometry(100, 100, 200, 50)
@@ -289,20 +413,80 @@ class RecorderApp(QtWidgets.QWidget):
         """)
 
         self.show()
-    def find_valid_sample_rate(self):
-        devices = sd.query_devices()
-        valid_sample_rates = []
-        
-        # Собираем поддерживаемые частоты дискретизации
-        for device in devices:
-            if device['max_input_channels'] > 0:  # Только входные устройства
-                valid_sample_rates.append(device['default_samplerate'])
-
-        # Выбираем первую допустимую частоту дискретизации
-        if valid_sample_rates:
-            self.audio_fs = int(valid_sample_rates[0])  # Используем первую доступную
+    def apply_audio_devices(self):
+        # Вызывается в потоке интерфейса: при запуске и после фоновой проверки устройств
+        samplerate = self.audio_devices.best_samplerate(self.audio_fs)
+        if samplerate is not None and samplerate != self.audio_fs:
+            self.audio_fs = samplerate
             print(f"Используемая частота дискретизации: {self.audio_fs}")
 
+    def new_session(self, replay_seconds=0):
+        # Каждая запись получает своё имя, прошлые файлы не перезаписываются.
+        # Контейнер подбирается под кодек (.mp4, .avi или .mkv)
+        name = "Replay_%Y%m%d_%H%M%S" if replay_seconds else "Recording_%Y%m%d_%H%M%S"
+        self.session_base = os.path.join(self.output_dir, time.strftime(name))
+        return RecordingSession(self.session_base, self.encoder,
+                                region=self.capture_region,
+                                size=self.video_resolution,
+                                fps=DEFAULT_VIDEO_FPS,
+                                backend=DEFAULT_CAPTURE_BACKEND,
+                                engine=DEFAULT_ENGINE,
+                                live_mux=DEFAULT_LIVE_MUX,
+                                pixel_format=DEFAULT_PIXEL_FORMAT,
+                                spool_bytes=DEFAULT_SPOOL_MEGABYTES * 1024 * 1024,
+                                spool_dir=DEFAULT_SPOOL_DIR,
+                                samplerate=self.audio_fs,
+                                audio_blocksize=DEFAULT_AUDIO_BLOCKSIZE,
+                                audio_latency=DEFAULT_AUDIO_LATENCY,
+                                audio_buffer_seconds=DEFAULT_AUDIO_BUFFER_SECONDS,
+                                audio_sources=DEFAULT_EXTRA_AUDIO_DEVICES,
+                                audio_tracks=DEFAULT_AUDIO_TRACKS,
+                                preview_port=DEFAULT_PREVIEW_PORT,
+                                preview_fps=DEFAULT_PREVIEW_FPS,
+                                preview_width=DEFAULT_PREVIEW_WIDTH,
+                                queue_size=DEFAULT_FRAME_QUEUE_SIZE,
+                                policy=DEFAULT_BACKPRESSURE,
+                                vfr=DEFAULT_VARIABLE_FRAME_RATE,
+                                change_tile=DEFAULT_CHANGE_TILE,
+                                segment_seconds=self.segment_seconds,
+                                segment_bytes=DEFAULT_SEGMENT_MEGABYTES * 1024 * 1024,
+                                outputs=[OutputSpec(*output) for output in DEFAULT_EXTRA_OUTPUTS],
+                                replay_seconds=replay_seconds,
+                                replay_max_bytes=DEFAULT_REPLAY_MAX_MEGABYTES * 1024 * 1024,
+                                adaptive=self.adaptive[0],
+                                min_fps=self.adaptive[1],
+                                min_scale=self.adaptive[2] / 100.0)
+
+    def recover_sessions(self):
+        # Сессии без записи 'end' в манифесте оборвались (сбой, kill): уцелевшие
+        # сегменты склеиваются в один файл без перекодирования. В фоновом потоке,
+        # чтобы ffmpeg не задерживал запуск
+        threading.Thread(target=self._recover_sessions, name="greenrecord-recover", daemon=True).start()
+
+    def _recover_sessions(self):
+        if not os.path.isdir(self.output_dir):
+            return
+        for name in os.listdir(self.output_dir):
+            if not name.endswith(".manifest.jsonl"):
+                continue
+            path = os.path.join(self.output_dir, name)
+            try:
+                # Недавно изменённый или занятый манифест принадлежит идущей
+                # записи (второй экземпляр, serve)
+                if time.time() - os.path.getmtime(path) < DEFAULT_RECOVERY_IDLE_SECONDS \
+                        or ManifestLock(path).in_use():
+                    continue
+                if any(event.get('event') in ('end', 'recovered') for event in read_manifest(path)):
+                    continue
+                output = None
+                if find_ffmpeg():
+                    output = path[:-len(".manifest.jsonl")] + "_recovered" + SEGMENT_CONTAINER
+                segments = recover_session(path, output)
+                if segments:
+                    print(f"Восстановлено сегментов: {len(segments)} ({output or path})")
+            except Exception as e:
+                print(f"Ошибка восстановления записи {name}: {e}")
+
     def init_ui(self):
         layout = QtWidgets.QHBoxLayout()
 
@@ -323,83 +507,268 @@ class RecorderApp(QtWidgets.QWidget):
         self.pause_button.setEnabled(False)
         layout.addWidget(self.pause_button)
 
+        # Повтор: последние DEFAULT_REPLAY_SECONDS секунд в памяти, сохраняются кнопкой или клавишами
+        self.replay_button = QtWidgets.QPushButton("⟲")
+        self.replay_button.setStyleSheet("font-size: 20px; color: #6ebf73;")
+        self.replay_button.clicked.connect(self.toggle_replay)
+        layout.addWidget(self.replay_button)
+
+        self.save_replay_button = QtWidgets.QPushButton("💾")
+        self.save_replay_button.setStyleSheet("font-size: 20px; color: #6ebf73;")
+        self.save_replay_button.clicked.connect(self.save_replay)
+        self.save_replay_button.setEnabled(False)
+        self.save_replay_button.setToolTip(DEFAULT_REPLAY_HOTKEY)
+        layout.addWidget(self.save_replay_button)
+        self.replay_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence(DEFAULT_REPLAY_HOTKEY), self)
+        self.replay_shortcut.setContext(QtCore.Qt.ApplicationShortcut)
+        self.replay_shortcut.activated.connect(self.save_replay)
+        self.replay_saved.connect(self.show_replay_saved)
+
         self.settings_button = QtWidgets.QPushButton("⚙️")
         self.settings_button.clicked.connect(self.open_settings)
         layout.addWidget(self.settings_button)
 
+        # Живая статистика: кадры/с, время этапов, очередь и потери
+        self.stats_label = QtWidgets.QLabel("")
+        self.stats_label.setStyleSheet("font-size: 10px; color: #6ebf73; border: none; padding: 0px;")
+        self.stats_label.setVisible(False)
+        layout.addWidget(self.stats_label)
+        self.stats_timer = QtCore.QTimer(self)
+        self.stats_timer.setInterval(500)
+        self.stats_timer.timeout.connect(self.update_stats)
+
+        # Ход обработки после остановки (индекс, миниатюры, копия для отправки)
+        self.post_label = QtWidgets.QLabel("")
+        self.post_label.setStyleSheet("font-size: 10px; color: #6ebf73; border: none; padding: 0px;")
+        self.post_label.setVisible(False)
+        layout.addWidget(self.post_label)
+        self.post_progress.connect(self.update_post_progress)
+        self.post_done.connect(self.post_job_done)
+
         self.setLayout(layout)
 
     def open_settings(self):
-        settings_dialog = SettingsDialog(self.language)
+        settings_dialog = SettingsDialog(self.language, self.video_resolution, self.capture_region, self.encoder,
+                                         self.segment_seconds, self.audio_fs, self.audio_devices, self.adaptive)
         if settings_dialog.exec_():
             settings = settings_dialog.get_settings()
             self.audio_fs = settings['audio_fs']
             self.video_resolution = settings['video_resolution']
+            self.capture_region = settings['capture_region']
             self.output_dir = settings['output_dir']
             self.language = settings['language']  # Save selected language
-            self.video_filename = os.path.join(self.output_dir, "Recording.avi")
-            self.audio_filename = os.path.join(self.output_dir, "Recording.wav")
+            self.encoder = settings['encoder']
+            self.segment_seconds = settings['segment_seconds']
+            self.adaptive = settings['adaptive']
 
     def countdown(self):
         self.countdown_widget.start_countdown()  # Start the countdown in the widget
 
     def start_recording_indicators(self):
         self.countdown()  # Call the countdown function
-    def handle_audio_recorded(self, audio_data):
-        # Обработка записанных данных
-        print("Audio data recorded.")
     def record_video(self):
-        codec = cv2.VideoWriter_fourcc(*"mp4v")  # Use mp4v codec for mp4 videos
-        out = cv2.VideoWriter(self.video_filename, codec, 20.0, self.video_resolution)
-
-        while self.recording_video:
-            if self.is_paused:
-                continue
-            img = pyautogui.screenshot()
-            frame = np.array(img)
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            out.write(frame)
-            cv2.waitKey(1)
-        out.release()
+        # Capture and encoding run on the engine's worker threads (or
+        # processes), so this returns immediately and the toolbar stays responsive
+        self.session = self.new_session()
+        try:
+            self.session.start()
+        except Exception as e:
+            print(f"Ошибка записи видео: {e}")
+            self.session = None
+            return False
+        return True
 
     def toggle_recording(self):
         if not self.recording_video and not self.recording_audio:
             self.recording_video = True
             self.recording_audio = True
             self.record_button.setEnabled(False)
+            self.replay_button.setEnabled(False)
             self.stop_button.setEnabled(True)
             self.pause_button.setEnabled(True)
 
-            # Запускаем запись в новом потоке
-            self.audio_thread = AudioThread(self.audio_fs)
-            self.audio_thread.start()
-
-            # Подключаем сигнал для обработки аудиозаписи
-            self.audio_thread.audio_recorded.connect(self.handle_audio_recorded)
-
             # Начинаем запись видео
-            self.record_video()
+            if self.record_video():
+                self.start_metrics()
+            else:
+                self.stop_recording()
         else:
             self.stop_recording()
 
+    def toggle_replay(self):
+        if self.replaying:
+            self.replaying = False
+            if self.session is not None:
+                self.session.stop()
+            self.session = None
+            self.stop_metrics()
+            self.replay_button.setText("⟲")
+            self.record_button.setEnabled(True)
+            self.save_replay_button.setEnabled(False)
+            return
+        self.session = self.new_session(DEFAULT_REPLAY_SECONDS)
+        try:
+            self.session.start()
+        except Exception as e:
+            print(f"Ошибка записи видео: {e}")
+            self.session = None
+            return
+        self.replaying = True
+        self.replay_button.setText("□")
+        self.record_button.setEnabled(False)
+        self.save_replay_button.setEnabled(True)
+        self.start_metrics()
+
+    def save_replay(self):
+        # Файл пишется в фоне, захват не прерывается
+        if not self.replaying or self.session is None:
+            return
+        self.session.save_replay(on_done=lambda path, error: self.replay_saved.emit(path or "", str(error or "")))
+
+    def show_replay_saved(self, path, error):
+        # Без модального окна: запись повтора продолжается
+        if error:
+            self.save_replay_button.setText("⚠️")
+        else:
+            print(f"Повтор сохранён: {path}")
+            self.save_replay_button.setText("✔")
+        QtCore.QTimer.singleShot(1500, lambda: self.save_replay_button.setText("💾"))
+
+    def start_metrics(self):
+        self.last_captured = 0
+        if DEFAULT_SHOW_STATS:
+            self.stats_label.setVisible(True)
+            self.stats_timer.start()
+        if DEFAULT_METRICS_FILE:
+            from greenrecord.metrics import MetricsExporter
+            self.metrics_exporter = MetricsExporter(self.session.metrics, DEFAULT_METRICS_FILE, DEFAULT_METRICS_FORMAT,
+                                                    DEFAULT_METRICS_INTERVAL)
+            self.metrics_exporter.start()
+
+    def stop_metrics(self):
+        self.stats_timer.stop()
+        self.stats_label.setVisible(False)
+        self.adjustSize()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()  # Последний снимок — с итогами записи
+            self.metrics_exporter = None
+
+    def update_stats(self):
+        if self.session is None:
+            return
+        metrics = self.session.metrics
+        counters = metrics.counters()
+        captured = counters.get('captured', 0)
+        fps = (captured - self.last_captured) * 1000.0 / self.stats_timer.interval()
+        self.last_captured = captured
+        parts = [f"{fps:.0f} fps"]
+        for stage, label in (('grab', "grab"), ('convert', "conv"), ('encode', "enc")):
+            snapshot = metrics.stages[stage].snapshot() if stage in metrics.stages else {}
+            if snapshot.get('count'):
+                parts.append(f"{label} {snapshot['p90_ms']:.1f}ms")
+        if counters.get('queue_depth') is not None:
+            parts.append(f"q {counters['queue_depth']}")
+        if counters.get('spool_depth'):
+            parts.append(f"spool {counters['spool_depth']}")
+        parts.append(f"drop {counters.get('dropped', 0) + counters.get('skipped', 0)}")
+        if counters.get('audio_overruns') or counters.get('audio_overflows'):
+            parts.append(f"audio lost {counters.get('audio_overruns', 0) + counters.get('audio_overflows', 0)}")
+        self.stats_label.setText(" · ".join(parts))
+
     def stop_recording(self):
         self.recording_video = False
         self.recording_audio = False
         self.record_button.setEnabled(True)
+        self.replay_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         self.pause_button.setEnabled(False)
 
-        # Остановить аудиопоток
-        if self.audio_thread is not None:
-            self.audio_thread.stop_recording()  # Останавливаем запись
-            self.audio_thread.quit()
-            self.audio_thread.wait()  # Ждем завершения потока
-            
-            # Show message box for stopped recording
-        self.show_message("Recording Stopped")
+        # Остановить запись: сначала аудио (буфер дописывается до конца), затем видео
+        if self.session is not None:
+            stats = self.session.stop()
+            if 'audio_frames' in stats:
+                print(f"Audio: {stats['audio_frames']} frames, {stats['audio_overflows']} overflows, "
+                      f"{stats['audio_underflows']} underflows, {stats['audio_overruns']} frames lost")
+            for device in range(1, len(DEFAULT_EXTRA_AUDIO_DEVICES) + 1):
+                if f'audio_{device}_drift_ppm' in stats:
+                    print(f"Audio source {device}: clock drift {stats[f'audio_{device}_drift_ppm']:+.0f} ppm, "
+                          f"{stats[f'audio_{device}_underruns']} frames of silence")
+            print(f"Video frames: {stats['encoded']} encoded, {stats['dropped']} dropped, {stats['late']} late, "
+                  f"{stats['duplicated']} duplicated, {stats['skipped']} skipped")
+            print(f"A/V drift: {stats['av_drift'] * 1000:.1f} ms")
+            if stats.get('spooled'):
+                print(f"Spooled frames: {stats['spooled']}, peak {stats['spool_high_water']} frames "
+                      f"({stats['spool_high_water_bytes'] / 1048576:.0f} MB), spool full {stats['spool_full']} times")
+            if stats['dirty_mean'] is not None:
+                print(f"Unchanged frames skipped: {stats['unchanged']}, mean dirty ratio: {stats['dirty_mean']:.2%}")
+            self.post_process(self.session)
+        self.stop_metrics()
+        self.session = None
+        self.is_paused = False
+        self.pause_button.setText("⏸️")
+
+    def post_process(self, session):
+        # Задачи идут в пуле процессов; ход виден в панели, без модальных окон
+        if not DEFAULT_POST_JOBS:
+            return
+        from greenrecord.postprocess import PostProcessor
+        if self.post_processor is None:
+            self.post_processor = PostProcessor(
+                DEFAULT_POST_WORKERS, on_progress=self.post_progress.emit,
+                on_done=lambda job_id, job, video, output, error: self.post_done.emit(job_id, job, video, output,
+                                                                                     str(error or "")))
+        for video in session.recorded_files():
+            options = {'share': {'height': DEFAULT_SHARE_HEIGHT}}
+            if video == session.video_filename and os.path.exists(session.audio_filename):
+                options['share']['audio'] = session.audio_filename  # Запись через OpenCV: звук в отдельном WAV
+            for job_id in self.post_processor.submit(video, DEFAULT_POST_JOBS, options):
+                self.post_jobs[job_id] = 0.0
+        self.show_post_progress()
+
+    def update_post_progress(self, job_id, job, video, fraction):
+        if job_id in self.post_jobs:
+            self.post_jobs[job_id] = max(self.post_jobs[job_id], fraction)
+        self.show_post_progress()
+
+    def post_job_done(self, job_id, job, video, output, error):
+        if not error:
+            print(f"Готово: {output}")
+        elif job_id in self.post_jobs:
+            self.post_failed += 1
+        if job_id in self.post_jobs:
+            self.post_jobs[job_id] = 1.0
+            self.show_post_progress()
+
+    def show_post_progress(self):
+        if not self.post_jobs:
+            return
+        done = sum(1 for fraction in self.post_jobs.values() if fraction >= 1.0)
+        if done == len(self.post_jobs):
+            if self.post_failed:
+                self.post_label.setText(f"⚙ {done - self.post_failed}/{done} ✖ {self.post_failed}")
+            else:
+                self.post_label.setText(f"⚙ {done}/{done} ✔")
+            self.post_jobs = {}
+            self.post_failed = 0
+            QtCore.QTimer.singleShot(3000, lambda: self.post_jobs or self.post_label.setVisible(False))
+            return
+        overall = sum(self.post_jobs.values()) / len(self.post_jobs)
+        self.post_label.setText(f"⚙ {done}/{len(self.post_jobs)} · {overall:.0%}")
+        self.post_label.setVisible(True)
+
+    def closeEvent(self, event):
+        # Незавершённая обработка отменяется, уже запущенные задачи дорабатывают в фоне
+        if self.post_processor is not None:
+            self.post_processor.shutdown(wait=False, cancel=True)
+        super().closeEvent(event)
 
     def toggle_pause(self):
         self.is_paused = not self.is_paused
+        if self.session is not None:
+            if self.is_paused:
+                self.session.pause()
+            else:
+                self.session.resume()
         self.pause_button.setText("▶️" if self.is_paused else "⏸️")  # Change button text
         
         # Show message box for paused recording
@@ -414,6 +783,11 @@ class RecorderApp(QtWidgets.QWidget):
         msg_box.exec_()  # Show message box until the user closes it
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Для движка на процессах в собранном PyInstaller exe
     app = QtWidgets.QApplication(sys.argv)
     recorder = RecorderApp()
+    if '--startup-check' in sys.argv:
+        # Замер запуска (python -m greenrecord.bench --startup): окно показано — выходим
+        print("GreenRecord ready", flush=True)
+        QtCore.QTimer.singleShot(0, app.quit)
     sys.exit(app.exec_())
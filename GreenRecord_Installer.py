@@ -1,8 +1,23 @@
 import sys
 import os
-import subprocess
+import shutil
+import statistics
+import tempfile
 from PyQt5 import QtWidgets, QtGui, QtCore
 
+# Сборка рекордера
+APP_NAME = "ScreenRecorder"
+DEFAULT_BUILD_MODE = 'onedir'  # 'onedir': a folder that starts fast; 'onefile': one exe, unpacked on every start
+# Pulled in by installed packages, never used by the recorder: left out of the bundle
+EXCLUDED_MODULES = [
+    'moviepy', 'imageio', 'imageio_ffmpeg', 'scipy', 'matplotlib', 'pandas', 'tkinter', 'IPython',
+    'notebook', 'pytest', 'PyQt5.QtWebEngineCore', 'PyQt5.QtWebEngineWidgets', 'PyQt5.QtQml', 'PyQt5.QtQuick',
+    'PyQt5.QtMultimedia', 'PyQt5.QtSql', 'PyQt5.QtBluetooth', 'PyQt5.QtDesigner',
+]
+STARTUP_RUNS = 3  # Launches of the built recorder; the first one is the cold start
+STARTUP_TIMEOUT_MS = 30000
+STARTUP_TARGET_SECONDS = 1.5  # As STARTUP_TARGETS['gui'] in greenrecord/bench.py
+
 # Объявите LANGUAGES с поддерживаемыми языками и ключами
 LANGUAGES = {
     'ru': {
@@ -12,6 +27,17 @@ LANGUAGES = {
         'welcome_header': 'Добро пожаловать в приложение Рекордера',
         'apply_button': 'Применить',
         'select_install_dir': 'Выберите папку для установки',
+        'build_mode': 'Тип сборки',
+        'onedir': 'Папка (быстрый запуск)',
+        'onefile': 'Один файл',
+        'cancel': 'Отмена',
+        'building': 'Сборка рекордера...',
+        'build_done': 'Рекордер успешно установлен!',
+        'build_failed': 'Произошла ошибка при установке (код {code}), подробности в журнале.',
+        'build_cancelled': 'Сборка отменена.',
+        'measuring': 'Замер запуска рекордера...',
+        'startup_result': 'Холодный запуск: {cold:.2f} с, затем {warm:.2f} с (цель {target:.1f} с)',
+        'startup_failed': 'Не удалось замерить запуск: {error}',
     },
     'en': {
         'documentation': 'Documentation',
@@ -20,6 +46,17 @@ LANGUAGES = {
         'welcome_header': 'Welcome to the Recorder Application',
         'apply_button': 'Apply',
         'select_install_dir': 'Select Installation Folder',
+        'build_mode': 'Build type',
+        'onedir': 'Folder (fast start)',
+        'onefile': 'Single file',
+        'cancel': 'Cancel',
+        'building': 'Building the recorder...',
+        'build_done': 'The recorder was installed successfully!',
+        'build_failed': 'The installation failed (code {code}), see the log for details.',
+        'build_cancelled': 'Build cancelled.',
+        'measuring': 'Measuring recorder startup...',
+        'startup_result': 'Cold start: {cold:.2f} s, then {warm:.2f} s (target {target:.1f} s)',
+        'startup_failed': 'Could not measure startup: {error}',
     },
     'es': {
         'documentation': 'Documentación',
@@ -28,6 +65,17 @@ LANGUAGES = {
         'welcome_header': 'Bienvenido a la Aplicación Grabadora',
         'apply_button': 'Aplicar',
         'select_install_dir': 'Seleccione la carpeta de instalación',
+        'build_mode': 'Tipo de compilación',
+        'onedir': 'Carpeta (inicio rápido)',
+        'onefile': 'Un solo archivo',
+        'cancel': 'Cancelar',
+        'building': 'Compilando el grabador...',
+        'build_done': '¡El grabador se instaló correctamente!',
+        'build_failed': 'La instalación falló (código {code}), consulte el registro.',
+        'build_cancelled': 'Compilación cancelada.',
+        'measuring': 'Midiendo el arranque del grabador...',
+        'startup_result': 'Arranque en frío: {cold:.2f} s, luego {warm:.2f} s (objetivo {target:.1f} s)',
+        'startup_failed': 'No se pudo medir el arranque: {error}',
     },
     'de': {
         'documentation': 'Dokumentation',
@@ -36,6 +84,17 @@ LANGUAGES = {
         'welcome_header': 'Willkommen bei der Recorder-Anwendung',
         'apply_button': 'Anwenden',
         'select_install_dir': 'Installationsordner auswählen',
+        'build_mode': 'Build-Typ',
+        'onedir': 'Ordner (schneller Start)',
+        'onefile': 'Einzelne Datei',
+        'cancel': 'Abbrechen',
+        'building': 'Recorder wird gebaut...',
+        'build_done': 'Der Recorder wurde erfolgreich installiert!',
+        'build_failed': 'Die Installation ist fehlgeschlagen (Code {code}), Details im Protokoll.',
+        'build_cancelled': 'Build abgebrochen.',
+        'measuring': 'Startzeit des Recorders wird gemessen...',
+        'startup_result': 'Kaltstart: {cold:.2f} s, danach {warm:.2f} s (Ziel {target:.1f} s)',
+        'startup_failed': 'Startzeit konnte nicht gemessen werden: {error}',
     },
 }
 
@@ -94,11 +153,49 @@ class MainApp(QtWidgets.QWidget):
         self.support_button.clicked.connect(self.support_author)
         layout.addWidget(self.support_button)
 
+        # Build type: a folder starts faster, a single file is easier to copy around
+        build_row = QtWidgets.QHBoxLayout()
+        self.build_mode_label = QtWidgets.QLabel(LANGUAGES[self.language]['build_mode'])
+        self.build_mode_label.setStyleSheet("color: #FFFFFF;")
+        self.build_mode_combo = QtWidgets.QComboBox()
+        for mode in ('onedir', 'onefile'):
+            self.build_mode_combo.addItem(LANGUAGES[self.language][mode], mode)
+        self.build_mode_combo.setCurrentIndex(self.build_mode_combo.findData(DEFAULT_BUILD_MODE))
+        build_row.addWidget(self.build_mode_label)
+        build_row.addWidget(self.build_mode_combo, 1)
+        layout.addLayout(build_row)
+
         # Install Button
         self.install_button = QtWidgets.QPushButton(LANGUAGES[self.language]['install_recorder'])
         self.install_button.clicked.connect(self.install_recorder)
         layout.addWidget(self.install_button)
 
+        # Build progress: PyInstaller runs in the background, its output is streamed here
+        progress_row = QtWidgets.QHBoxLayout()
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 0)  # Busy indicator: PyInstaller does not report progress
+        self.progress_bar.setVisible(False)
+        self.cancel_button = QtWidgets.QPushButton(LANGUAGES[self.language]['cancel'])
+        self.cancel_button.clicked.connect(self.cancel_build)
+        self.cancel_button.setVisible(False)
+        progress_row.addWidget(self.progress_bar, 1)
+        progress_row.addWidget(self.cancel_button)
+        layout.addLayout(progress_row)
+        self.build_log = QtWidgets.QPlainTextEdit()
+        self.build_log.setReadOnly(True)
+        self.build_log.setMaximumBlockCount(5000)
+        self.build_log.setStyleSheet("background-color: rgba(255, 255, 255, 200); border-radius: 10px;")
+        self.build_log.setVisible(False)
+        layout.addWidget(self.build_log)
+
+        self.build_process = None
+        self.startup_process = None
+        self.build_dir = None
+        self.work_dir = None
+        self.executable = None
+        self.startup_times = []
+        self.startup_timer = QtCore.QElapsedTimer()
+
         # Documentation area
         self.documentation_area = QtWidgets.QTextEdit()
         self.documentation_area.setReadOnly(True)
@@ -189,19 +286,152 @@ class MainApp(QtWidgets.QWidget):
     def support_author(self):
         QtWidgets.QMessageBox.information(self, LANGUAGES[self.language]['support_author'], "Спасибо за вашу поддержку!")
 
+    @staticmethod
+    def build_command(install_dir, work_dir, mode):
+        # onedir: nothing is unpacked at start, the libraries load straight from the folder.
+        # -O: the bundle gets optimised bytecode, compiled once here (PyInstaller stores only
+        # .pyc), so nothing is compiled at start; --noupx: compressed DLLs load slower
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        command = [sys.executable, "-O", "-m", "PyInstaller", "--noconfirm", f"--{mode}",
+                   "--windowed", "--noupx",
+                   f"--name={APP_NAME}",
+                   "--distpath", install_dir, "--workpath", work_dir, "--specpath", work_dir,
+                   "--paths", script_dir]
+        for module in EXCLUDED_MODULES:
+            command += ["--exclude-module", module]
+        command.append(os.path.join(script_dir, "GreenRecord.py"))
+        return command
+
     def install_recorder(self):
         # Open a dialog to select the installation directory
         install_dir = QtWidgets.QFileDialog.getExistingDirectory(self, LANGUAGES[self.language]['select_install_dir'], "")
-        if install_dir:
-            command = [sys.executable, "-m", "PyInstaller", "--onefile", 
-                       "--windowed", "--noconsole", 
-                       f"--name=ScreenRecorder", 
-                       "--distpath", install_dir, "GreenRecord.py"]
-            try:
-                result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                QtWidgets.QMessageBox.information(self, "Успех", "Рекордер успешно установлен!")
-            except subprocess.CalledProcessError as e:
-                QtWidgets.QMessageBox.critical(self, "Ошибка", f"Произошла ошибка при установке:\n{e.stderr.decode()}")
+        if not install_dir or self.build_process is not None:
+            return
+        mode = self.build_mode_combo.currentData()
+        self.work_dir = tempfile.mkdtemp(prefix="greenrecord-build-")
+        name = APP_NAME + (".exe" if sys.platform == 'win32' else "")
+        self.executable = os.path.join(install_dir, APP_NAME, name) if mode == 'onedir' else os.path.join(install_dir, name)
+        command = self.build_command(install_dir, self.work_dir, mode)
+
+        # Сборка идёт в фоне: окно не замирает, журнал выводится по мере работы
+        self.build_log.clear()
+        self.build_log.appendPlainText(LANGUAGES[self.language]['building'])
+        self.build_log.appendPlainText(" ".join(command))
+        self.set_building(True)
+        self.build_process = QtCore.QProcess(self)
+        self.build_process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
+        self.build_process.setWorkingDirectory(os.path.dirname(os.path.abspath(__file__)))
+        self.build_process.readyReadStandardOutput.connect(self.read_build_output)
+        self.build_process.finished.connect(self.build_finished)
+        self.build_process.errorOccurred.connect(self.build_error)
+        self.build_process.start(command[0], command[1:])
+
+    def set_building(self, building):
+        self.install_button.setEnabled(not building)
+        self.build_mode_combo.setEnabled(not building)
+        self.progress_bar.setVisible(building)
+        self.cancel_button.setVisible(building)
+        if building:
+            self.build_log.setVisible(True)
+            self.documentation_area.setVisible(False)
+
+    def read_build_output(self):
+        text = bytes(self.build_process.readAllStandardOutput()).decode(errors='replace')
+        self.build_log.moveCursor(QtGui.QTextCursor.End)
+        self.build_log.insertPlainText(text)
+        self.build_log.moveCursor(QtGui.QTextCursor.End)
+
+    def cancel_build(self):
+        for process in (self.build_process, self.startup_process):
+            if process is not None and process.state() != QtCore.QProcess.NotRunning:
+                process.setProperty("cancelled", True)
+                process.kill()
+
+    def build_error(self, error):
+        # Python or PyInstaller could not be started at all
+        if error == QtCore.QProcess.FailedToStart:
+            self.build_log.appendPlainText(self.build_process.errorString())
+            self.end_build()
+            QtWidgets.QMessageBox.critical(self, "Ошибка", LANGUAGES[self.language]['build_failed'].format(code=-1))
+
+    def build_finished(self, exit_code, exit_status):
+        if self.build_process is None:
+            return
+        self.read_build_output()
+        cancelled = bool(self.build_process.property("cancelled"))
+        self.end_build()
+        if cancelled:
+            self.build_log.appendPlainText(LANGUAGES[self.language]['build_cancelled'])
+        elif exit_status != QtCore.QProcess.NormalExit or exit_code != 0:
+            QtWidgets.QMessageBox.critical(self, "Ошибка", LANGUAGES[self.language]['build_failed'].format(code=exit_code))
+        else:
+            self.build_log.appendPlainText(LANGUAGES[self.language]['build_done'])
+            self.measure_startup()
+
+    def end_build(self):
+        self.build_process.deleteLater()
+        self.build_process = None
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        self.set_building(False)
+
+    def measure_startup(self):
+        # Запуск собранного рекордера с --startup-check: окно показывается и сразу закрывается.
+        # Первый запуск — холодный (библиотеки ещё не в памяти процесса), остальные — для сравнения
+        self.startup_times = []
+        self.build_log.appendPlainText(LANGUAGES[self.language]['measuring'])
+        self.progress_bar.setVisible(True)
+        self.cancel_button.setVisible(True)
+        self.install_button.setEnabled(False)
+        self.start_startup_run()
+
+    def start_startup_run(self):
+        self.startup_process = QtCore.QProcess(self)
+        self.startup_process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
+        self.startup_process.setWorkingDirectory(os.path.dirname(self.executable))
+        self.startup_process.finished.connect(self.startup_finished)
+        self.startup_process.errorOccurred.connect(self.startup_error)
+        process = self.startup_process
+        QtCore.QTimer.singleShot(STARTUP_TIMEOUT_MS, lambda: self.startup_timeout(process))
+        self.startup_timer.start()
+        self.startup_process.start(self.executable, ["--startup-check"])
+
+    def startup_timeout(self, process):
+        # The recorder never got its window up (e.g. no display)
+        if process is self.startup_process and process.state() != QtCore.QProcess.NotRunning:
+            process.kill()
+
+    def startup_finished(self, exit_code, exit_status):
+        elapsed = self.startup_timer.elapsed() / 1000.0
+        process = self.startup_process
+        if process is None:
+            return
+        self.startup_process = None
+        process.deleteLater()
+        if process.property("cancelled"):
+            self.end_startup(LANGUAGES[self.language]['build_cancelled'])
+            return
+        if exit_status != QtCore.QProcess.NormalExit or exit_code != 0:
+            output = bytes(process.readAll()).decode(errors='replace').strip()
+            self.end_startup(LANGUAGES[self.language]['startup_failed'].format(error=output or f"exit code {exit_code}"))
+            return
+        self.startup_times.append(elapsed)
+        if len(self.startup_times) < STARTUP_RUNS:
+            self.start_startup_run()
+            return
+        warm = statistics.median(self.startup_times[1:]) if len(self.startup_times) > 1 else self.startup_times[0]
+        self.end_startup(LANGUAGES[self.language]['startup_result'].format(
+            cold=self.startup_times[0], warm=warm, target=STARTUP_TARGET_SECONDS))
+
+    def startup_error(self, error):
+        if error == QtCore.QProcess.FailedToStart and self.startup_process is not None:
+            process, self.startup_process = self.startup_process, None
+            self.end_startup(LANGUAGES[self.language]['startup_failed'].format(error=process.errorString()))
+            process.deleteLater()
+
+    def end_startup(self, message):
+        self.set_building(False)
+        self.build_log.appendPlainText(message)
+        QtWidgets.QMessageBox.information(self, "Успех", LANGUAGES[self.language]['build_done'] + "\n" + message)
 
     def apply_language(self):
         selected_language = self.language_combo.currentText()
@@ -220,6 +450,10 @@ class MainApp(QtWidgets.QWidget):
         self.doc_button.setText(LANGUAGES[self.language]['documentation'])
         self.support_button.setText(LANGUAGES[self.language]['support_author'])
         self.install_button.setText(LANGUAGES[self.language]['install_recorder'])
+        self.build_mode_label.setText(LANGUAGES[self.language]['build_mode'])
+        for index in range(self.build_mode_combo.count()):
+            self.build_mode_combo.setItemText(index, LANGUAGES[self.language][self.build_mode_combo.itemData(index)])
+        self.cancel_button.setText(LANGUAGES[self.language]['cancel'])
         self.documentation_area.setPlainText(self.get_documentation())  # Обновление документации
         self.apply_language_button.setText(LANGUAGES[self.language]['apply_button'])
 
@@ -0,0 +1 @@
+# Recording engine for GreenRecord. Kept free of Qt so it can run without a GUI.
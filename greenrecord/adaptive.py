@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+
+from greenrecord.encoders import PRESETS
+
+# Adaptive quality: a controller thread samples the pipeline about once a
+# second and moves along a ladder of quality levels, one step at a time:
+#
+#   level 0  (scale 1.0,  fps 30, balanced)   <- what the user asked for
+#   level 1  (scale 1.0,  fps 30, fast)
+#   level 2  (scale 1.0,  fps 22.5, fast)
+#   level 3  (scale 0.75, fps 22.5, fast)     ... down to min_fps / min_scale
+#
+# Cheaper presets come first (same picture, more bytes), then frame rate and
+# resolution take turns.
+
+FPS_STEP = 0.75
+SCALE_STEP = 0.75
+
+
+class QualityLevel:
+    __slots__ = ("scale", "fps", "preset")
+
+    def __init__(self, scale, fps, preset):
+        self.scale = scale
+        self.fps = fps
+        self.preset = preset
+
+    def as_dict(self):
+        return {'scale': round(self.scale, 3), 'fps': round(self.fps, 3), 'preset': self.preset}
+
+    def __repr__(self):
+        return f"QualityLevel(scale={self.scale:.2f}, fps={self.fps:.2f}, preset={self.preset})"
+
+
+def build_ladder(fps, preset='balanced', min_fps=None, min_scale=1.0, presets=True):
+    # min_fps None keeps the frame rate; min_scale 1.0 keeps the size;
+    # presets=False keeps the encoder preset
+    min_fps = fps if min_fps is None else min(min_fps, fps)
+    min_scale = min(max(min_scale, 0.1), 1.0)
+    level = QualityLevel(1.0, float(fps), preset)
+    ladder = [level]
+    if presets:
+        # PRESETS goes from the cheapest to the smallest file
+        for cheaper in reversed(PRESETS[:PRESETS.index(preset)]):
+            level = QualityLevel(level.scale, level.fps, cheaper)
+            ladder.append(level)
+    step_fps = True
+    while True:
+        next_fps = max(level.fps * FPS_STEP, min_fps)
+        next_scale = max(level.scale * SCALE_STEP, min_scale)
+        can_fps = next_fps < level.fps - 1e-6
+        can_scale = next_scale < level.scale - 1e-6
+        if not can_fps and not can_scale:
+            break
+        if can_fps and (step_fps or not can_scale):
+            level = QualityLevel(level.scale, next_fps, level.preset)
+        else:
+            level = QualityLevel(next_scale, level.fps, level.preset)
+        ladder.append(level)
+        step_fps = not step_fps
+    return ladder
+
+
+def scale_filter(scale):
+    # ffmpeg -vf for a scaled output; yuv420p needs even dimensions
+    return f"scale=trunc(iw*{scale:.4f}/2)*2:trunc(ih*{scale:.4f}/2)*2"
+
+
+class CpuSampler:
+    # Whole-machine CPU use (0..1) since the previous sample. /proc/stat on
+    # Linux, the load average elsewhere on Unix, None where neither exists.
+    def __init__(self):
+        self._last = self._read_proc()
+        self._cores = os.cpu_count() or 1
+
+    @staticmethod
+    def _read_proc():
+        try:
+            with open('/proc/stat') as f:
+                values = [int(value) for value in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        idle = values[3] + (values[4] if len(values) > 4 else 0)  # idle + iowait
+        return sum(values), idle
+
+    def sample(self):
+        if self._last is not None:
+            current = self._read_proc()
+            if current is None:
+                return None
+            total, idle = current[0] - self._last[0], current[1] - self._last[1]
+            self._last = current
+            return 1.0 - idle / total if total > 0 else None
+        try:
+            return min(os.getloadavg()[0] / self._cores, 1.0)
+        except (AttributeError, OSError):
+            return None
+
+
+class AdaptiveController(threading.Thread):
+    # Watches the engine (queue depth, late and dropped frames), the stage
+    # timings in `metrics` and the CPU load. A step down needs down_after
+    # pressured samples in a row, a step up up_after calm ones, and no step
+    # follows another within `cooldown` seconds, so the level does not flap.
+    # apply(level) makes a level take effect; on_change(old, new, reasons)
+    # is called after each step. Both run on the controller thread.
+    def __init__(self, engine, ladder, apply, metrics=None, queue_size=4, interval=1.0, on_change=None,
+                 cpu=None, down_after=2, up_after=10, cooldown=3.0, cpu_high=0.9, cpu_low=0.6):
+        super().__init__(name="greenrecord-adaptive", daemon=True)
+        self.engine = engine
+        self.ladder = ladder
+        self.apply = apply
+        self.metrics = metrics
+        self.queue_size = max(1, queue_size)
+        self.interval = interval
+        self.on_change = on_change
+        self.cpu = cpu or CpuSampler()
+        self.down_after = down_after
+        self.up_after = up_after
+        self.cooldown = cooldown
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.index = 0
+        self.changes = 0
+        self.last_sample = {}
+        self._pressured = 0
+        self._calm = 0
+        self._changed_at = 0.0
+        self._counts = {}
+        self._quit = threading.Event()
+        if metrics is not None:
+            metrics.add_source(self.stats)
+
+    @property
+    def level(self):
+        return self.ladder[self.index]
+
+    def run(self):
+        self._stage_time()  # Only frames from now on count
+        while not self._quit.wait(self.interval):
+            if getattr(self.engine, 'is_paused', False):
+                continue
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Ошибка адаптации качества: {e}")
+
+    def stop(self):
+        self._quit.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def _stage_time(self):
+        # Mean seconds per frame since the last call of the busier thread:
+        # capture (grab + convert) or encoder (detect + encode)
+        if self.metrics is None:
+            return None
+        busiest = None
+        for stages in (('grab', 'convert'), ('detect', 'encode')):
+            spent, frames = 0.0, 0
+            for name in stages:
+                histogram = self.metrics.stages.get(name)
+                if histogram is None:
+                    continue
+                count, total = histogram.count, histogram.total
+                last_count, last_total = self._counts.get(name, (0, 0.0))
+                self._counts[name] = (count, total)
+                spent += total - last_total
+                frames = max(frames, count - last_count)
+            if frames:
+                busiest = max(busiest or 0.0, spent / frames)
+        return busiest
+
+    def sample(self):
+        stats = self.engine.stats()
+        previous = self.last_sample
+        sample = {
+            'queue_fill': (stats.get('queue_depth') or 0) / self.queue_size,
+            'late': stats.get('late', 0),
+            'dropped': stats.get('dropped', 0),
+            'frame_time': self._stage_time(),
+            'cpu': self.cpu.sample(),
+        }
+        sample['new_late'] = sample['late'] - previous.get('late', sample['late'])
+        sample['new_dropped'] = sample['dropped'] - previous.get('dropped', sample['dropped'])
+        self.last_sample = sample
+        return sample
+
+    def pressure(self, sample):
+        # Reasons to step down (empty: none) and whether there is room to step up
+        budget = 1.0 / self.level.fps
+        reasons = []
+        if sample['queue_fill'] > 0.5:
+            reasons.append('queue')
+        if sample['frame_time'] is not None and sample['frame_time'] > 0.9 * budget:
+            reasons.append('frame_time')
+        if sample['new_late'] > 0.05 * self.level.fps * self.interval:  # A late tick now and then is jitter
+            reasons.append('late')
+        if sample['new_dropped'] > 0:
+            reasons.append('dropped')
+        if sample['cpu'] is not None and sample['cpu'] > self.cpu_high:
+            reasons.append('cpu')
+        headroom = (not reasons and sample['queue_fill'] <= 0.25
+                    and (sample['frame_time'] is None or sample['frame_time'] < 0.5 * budget)
+                    and (sample['cpu'] is None or sample['cpu'] < self.cpu_low))
+        return reasons, headroom
+
+    def step(self, now=None):
+        # One control decision; returns the new level index
+        now = time.monotonic() if now is None else now
+        reasons, headroom = self.pressure(self.sample())
+        self._pressured = self._pressured + 1 if reasons else 0
+        self._calm = self._calm + 1 if headroom else 0
+        if now - self._changed_at < self.cooldown:
+            return self.index
+        if self._pressured >= self.down_after and self.index < len(self.ladder) - 1:
+            self._change(self.index + 1, reasons, now)
+        elif self._calm >= self.up_after and self.index > 0:
+            self._change(self.index - 1, ['headroom'], now)
+        return self.index
+
+    def _change(self, index, reasons, now):
+        old = self.level
+        self.index = index
+        self.apply(self.level)
+        self.changes += 1
+        self._changed_at = now
+        self._pressured = self._calm = 0
+        if self.on_change is not None:
+            self.on_change(old, self.level, reasons)
+
+    def stats(self):
+        return {
+            'adapt_level': self.index,
+            'adapt_fps': round(self.level.fps, 3),
+            'adapt_scale': round(self.level.scale, 3),
+            'adapt_changes': self.changes,
+        }
@@ -0,0 +1,217 @@
+import threading
+import time
+import wave
+
+import numpy as np
+
+
+class AudioRingBuffer:
+    # Preallocated single-producer/single-consumer ring. The audio callback
+    # copies each block in; the writer thread copies chunks out. Neither side
+    # allocates, and memory stays fixed however long the recording runs.
+    def __init__(self, frames, channels, dtype=np.int16):
+        self.data = np.zeros((frames, channels), dtype)
+        self.capacity = frames
+        self.overruns = 0  # frames lost because the reader fell behind
+        self._written = 0
+        self._read = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def available(self):
+        with self._cond:
+            return self._written - self._read
+
+    def write(self, block):
+        # Returns how many frames were stored
+        with self._cond:
+            free = self.capacity - (self._written - self._read)
+            count = len(block)
+            if count > free:
+                self.overruns += count - free
+                count = free
+            start = self._written % self.capacity
+            first = min(count, self.capacity - start)
+            self.data[start:start + first] = block[:first]
+            if count > first:
+                self.data[:count - first] = block[first:count]
+            self._written += count
+            self._cond.notify()
+            return count
+
+    def read_into(self, out, timeout=None):
+        # Copies up to len(out) frames into out; 0 means timeout or closed and empty
+        with self._cond:
+            if self._written == self._read and not self._closed:
+                self._cond.wait(timeout)
+            count = min(self._written - self._read, len(out))
+            start = self._read % self.capacity
+            first = min(count, self.capacity - start)
+            out[:first] = self.data[start:start + first]
+            if count > first:
+                out[first:count] = self.data[:count - first]
+            self._read += count
+            return count
+
+    @property
+    def drained(self):
+        with self._cond:
+            return self._closed and self._written == self._read
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class WavFileSink:
+    def __init__(self, filename, samplerate, channels, dtype=np.int16):
+        self.filename = filename
+        self._wav = wave.open(filename, 'wb')
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(np.dtype(dtype).itemsize)
+        self._wav.setframerate(int(samplerate))
+
+    def write(self, block):
+        # writeframes also patches the header, so the file stays readable up
+        # to the last block even if close() is never reached
+        self._wav.writeframes(block)
+
+    def close(self):
+        self._wav.close()
+
+
+class AudioRecorder:
+    # Gapless microphone capture: sounddevice calls back with every block
+    # as soon as it is ready, the block goes into an AudioRingBuffer and a
+    # writer thread hands it to the sink (a WAV file unless another sink,
+    # e.g. FFmpegMuxSink.audio, is given). The sounddevice module can be
+    # swapped for a fake with the same InputStream interface in tests.
+    # pause() stops the device stream and cuts the last block at the pause
+    # moment, so the audio timeline loses exactly the paused span, like the
+    # video one (AVClock.paused_total).
+    def __init__(self, filename, samplerate, channels=1, blocksize=1024, latency='low',
+                 device=None, buffer_seconds=2.0, av_clock=None, sd_module=None, sink=None, metrics=None):
+        if sd_module is None:
+            import sounddevice as sd_module
+        self._sd = sd_module
+        self.filename = filename
+        self.sink = sink
+        self.samplerate = int(samplerate)
+        self.channels = channels
+        self.blocksize = blocksize
+        self.latency = latency
+        self.device = device
+        self.av_clock = av_clock
+        self.dtype = np.int16
+        self.ring = AudioRingBuffer(max(blocksize * 2, int(self.samplerate * buffer_seconds)), channels, self.dtype)
+        self.overflows = 0
+        self.underflows = 0
+        self.frames_captured = 0
+        self.frames_written = 0
+        self.paused_frames = 0  # captured after the pause began, discarded
+        self.error = None
+        self._paused_at = None
+        self._chunk = np.empty((max(blocksize, self.samplerate // 10), channels), self.dtype)
+        self._stream = None
+        self._writer = None
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.add_source(self.stats)
+
+    def _callback(self, indata, frames, time_info, status):
+        started = time.perf_counter()
+        timestamp = time.monotonic() - frames / self.samplerate  # start of the block
+        if status:
+            if status.input_overflow:
+                self.overflows += 1
+            if status.input_underflow:
+                self.underflows += 1
+        paused_at = self._paused_at
+        if paused_at is not None:
+            # Only the part recorded before the pause belongs to the timeline
+            keep = min(frames, max(0, int((paused_at - timestamp) * self.samplerate)))
+            self.paused_frames += frames - keep
+            if not keep:
+                return
+            indata = indata[:keep]
+        stored = self.ring.write(indata)
+        self.frames_captured += stored
+        if self.av_clock is not None:
+            self.av_clock.add_audio(stored, self.samplerate, timestamp)
+        if self.metrics is not None:
+            self.metrics.observe('audio_callback', time.perf_counter() - started)
+
+    def start(self):
+        if self.sink is None:
+            self.sink = WavFileSink(self.filename, self.samplerate, self.channels, self.dtype)
+        self._writer = threading.Thread(target=self._write_loop, name="greenrecord-audio-writer", daemon=True)
+        self._writer.start()
+        try:
+            self._stream = self._sd.InputStream(
+                samplerate=self.samplerate, channels=self.channels, dtype='int16',
+                blocksize=self.blocksize, latency=self.latency, device=self.device,
+                callback=self._callback)
+            self._stream.start()
+        except Exception:
+            # Still close the sink, a muxer may be waiting for its audio input
+            self._stream = None
+            self.stop()
+            raise
+
+    def pause(self, at=None):
+        # at: the moment of the pause, normally AVClock.pause()'s return value
+        if self._paused_at is not None:
+            return
+        self._paused_at = time.monotonic() if at is None else at
+        if self._stream is not None:
+            self._stream.stop()  # no callbacks, no CPU until resume
+
+    def resume(self):
+        if self._paused_at is None:
+            return
+        # The stream restarts with fresh device buffers, nothing from the
+        # paused span is left to deliver
+        self._paused_at = None
+        if self._stream is not None:
+            self._stream.start()
+
+    @property
+    def is_paused(self):
+        return self._paused_at is not None
+
+    def _write_loop(self):
+        try:
+            while not self.ring.drained:
+                count = self.ring.read_into(self._chunk, timeout=0.2)
+                if count:
+                    started = time.perf_counter()
+                    self.sink.write(self._chunk[:count])
+                    self.frames_written += count
+                    if self.metrics is not None:
+                        self.metrics.observe('audio_write', time.perf_counter() - started)
+        except Exception as e:
+            self.error = e
+            print(f"Ошибка записи аудио: {e}")
+        finally:
+            self.sink.close()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        self.ring.close()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    def stats(self):
+        return {
+            'audio_frames': self.frames_written,
+            'audio_overflows': self.overflows,
+            'audio_underflows': self.underflows,
+            'audio_overruns': self.ring.overruns,
+            'audio_buffered': self.ring.available(),
+            'audio_paused_frames': self.paused_frames,
+        }
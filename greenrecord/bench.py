@@ -0,0 +1,495 @@
+import argparse
+import functools
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from greenrecord.pacing import FramePacer
+
+# Headless benchmark of the recording pipeline: the same capture -> convert
+# -> encode path as RecorderApp.record_video, fed by the synthetic source (or
+# any other backend, e.g. under Xvfb) and a fake microphone. Every
+# configuration runs in a fresh interpreter so peak RSS and child CPU time
+# belong to that run alone.
+#
+#   python -m greenrecord.bench --resolutions 1280x720 1920x1080 --fps 30 60 --output results.json
+#   python -m greenrecord.bench --startup
+#   python -m greenrecord.bench --stop-check
+#
+# --startup times how long it takes from launching the interpreter until
+# recording can begin: the CLI until "Recording to ..." (engine running),
+# the GUI until the RecorderApp toolbar is shown. The median of several
+# runs is compared with STARTUP_TARGETS.
+#
+# --stop-check makes a stage of the processes engine fail (a capture backend
+# that does not exist, a sink that cannot be opened) and checks that stop()
+# still returns.
+
+# Median seconds from process launch to ready
+STARTUP_TARGETS = {'cli': 0.5, 'gui': 1.5}
+
+
+class FakeInputStream:
+    # Stand-in for sounddevice.InputStream: calls back with a sine tone in
+    # real time from its own thread, like PortAudio does. rate_error makes
+    # the fake device clock run fast (+) or slow (-), e.g. 0.002 = 2000 ppm.
+    def __init__(self, samplerate, channels=1, dtype='int16', blocksize=1024, latency=None,
+                 device=None, callback=None, frequency=440.0, rate_error=0.0):
+        self.samplerate = samplerate
+        self.rate_error = rate_error
+        self.channels = channels
+        self.blocksize = blocksize or 1024
+        self.callback = callback
+        period = np.arange(int(samplerate)) / samplerate
+        tone = (np.sin(2 * np.pi * frequency * period) * 8000).astype(np.int16)
+        self._tone = np.repeat(tone[:, None], channels, axis=1)
+        self._block = np.empty((self.blocksize, channels), np.int16)
+        self._position = 0
+        self._running = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="fake-sounddevice", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        pacer = FramePacer(self.samplerate * (1.0 + self.rate_error) / self.blocksize)
+        while self._running.is_set():
+            # A sound card buffers what a late callback has not taken yet, so
+            # skipped ticks are delivered back to back rather than lost
+            for _ in range(1 + pacer.wait()):
+                index = (self._position + np.arange(self.blocksize)) % len(self._tone)
+                np.take(self._tone, index, axis=0, out=self._block)
+                self._position += self.blocksize
+                self.callback(self._block, self.blocksize, None, None)
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+
+
+class FakeSoundDevice:
+    # Passed to AudioRecorder(sd_module=...) in place of the sounddevice module
+    InputStream = FakeInputStream
+
+
+class FakeDevices:
+    # sounddevice stand-in with several devices for MultiSourceRecorder:
+    # devices maps a device to (frequency, rate_error) of its fake stream
+    def __init__(self, devices):
+        self.devices = devices
+
+    def InputStream(self, device=None, **options):
+        frequency, rate_error = self.devices.get(device, (440.0, 0.0))
+        return FakeInputStream(device=device, frequency=frequency, rate_error=rate_error, **options)
+
+
+class LatencySink:
+    # Records capture-to-encoder latency of every frame handed to the sink.
+    # With path set (the sink lives in an encoder process) the latencies are
+    # saved there as .npy on close; capture timestamps are time.monotonic(),
+    # which is the same clock in every process.
+    def __init__(self, sink, path=None):
+        self.sink = sink
+        self.path = path
+        self.latencies = []
+        self._last = None
+        self.audio = getattr(sink, 'audio', None)
+
+    def write(self, frame, timestamp=None):
+        self.sink.write(frame, timestamp)
+        if timestamp is not None and timestamp != self._last:
+            # Repeated frames (constant-rate padding) count once
+            self.latencies.append(time.monotonic() - timestamp)
+            self._last = timestamp
+
+    def close(self):
+        self.sink.close()
+        if self.path:
+            np.save(self.path, np.array(self.latencies))
+
+
+def _latency_sink(sink_factory, path):
+    # Picklable sink factory for MultiProcessEngine's encoder process
+    return LatencySink(sink_factory(), path)
+
+
+def _parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def _peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _cpu_seconds():
+    # Own CPU time plus that of finished children (ffmpeg, engine processes)
+    try:
+        import resource
+    except ImportError:
+        times = os.times()
+        return times.user + times.system
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run_config(config):
+    # One benchmark run in this process; returns the result record
+    from greenrecord.audio import AudioRecorder
+    from greenrecord.capture import create_backend
+    from greenrecord.encoders import EncoderSettings
+    from greenrecord.pacing import AVClock
+    from greenrecord.pipeline import RecordingEngine
+    from greenrecord.sinks import AudioSocketInput, FFmpegMuxSink, VideoWriterSink, find_ffmpeg
+    from greenrecord.transform import FrameTransform
+
+    width, height = config['resolution']
+    fps = config['fps']
+    samplerate = config['samplerate']
+    encoder = EncoderSettings(config['codec'], config['preset'])
+    filename = encoder.filename(os.path.join(config['directory'], 'bench'))
+    options = {'region': (0, 0, width, height)}
+    if config['backend'] == 'synthetic':
+        options.update(width=width, height=height)
+    source = create_backend(config['backend'], **options)
+    out_size = config['output_size'] or (width, height)
+    transform = FrameTransform(source.shape, out_size)
+    use_mux = config['sink'] == 'ffmpeg'
+    if use_mux and not find_ffmpeg():
+        raise RuntimeError("ffmpeg not found")
+    audio = config['audio']
+
+    av_clock = AVClock()
+    av_clock.begin()
+    cpu_start, wall_start = _cpu_seconds(), time.monotonic()
+    recorder = None
+    latency = None
+    if config['engine'] == 'processes':
+        from greenrecord.mp_engine import MultiProcessEngine
+        backend, shape = source.name, source.shape
+        source.close()
+        audio_input = AudioSocketInput() if use_mux and audio else None
+        if use_mux:
+            sink_factory = functools.partial(FFmpegMuxSink, filename, fps, transform.out_size,
+                                             samplerate=samplerate if audio else None,
+                                             video_args=encoder.video_args(), audio_args=encoder.audio_args(),
+                                             audio_port=audio_input.port if audio_input else None)
+        else:
+            sink_factory = functools.partial(VideoWriterSink, filename, fps, encoder.fourcc,
+                                             encoder.opencv_params(), encoder.fallback_fourcc)
+        if audio:
+            recorder = AudioRecorder(os.path.join(config['directory'], 'bench.wav'), samplerate,
+                                     av_clock=av_clock, sd_module=FakeSoundDevice, sink=audio_input)
+        latency_path = os.path.join(config['directory'], 'latency.npy')
+        sink_factory = functools.partial(_latency_sink, sink_factory, latency_path)
+        engine = MultiProcessEngine(backend, options, shape, sink_factory, fps=fps,
+                                    queue_size=config['queue_size'], policy=config['policy'],
+                                    av_clock=av_clock, transform=transform)
+    else:
+        if use_mux:
+            sink = FFmpegMuxSink(filename, fps, transform.out_size, samplerate=samplerate if audio else None,
+                                 video_args=encoder.video_args(), audio_args=encoder.audio_args())
+        else:
+            sink = VideoWriterSink(filename, fps, encoder.fourcc, encoder.opencv_params(), encoder.fallback_fourcc)
+        latency = LatencySink(sink)
+        if audio:
+            recorder = AudioRecorder(os.path.join(config['directory'], 'bench.wav'), samplerate,
+                                     av_clock=av_clock, sd_module=FakeSoundDevice,
+                                     sink=getattr(sink, 'audio', None))
+        engine = RecordingEngine(source, latency, fps=fps, queue_size=config['queue_size'],
+                                 policy=config['policy'], av_clock=av_clock, transform=transform)
+    if recorder is not None:
+        recorder.start()
+    engine.start()
+    # The window starts with the first frame, so process start-up is not counted
+    deadline = time.monotonic() + 10.0
+    while engine.stats()['captured'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    started = time.monotonic()
+    first = engine.stats()['captured']
+    time.sleep(config['duration'])
+    captured = engine.stats()['captured'] - first
+    elapsed = time.monotonic() - started
+    if recorder is not None:
+        recorder.stop()
+    engine.stop()
+    if config['engine'] == 'processes' and os.path.exists(latency_path):
+        latencies = np.load(latency_path).tolist()
+        os.remove(latency_path)
+    else:
+        latencies = latency.latencies if latency is not None else []
+    cpu = _cpu_seconds() - cpu_start
+    wall = time.monotonic() - wall_start
+    stats = engine.stats()
+
+    result = {
+        'backend': config['backend'],
+        'engine': config['engine'],
+        'sink': config['sink'],
+        'codec': config['codec'],
+        'preset': config['preset'],
+        'resolution': f"{width}x{height}",
+        'output_size': "{}x{}".format(*transform.out_size),
+        'target_fps': fps,
+        'duration': round(elapsed, 3),
+        'captured': stats['captured'],
+        'encoded': stats['encoded'],
+        'achieved_fps': round(captured / elapsed, 2),
+        'dropped': stats['dropped'],
+        'late': stats['late'],
+        'duplicated': stats['duplicated'],
+        'skipped': stats['skipped'],
+        'cpu_seconds': round(cpu, 3),
+        'cpu_percent': round(100.0 * cpu / wall, 1),
+        'peak_rss_bytes': _peak_rss_bytes(),
+        'output_bytes': os.path.getsize(filename) if os.path.exists(filename) else 0,
+    }
+    if latencies:
+        values = np.array(latencies) * 1000.0
+        for name, q in (('p50', 50), ('p90', 90), ('p99', 99)):
+            result[f'latency_{name}_ms'] = round(float(np.percentile(values, q)), 2)
+        result['latency_max_ms'] = round(float(values.max()), 2)
+    else:
+        result.update(latency_p50_ms=None, latency_p90_ms=None, latency_p99_ms=None, latency_max_ms=None)
+    if recorder is not None:
+        result.update(recorder.stats())
+    if config['engine'] == 'threads':
+        result['stages'] = engine.metrics.snapshot()['stages']
+    return result
+
+
+def _time_until(command, marker, env=None, timeout=60.0):
+    # Seconds from launch until a line containing marker is printed
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+    elapsed = None
+    try:
+        for line in process.stdout:
+            if marker in line:
+                elapsed = time.perf_counter() - started
+                break
+        process.communicate(timeout=timeout)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return elapsed
+
+
+def _failing_sink():
+    # Picklable sink factory for --stop-check: the encoder cannot open its output
+    raise RuntimeError("sink cannot be opened")
+
+
+def check_stop(directory, timeout=15.0):
+    from greenrecord.mp_engine import MultiProcessEngine
+    from greenrecord.sinks import VideoWriterSink
+    from greenrecord.transform import FrameTransform
+    shape = (120, 160, 3)
+    cases = {
+        'unknown_backend': ('no-such-backend', {},
+                            functools.partial(VideoWriterSink, os.path.join(directory, 'stop.avi'), 20.0, 'MJPG')),
+        'encoder_fails': ('synthetic', {'width': 160, 'height': 120}, _failing_sink),
+    }
+    results = {}
+    for name, (backend, options, sink_factory) in cases.items():
+        # A scaling transform, so the convert process sits between capture and encoder
+        engine = MultiProcessEngine(backend, options, shape, sink_factory, fps=20.0,
+                                    transform=FrameTransform(shape, (80, 60)))
+        engine.start()
+        time.sleep(1.0)
+        stopper = threading.Thread(target=engine.stop, daemon=True)
+        started = time.monotonic()
+        stopper.start()
+        stopper.join(timeout)
+        results[name] = {'ok': not stopper.is_alive(), 'stop_seconds': round(time.monotonic() - started, 3)}
+        if stopper.is_alive():
+            for process in engine._processes:
+                process.kill()
+    return results
+
+
+def measure_startup(repeat=5, directory=None):
+    import statistics
+    directory = directory or tempfile.gettempdir()
+    commands = {
+        'cli': ([sys.executable, '-m', 'greenrecord', 'record', '--backend', 'synthetic', '--no-audio',
+                 '--duration', '0', '--out', os.path.join(directory, 'startup')], "Recording to"),
+    }
+    gui = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'GreenRecord.py')
+    if os.path.exists(gui):
+        commands['gui'] = ([sys.executable, gui, '--startup-check'], "GreenRecord ready")
+    results = {}
+    for name, (command, marker) in commands.items():
+        times = [_time_until(command, marker) for _ in range(repeat)]
+        if None in times:
+            results[name] = {'error': "did not start", 'target_seconds': STARTUP_TARGETS[name]}
+            continue
+        median = statistics.median(times)
+        results[name] = {
+            'median_seconds': round(median, 3),
+            'min_seconds': round(min(times), 3),
+            'max_seconds': round(max(times), 3),
+            'target_seconds': STARTUP_TARGETS[name],
+            'ok': median <= STARTUP_TARGETS[name],
+        }
+    return results
+
+
+def _start_xvfb(size):
+    # Private X server for the screen backends; returns the process or None
+    xvfb = shutil.which('Xvfb')
+    if not xvfb:
+        print("Xvfb not found", file=sys.stderr)
+        return None
+    display = ':%d' % (90 + os.getpid() % 100)
+    process = subprocess.Popen([xvfb, display, '-screen', '0', '%dx%dx24' % size, '-nolisten', 'tcp'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0)
+    os.environ['DISPLAY'] = display
+    return process
+
+
+def _print_table(results, stream):
+    columns = ('backend', 'engine', 'sink', 'codec', 'resolution', 'target_fps', 'achieved_fps', 'dropped',
+               'latency_p50_ms', 'latency_p99_ms', 'cpu_percent', 'peak_rss_bytes', 'output_bytes', 'error')
+    print('\t'.join(columns), file=stream)
+    for result in results:
+        print('\t'.join(str(result.get(column, '')) for column in columns), file=stream)
+
+
+def main(argv=None):
+    from greenrecord.encoders import CODECS, PRESETS
+    from greenrecord.pipeline import BLOCK, POLICIES
+
+    parser = argparse.ArgumentParser(prog="python -m greenrecord.bench",
+                                     description="Benchmark the GreenRecord recording pipeline headless.")
+    parser.add_argument('--resolutions', nargs='+', type=_parse_size, default=[(1280, 720), (1920, 1080)])
+    parser.add_argument('--fps', nargs='+', type=float, default=[30.0])
+    parser.add_argument('--backends', nargs='+', default=['synthetic'])
+    parser.add_argument('--engines', nargs='+', choices=('threads', 'processes'), default=['threads'])
+    parser.add_argument('--codecs', nargs='+', choices=sorted(CODECS), default=['h264'])
+    parser.add_argument('--presets', nargs='+', choices=PRESETS, default=['fast'])
+    parser.add_argument('--sink', choices=('ffmpeg', 'opencv'), default='ffmpeg')
+    parser.add_argument('--output-size', type=_parse_size, default=None, help="scale to WxH (convert stage)")
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--queue-size', type=int, default=4)
+    parser.add_argument('--policy', choices=POLICIES, default=BLOCK)
+    parser.add_argument('--samplerate', type=int, default=48000)
+    parser.add_argument('--no-audio', dest='audio', action='store_false')
+    parser.add_argument('--xvfb', action='store_true', help="start a private Xvfb for screen backends")
+    parser.add_argument('--format', choices=('json', 'jsonl', 'table'), default='json')
+    parser.add_argument('--output', help="write results here instead of stdout")
+    parser.add_argument('--startup', action='store_true', help="measure CLI and GUI startup time instead")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per startup measurement")
+    parser.add_argument('--stop-check', action='store_true',
+                        help="check that the processes engine stops when one of its stages fails")
+    parser.add_argument('--run', help=argparse.SUPPRESS)  # internal: one configuration as JSON
+    args = parser.parse_args(argv)
+
+    if args.stop_check:
+        directory = tempfile.mkdtemp(prefix="greenrecord-bench-")
+        try:
+            checks = check_stop(directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        print(json.dumps({'stop_check': checks}, indent=2))
+        return 0 if all(result['ok'] for result in checks.values()) else 1
+
+    if args.run:
+        config = json.loads(args.run)
+        print(json.dumps(run_config(config)))
+        return 0
+
+    if args.sink == 'ffmpeg' and not args.startup:
+        from greenrecord.sinks import find_ffmpeg
+        if not find_ffmpeg():
+            # Otherwise every run would fail the same way
+            print("ffmpeg not found, using the opencv sink", file=sys.stderr)
+            args.sink = 'opencv'
+    # Large enough for every resolution: the widest width and the tallest height
+    screen = (max(width for width, height in args.resolutions), max(height for width, height in args.resolutions))
+    xvfb = _start_xvfb(screen) if args.xvfb else None
+    results = []
+    directory = tempfile.mkdtemp(prefix="greenrecord-bench-")
+    if args.startup:
+        try:
+            startup = measure_startup(args.repeat, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+            if xvfb is not None:
+                xvfb.terminate()
+        text = json.dumps({'python': sys.version.split()[0], 'platform': sys.platform, 'startup': startup},
+                          indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+        return 0 if all(result.get('ok') for result in startup.values()) else 1
+    try:
+        for backend, engine, codec, preset, resolution, fps in itertools.product(
+                args.backends, args.engines, args.codecs, args.presets, args.resolutions, args.fps):
+            config = {
+                'backend': backend, 'engine': engine, 'codec': codec, 'preset': preset,
+                'resolution': resolution, 'fps': fps, 'sink': args.sink, 'output_size': args.output_size,
+                'duration': args.duration, 'queue_size': args.queue_size, 'policy': args.policy,
+                'samplerate': args.samplerate, 'audio': args.audio, 'directory': directory,
+            }
+            print(f"{backend}/{engine}/{codec}-{preset} {resolution[0]}x{resolution[1]}@{fps:g}...",
+                  file=sys.stderr)
+            process = subprocess.run([sys.executable, '-m', 'greenrecord.bench', '--run', json.dumps(config)],
+                                     capture_output=True, text=True)
+            lines = process.stdout.strip().splitlines()
+            if process.returncode != 0 or not lines:
+                error = (process.stderr.strip().splitlines() or ["failed"])[-1]
+                print(f"  {error}", file=sys.stderr)
+                results.append(dict(config, error=error, resolution="%dx%d" % resolution, target_fps=fps))
+                continue
+            results.append(json.loads(lines[-1]))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        if xvfb is not None:
+            xvfb.terminate()
+
+    stream = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        if args.format == 'json':
+            json.dump({'python': sys.version.split()[0], 'platform': sys.platform, 'results': results},
+                      stream, indent=2)
+            stream.write('\n')
+        elif args.format == 'jsonl':
+            for result in results:
+                stream.write(json.dumps(result) + '\n')
+        else:
+            _print_table(results, stream)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    return 0 if all('error' not in result for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+import ctypes
+import ctypes.util
+
+import numpy as np
+
+from greenrecord.transform import clamp_region
+
+# Capture backends. Every backend exposes `shape` (height, width, 3) and
+# grab_into(out), which fills a caller supplied BGR uint8 buffer in place so
+# the pipeline can keep reusing its preallocated frame slots. All of them
+# accept region=(x, y, w, h) and then only read that part of the screen.
+# Backends whose screen memory is BGRA also offer grab_native(), which
+# returns a view of that memory (valid until the next grab) so the pipeline
+# can convert it to the encoder's format without the BGR copy in between;
+# native_format says what grab_native() returns.
+
+BACKENDS = {}
+# Tried in this order when no backend is requested explicitly
+DEFAULT_BACKEND_ORDER = ("x11", "mss", "pyautogui")
+
+
+class CaptureError(RuntimeError):
+    pass
+
+
+def register_backend(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def create_backend(name=None, **options):
+    if name is not None:
+        if name not in BACKENDS:
+            raise CaptureError(f"Unknown capture backend: {name}")
+        return BACKENDS[name](**options)
+    errors = []
+    for candidate in DEFAULT_BACKEND_ORDER:
+        try:
+            return BACKENDS[candidate](**options)
+        except (ImportError, OSError, CaptureError) as e:
+            errors.append(f"{candidate}: {e}")
+    raise CaptureError("No capture backend available (" + "; ".join(errors) + ")")
+
+
+def _copy_bgrx(src, out):
+    # BGRX/BGRA screen memory -> BGR frame slot, a single pass without temporaries
+    import cv2
+    cv2.cvtColor(src, cv2.COLOR_BGRA2BGR, dst=out)
+
+
+@register_backend("pyautogui")
+class PyAutoGuiSource:
+    # Portable fallback: pyautogui.screenshot() allocates a PIL image per
+    # frame, so it is the slowest backend, but it works everywhere pyautogui does.
+    native_format = 'bgr24'
+
+    def __init__(self, region=None):
+        import pyautogui
+        self._pyautogui = pyautogui
+        self.region = clamp_region(region, pyautogui.size())
+        self.shape = (self.region[3], self.region[2], 3)
+
+    def grab_into(self, out):
+        import cv2
+        img = self._pyautogui.screenshot(region=self.region)
+        cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR, dst=out)
+        return out
+
+    def close(self):
+        pass
+
+
+@register_backend("mss")
+class MssSource:
+    # mss grabs straight into a BGRA byte buffer (XGetImage on X11, BitBlt on
+    # Windows, CoreGraphics on macOS); it is viewed without copying and
+    # converted once into the frame slot.
+    native_format = 'bgra'
+
+    def __init__(self, region=None, monitor=1):
+        import mss
+        self._sct = mss.mss()
+        try:
+            screen = self._sct.monitors[monitor]
+        except IndexError:
+            self._sct.close()
+            raise CaptureError(f"Monitor {monitor} not found")
+        x, y, w, h = clamp_region(region, (screen['width'], screen['height']))
+        self.region = (x, y, w, h)
+        self._monitor = {'left': screen['left'] + x, 'top': screen['top'] + y, 'width': w, 'height': h}
+        self.shape = (h, w, 3)
+
+    def grab_native(self):
+        shot = self._sct.grab(self._monitor)
+        return np.frombuffer(shot.raw, np.uint8).reshape(shot.height, shot.width, 4)
+
+    def grab_into(self, out):
+        _copy_bgrx(self.grab_native(), out)
+        return out
+
+    def close(self):
+        self._sct.close()
+
+
+class _XImage(ctypes.Structure):
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+        ('red_mask', ctypes.c_ulong),
+        ('green_mask', ctypes.c_ulong),
+        ('blue_mask', ctypes.c_ulong),
+    ]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+_ZPIXMAP = 2
+_ALL_PLANES = 0xFFFFFFFF
+_IPC_PRIVATE = 0
+_IPC_CREAT = 0o1000
+_IPC_RMID = 0
+
+
+def _load_library(name):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise CaptureError(f"lib{name} not found")
+    return ctypes.CDLL(path, use_errno=True)
+
+
+@register_backend("x11")
+class X11ShmSource:
+    # MIT-SHM capture: the X server copies the root window straight into a
+    # shared memory segment that is mapped once as a NumPy array, so a grab
+    # costs one server-side copy and no per-frame allocation.
+    native_format = 'bgra'
+
+    def __init__(self, region=None, display=None):
+        self._requested_region = region
+        self._xlib = xlib = _load_library('X11')
+        self._xext = xext = _load_library('Xext')
+        self._libc = libc = _load_library('c')
+
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        xlib.XRootWindow.restype = ctypes.c_ulong
+        xlib.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDefaultVisual.restype = ctypes.c_void_p
+        xlib.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XFree.argtypes = [ctypes.c_void_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+            ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+        self._display = xlib.XOpenDisplay(display.encode() if display else None)
+        if not self._display:
+            raise CaptureError("Cannot open X display")
+        self._image = None
+        self._shminfo = _XShmSegmentInfo()
+        self._shminfo.shmaddr = None
+        try:
+            self._setup()
+        except Exception:
+            self.close()
+            raise
+
+    def _setup(self):
+        xlib, xext, libc = self._xlib, self._xext, self._libc
+        display = self._display
+        if not xext.XShmQueryExtension(display):
+            raise CaptureError("X server has no MIT-SHM extension")
+        screen = xlib.XDefaultScreen(display)
+        self._root = xlib.XRootWindow(display, screen)
+        screen_size = (xlib.XDisplayWidth(display, screen), xlib.XDisplayHeight(display, screen))
+        self.region = clamp_region(self._requested_region, screen_size)
+        x, y, width, height = self.region
+
+        self._image = xext.XShmCreateImage(
+            display, xlib.XDefaultVisual(display, screen), xlib.XDefaultDepth(display, screen),
+            _ZPIXMAP, None, ctypes.byref(self._shminfo), width, height)
+        if not self._image:
+            raise CaptureError("XShmCreateImage failed")
+        image = self._image.contents
+        if image.bits_per_pixel != 32:
+            raise CaptureError(f"Unsupported X11 pixel size: {image.bits_per_pixel} bpp")
+
+        size = image.bytes_per_line * height
+        shmid = libc.shmget(_IPC_PRIVATE, size, _IPC_CREAT | 0o600)
+        if shmid < 0:
+            raise CaptureError(f"shmget failed: errno {ctypes.get_errno()}")
+        self._shminfo.shmid = shmid
+        address = libc.shmat(shmid, None, 0)
+        # Marked for removal right away; it lives until both sides detach
+        libc.shmctl(shmid, _IPC_RMID, None)
+        if address in (None, ctypes.c_void_p(-1).value):
+            raise CaptureError(f"shmat failed: errno {ctypes.get_errno()}")
+        self._shminfo.shmaddr = address
+        self._shminfo.readOnly = 0
+        image.data = address
+        if not xext.XShmAttach(display, ctypes.byref(self._shminfo)):
+            raise CaptureError("XShmAttach failed")
+        xlib.XSync(display, 0)
+        self._attached = True
+
+        memory = (ctypes.c_ubyte * size).from_address(address)
+        rows = np.ndarray((height, image.bytes_per_line // 4, 4), np.uint8, buffer=memory)
+        self._view = rows[:, :width]
+        self.shape = (height, width, 3)
+
+    def grab_native(self):
+        x, y = self.region[:2]
+        if not self._xext.XShmGetImage(self._display, self._root, self._image, x, y, _ALL_PLANES):
+            raise CaptureError("XShmGetImage failed")
+        return self._view
+
+    def grab_into(self, out):
+        _copy_bgrx(self.grab_native(), out)
+        return out
+
+    def close(self):
+        if self._display is None:
+            return
+        if getattr(self, '_attached', False):
+            self._xext.XShmDetach(self._display, ctypes.byref(self._shminfo))
+            self._attached = False
+        self._view = None
+        if self._image:
+            # XFree rather than XDestroyImage: the pixel memory is the shm segment
+            self._xlib.XFree(self._image)
+            self._image = None
+        if self._shminfo.shmaddr:
+            self._libc.shmdt(self._shminfo.shmaddr)
+            self._shminfo.shmaddr = None
+        self._xlib.XCloseDisplay(self._display)
+        self._display = None
+
+
+@register_backend("synthetic")
+class SyntheticSource:
+    # Deterministic test pattern: a fixed gradient with a bar that moves one
+    # step per frame and the frame number stored in the first pixels. Needs
+    # no display, so the whole pipeline can run headless.
+    native_format = 'bgr24'
+
+    def __init__(self, region=None, width=1280, height=720, step=8, seed=0):
+        self.region = clamp_region(region, (width, height))
+        x, y, w, h = self.region
+        self.shape = (h, w, 3)
+        self._full_width = width
+        self.step = step
+        self.index = 0
+        rng = np.random.default_rng(seed)
+        background = np.empty((height, width, 3), np.uint8)
+        background[..., 0] = np.linspace(0, 255, width, dtype=np.float32)
+        background[..., 1] = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        background[..., 2] = rng.integers(0, 64, dtype=np.uint8)
+        self._background = background[y:y + h, x:x + w].copy()
+        self._bar_width = max(1, width // 20)
+        self._bar_color = np.array([255, 255, 255], np.uint8)
+
+    def grab_into(self, out):
+        np.copyto(out, self._background)
+        # Bar position is in full-screen coordinates, shifted into the region
+        left = (self.index * self.step) % self._full_width - self.region[0]
+        out[:, max(left, 0):max(left + self._bar_width, 0)] = self._bar_color
+        # Frame number as little-endian bytes in the first row, for checks
+        out[0, :4, 0] = np.frombuffer(np.uint32(self.index).tobytes(), np.uint8)
+        self.index += 1
+        return out
+
+    @staticmethod
+    def frame_number(frame):
+        return int(np.frombuffer(frame[0, :4, 0].tobytes(), np.uint32)[0])
+
+    def close(self):
+        pass
@@ -0,0 +1,174 @@
+import threading
+import time
+
+import numpy as np
+
+from greenrecord.capture import create_backend
+from greenrecord.fanout import union_region
+from greenrecord.transform import clamp_region
+
+# Screen capture shared by the recording sessions of one process (see
+# control.ControlServer). Sessions whose regions overlap form a group with a
+# single backend that grabs the union of their regions:
+#
+#   session A (0,0,1280,720)    --\
+#                                  >-- one backend, region (0,0,1600,900) -- grab
+#   session B (320,180,1280,720) --/
+#   session C (1700,0,200,200)  ---- own backend
+#
+# Every session keeps its own engine, pacer and encoder and starts, pauses
+# and stops on its own; its source is a PooledSource that crops its region
+# out of the group's latest grab. A grab younger than half a frame interval
+# of the group's fastest session is reused instead of grabbing again, so
+# sessions ticking at about the same time share one screen read. A group
+# grows when an overlapping session joins (its backend is reopened on the
+# new union) and is closed with its last session; it does not shrink.
+
+
+def regions_overlap(a, b):
+    if a is None or b is None:
+        return True  # Full screen
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def region_contains(outer, inner):
+    return (outer[0] <= inner[0] and outer[1] <= inner[1] and inner[0] + inner[2] <= outer[0] + outer[2]
+            and inner[1] + inner[3] <= outer[1] + outer[3])
+
+
+class _Group:
+    def __init__(self, backend):
+        self.backend = backend
+        self.region = backend.region
+        self.frame = np.empty(backend.shape, np.uint8)
+        self.grabbed_at = None
+        self.max_age = 0.0
+        self.sources = []
+        self.lock = threading.Lock()
+
+    def update_max_age(self):
+        fastest = max((source.fps for source in self.sources if source.fps), default=0)
+        self.max_age = 0.5 / fastest if fastest else 0.0
+
+
+class PooledSource:
+    # Capture backend interface (shape, region, grab_into, close) over a
+    # group's shared grab. Grabs are bgr24; there is no grab_native.
+    name = 'pooled'
+    native_format = 'bgr24'
+
+    def __init__(self, pool, group, region, fps):
+        self.pool = pool
+        self.group = group
+        self.region = region
+        self.fps = fps
+        self.shape = (region[3], region[2], 3)
+        self.grabs = 0
+        self.reused = 0
+
+    def grab_into(self, out):
+        while True:
+            group = self.group
+            with group.lock:
+                if group is not self.group:
+                    continue  # Moved to a merged group meanwhile
+                now = time.monotonic()
+                if group.grabbed_at is None or now - group.grabbed_at > group.max_age:
+                    group.backend.grab_into(group.frame)
+                    group.grabbed_at = time.monotonic()
+                    self.grabs += 1
+                else:
+                    self.reused += 1
+                x, y = self.region[0] - group.region[0], self.region[1] - group.region[1]
+                np.copyto(out, group.frame[y:y + self.region[3], x:x + self.region[2]])
+                return out
+
+    def close(self):
+        self.pool.release(self)
+
+
+class CapturePool:
+    # backend and backend_options as for capture.create_backend; regions are
+    # in screen coordinates, None is the whole screen
+    def __init__(self, backend=None, backend_options=None):
+        self.backend = backend
+        self.backend_options = dict(backend_options or {})
+        self.groups = []
+        self._lock = threading.Lock()
+        probe = create_backend(backend, region=None, **self.backend_options)
+        self.screen = probe.region
+        self.backend = probe.name  # The one create_backend picked
+        probe.close()
+
+    def source(self, region=None, fps=None):
+        region = clamp_region(region, self.screen[2:])
+        with self._lock:
+            overlapping = [group for group in self.groups if regions_overlap(group.region, region)]
+            if not overlapping:
+                group = _Group(create_backend(self.backend, region=region, **self.backend_options))
+                self.groups.append(group)
+            else:
+                group = overlapping[0]
+                union = union_region([region] + [other.region for other in overlapping])
+                union = clamp_region(union, self.screen[2:])
+                if len(overlapping) > 1 or not region_contains(group.region, union):
+                    self._reopen(group, union, overlapping[1:])
+            source = PooledSource(self, group, region, fps)
+            with group.lock:
+                group.sources.append(source)
+                group.update_max_age()
+        return source
+
+    def _reopen(self, group, region, merged):
+        # Grows group to region and moves the sources of merged into it;
+        # the new backend is opened before the old one goes away
+        backend = create_backend(self.backend, region=region, **self.backend_options)
+        locks = [group.lock] + [other.lock for other in merged]
+        for lock in locks:
+            lock.acquire()
+        try:
+            old = [group.backend] + [other.backend for other in merged]
+            group.backend = backend
+            group.region = backend.region
+            group.frame = np.empty(backend.shape, np.uint8)
+            group.grabbed_at = None
+            for other in merged:
+                for source in other.sources:
+                    source.group = group
+                group.sources += other.sources
+                other.sources = []
+                self.groups.remove(other)
+            group.update_max_age()
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        for backend in old:
+            backend.close()
+
+    def release(self, source):
+        with self._lock:
+            group = source.group
+            with group.lock:
+                if source in group.sources:
+                    group.sources.remove(source)
+                group.update_max_age()
+                empty = not group.sources
+            if empty and group in self.groups:
+                self.groups.remove(group)
+                group.backend.close()
+
+    def close(self):
+        with self._lock:
+            for group in self.groups:
+                group.backend.close()
+            self.groups = []
+
+    def stats(self):
+        with self._lock:
+            sources = [source for group in self.groups for source in group.sources]
+            return {
+                'capture_groups': len(self.groups),
+                'capture_sources': len(sources),
+                'capture_grabs': sum(source.grabs for source in sources),
+                'capture_reused': sum(source.reused for source in sources),
+            }
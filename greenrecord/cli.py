@@ -0,0 +1,402 @@
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+
+from greenrecord.encoders import CODECS, PRESETS, EncoderSettings
+from greenrecord.pixfmt import PIXEL_FORMATS
+
+# Command line / daemon front end, no Qt involved:
+#
+#   python -m greenrecord record --region 0,0,1280,720 --fps 30 --duration 60 --out talk.mp4
+#   python -m greenrecord record --out talk.mp4 --also window:region=200,100,1280,720:size=640x360:fps=10
+#   python -m greenrecord post talk.mp4 --jobs index,thumbnails
+#   python -m greenrecord recover Recording_20240101_120000.manifest.jsonl --out joined.mkv
+#   python -m greenrecord serve --port 8790 --dir recordings   (HTTP control API, see control.py)
+#
+# Without --duration the recording runs until SIGINT/SIGTERM; SIGUSR1
+# toggles pause. With --replay SECONDS only the last SECONDS are kept in
+# memory and SIGUSR2 saves them to <out>_replay_<time>.mp4. Only argparse and the encoder table are imported up front,
+# the engine comes in when the recording starts.
+
+CONTAINERS = ('.mp4', '.mkv', '.avi')
+
+
+def _region(text):
+    values = tuple(int(v) for v in text.replace('x', ',').split(','))
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError("expected X,Y,WIDTH,HEIGHT")
+    return values
+
+
+def _size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def _output(text):
+    # NAME[:region=X,Y,W,H][:size=WxH][:fps=N][:codec=C][:preset=P][:crf=N][:bitrate=B]
+    name, *options = text.split(':')
+    values = {}
+    for option in options:
+        key, _, value = option.partition('=')
+        if key == 'region':
+            values[key] = _region(value)
+        elif key == 'size':
+            values[key] = _size(value)
+        elif key in ('fps', 'crf'):
+            values[key] = float(value) if key == 'fps' else int(value)
+        elif key in ('codec', 'preset', 'bitrate'):
+            values[key] = value
+        else:
+            raise argparse.ArgumentTypeError(f"unknown output option: {key}")
+    return name, values
+
+
+def _base(out):
+    if not out:
+        return time.strftime("Recording_%Y%m%d_%H%M%S")
+    root, extension = os.path.splitext(out)
+    return root if extension.lower() in CONTAINERS else out
+
+
+def _print_stats(stats, stream=sys.stderr):
+    line = (f"captured {stats.get('captured', 0)}, encoded {stats.get('encoded', 0)}, "
+            f"dropped {stats.get('dropped', 0)}, late {stats.get('late', 0)}, "
+            f"duplicated {stats.get('duplicated', 0)}, skipped {stats.get('skipped', 0)}")
+    if stats.get('av_drift') is not None:
+        line += f", A/V drift {stats['av_drift'] * 1000:.1f} ms"
+    if 'audio_frames' in stats:
+        line += f", audio {stats['audio_frames']} frames ({stats['audio_overruns']} lost)"
+    index = 1
+    while f'audio_{index}_drift_ppm' in stats:
+        line += (f", source {index} drift {stats[f'audio_{index}_drift_ppm']:+.0f} ppm "
+                 f"({stats[f'audio_{index}_underruns']} silent)")
+        index += 1
+    if stats.get('preview_clients'):
+        line += f", preview {stats['preview_clients']} clients"
+    if stats.get('spooled'):
+        line += (f", spooled {stats['spooled']} (peak {stats['spool_high_water']} frames, "
+                 f"{stats['spool_high_water_bytes'] / 1048576:.0f} MB)")
+    print(line, file=stream)
+
+
+def _device(value):
+    # sounddevice takes a device index as int and anything else as a name
+    return int(value) if value.isdigit() else value
+
+
+def _samplerate(device, preferred=44100):
+    # Verified rates come from the device cache; PortAudio is asked again
+    # only when the device list changed since the last run
+    from greenrecord.devices import AudioDeviceService
+    devices = AudioDeviceService()
+    try:
+        devices.refresh()
+    except Exception as e:
+        print(f"Ошибка опроса аудиоустройств: {e}", file=sys.stderr)
+    if device is not None and str(device).isdigit():
+        device = int(device)
+    elif device is not None:
+        device = next((info['index'] for info in devices.devices if device in info['name']), None)
+    return devices.best_samplerate(preferred, device) or preferred
+
+
+def record(args):
+    from greenrecord.session import RecordingSession
+
+    samplerate = args.samplerate
+    if samplerate is None and not args.no_audio:
+        samplerate = _samplerate(args.audio_device)
+    encoder = EncoderSettings(args.codec, args.preset, crf=args.crf, bitrate=args.bitrate, threads=args.threads)
+    outputs = []
+    if args.also:
+        from greenrecord.session import OutputSpec
+        for name, values in args.also:
+            output_encoder = None
+            if {'codec', 'preset', 'crf', 'bitrate'} & set(values):
+                output_encoder = EncoderSettings(values.get('codec', args.codec), values.get('preset', args.preset),
+                                                 crf=values.get('crf'), bitrate=values.get('bitrate'),
+                                                 threads=args.threads)
+            outputs.append(OutputSpec(name, values.get('region'), values.get('size'), values.get('fps'),
+                                      output_encoder))
+    base = _base(args.out)
+    directory = os.path.dirname(os.path.abspath(base))
+    os.makedirs(directory, exist_ok=True)
+    backend_options = {}
+    if args.backend == 'synthetic' and args.region:
+        # The test pattern is as large as the region asks for
+        backend_options.update(width=args.region[0] + args.region[2], height=args.region[1] + args.region[3])
+    session = RecordingSession(base, encoder, region=args.region, size=args.size, fps=args.fps,
+                               backend=args.backend, backend_options=backend_options, engine=args.engine,
+                               live_mux=not args.no_mux, audio=not args.no_audio, samplerate=samplerate,
+                               audio_device=args.audio_device, queue_size=args.queue_size, vfr=args.vfr,
+                               segment_seconds=args.segment_seconds,
+                               segment_bytes=int(args.segment_mb * 1024 * 1024), outputs=outputs,
+                               replay_seconds=args.replay, replay_max_bytes=int(args.replay_mb * 1024 * 1024),
+                               adaptive=args.adaptive, min_fps=args.min_fps, min_scale=args.min_scale / 100.0,
+                               pixel_format=args.pix_fmt, spool_bytes=int(args.spool_mb * 1024 * 1024),
+                               spool_dir=args.spool_dir, audio_sources=args.audio_also,
+                               audio_tracks=args.audio_tracks, preview_port=args.preview_port,
+                               preview_host=args.preview_host, preview_fps=args.preview_fps,
+                               preview_width=args.preview_width)
+
+    finished = threading.Event()
+
+    def stop(signum, frame):
+        finished.set()
+
+    def toggle_pause(signum, frame):
+        if session.is_paused:
+            session.resume()
+            print("Resumed", file=sys.stderr)
+        else:
+            session.pause()
+            print("Paused", file=sys.stderr)
+
+    def save_replay(signum, frame):
+        session.save_replay(on_done=lambda path, error: error is None and
+                            print(f"Replay saved to {path}", file=sys.stderr))
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, toggle_pause)
+    if args.replay and hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, save_replay)
+
+    exporter = None
+    try:
+        session.start()
+    except Exception as e:
+        print(f"Ошибка записи видео: {e}", file=sys.stderr)
+        return 1
+    if args.metrics:
+        from greenrecord.metrics import MetricsExporter
+        exporter = MetricsExporter(session.metrics, args.metrics, args.metrics_format, args.stats_interval)
+        exporter.start()
+    target = base + "_*" if session.segmenting else session.video_filename
+    if args.replay:
+        target = f"memory (last {args.replay:g} s, kill -USR2 {os.getpid()} saves {base}_replay_*.mp4)"
+    target = ", ".join([target] + list(session.output_filenames.values()))
+    print(f"Recording to {target}" + (f" for {args.duration:g} s" if args.duration is not None else
+                                      " (Ctrl+C to stop)"), file=sys.stderr)
+
+    deadline = None if args.duration is None else time.monotonic() + args.duration
+    while not finished.is_set():
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            break
+        wait = args.stats_interval if remaining is None else min(args.stats_interval, remaining)
+        if not finished.wait(wait) and args.verbose:
+            _print_stats(session.stats())
+
+    stats = session.stop()
+    if exporter is not None:
+        exporter.stop()
+    _print_stats(stats)
+    if args.post:
+        audio = session.audio_filename if os.path.exists(session.audio_filename) else None
+        return _post_process(session.recorded_files(), args.post, args.share_height,
+                             {session.video_filename: audio} if audio else {})
+    return 0
+
+
+def _jobs(text):
+    from greenrecord.postprocess import JOBS
+    jobs = tuple(job for job in text.split(',') if job)
+    for job in jobs:
+        if job not in JOBS:
+            raise argparse.ArgumentTypeError(f"unknown job {job!r} (choose from {', '.join(JOBS)})")
+    return jobs
+
+
+def _post_process(videos, jobs, share_height=720, audio=None, workers=None):
+    # Runs the jobs in a process pool and waits, printing each one as it finishes
+    from greenrecord.postprocess import PostProcessor
+
+    def done(job_id, job, video, output, error):
+        if error is None:
+            print(f"{job}\t{output}")
+
+    processor = PostProcessor(workers, on_done=done)
+    futures = {}
+    for video in videos:
+        options = {'share': {'height': share_height}}
+        if audio and audio.get(video):
+            options['share']['audio'] = audio[video]
+        futures.update(processor.submit(video, jobs, options))
+    processor.shutdown()
+    return 1 if any(future.exception() for future in futures.values()) else 0
+
+
+def post(args):
+    return _post_process(args.videos, args.jobs, args.share_height, workers=args.workers)
+
+
+def recover(args):
+    from greenrecord.segments import recover_session
+
+    try:
+        segments = recover_session(args.manifest, args.out)
+    except Exception as e:
+        print(f"Ошибка восстановления записи: {e}", file=sys.stderr)
+        return 1
+    for segment in segments:
+        state = "recovered" if segment['recovered'] else "complete"
+        print(f"{segment['file']}\t{segment['start']:.3f}\t{segment.get('end')}\t{state}")
+    if args.out and segments:
+        print(f"Joined into {args.out}", file=sys.stderr)
+    return 0 if segments else 1
+
+
+def devices(args):
+    from greenrecord.devices import AudioDeviceService
+    service = AudioDeviceService()
+    if args.refresh:
+        service.fingerprint = None
+    try:
+        service.refresh()
+    except Exception as e:
+        print(f"Ошибка опроса аудиоустройств: {e}", file=sys.stderr)
+        return 1
+    for info in service.devices:
+        default = " (default)" if info['index'] == service.default_input else ""
+        rates = "; ".join(f"{channels} ch: {', '.join(str(rate) for rate in rates)}"
+                          for channels, rates in sorted(info['rates'].items()))
+        print(f"{info['index']}\t{info['name']}{default}\t{rates or 'no usable rate'}")
+    return 0
+
+
+def backends(args):
+    from greenrecord.capture import BACKENDS, DEFAULT_BACKEND_ORDER
+    for name in BACKENDS:
+        print(name + (" (default order)" if name in DEFAULT_BACKEND_ORDER else ""))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m greenrecord",
+                                     description="GreenRecord screen recorder without the GUI.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rec = commands.add_parser('record', help="record the screen (and microphone)")
+    rec.add_argument('--out', help="output file or base name (default: Recording_<date>_<time>)")
+    rec.add_argument('--region', type=_region, default=None, help="X,Y,WIDTH,HEIGHT (default: full screen)")
+    rec.add_argument('--size', type=_size, default=None, help="scale to WIDTHxHEIGHT")
+    rec.add_argument('--fps', type=float, default=20.0)
+    rec.add_argument('--duration', type=float, default=None, help="seconds (default: until interrupted)")
+    rec.add_argument('--backend', default=None, help="x11, mss, pyautogui or synthetic (default: first available)")
+    rec.add_argument('--engine', choices=('threads', 'processes'), default='threads')
+    rec.add_argument('--codec', choices=sorted(CODECS), default='h264')
+    rec.add_argument('--preset', choices=PRESETS, default='balanced')
+    rec.add_argument('--crf', type=int, default=None)
+    rec.add_argument('--bitrate', default=None, help="e.g. 4M (average bitrate instead of CRF)")
+    rec.add_argument('--threads', type=int, default=0)
+    rec.add_argument('--queue-size', type=int, default=4)
+    rec.add_argument('--pix-fmt', choices=('auto',) + PIXEL_FORMATS, default='auto',
+                     help="frame format handed to the encoder (default: its own 4:2:0 format if possible)")
+    rec.add_argument('--spool-mb', type=float, default=0,
+                     help="let frames the encoder cannot take in time overflow into a file of up to this size")
+    rec.add_argument('--spool-dir', default=None, help="directory of the spool file (default: system temp)")
+    rec.add_argument('--no-audio', action='store_true')
+    rec.add_argument('--samplerate', type=int, default=None,
+                     help="default: 44100 if the microphone supports it, else the best verified rate")
+    rec.add_argument('--audio-device', type=_device, default=None, help="input device (index or name)")
+    rec.add_argument('--audio-also', type=_device, action='append', default=[], metavar='DEVICE',
+                     help="record this input device too (index or name, e.g. a monitor of the speakers), "
+                          "at its own rate")
+    rec.add_argument('--audio-tracks', action='store_true',
+                     help="keep every audio device on its own track instead of mixing them")
+    rec.add_argument('--no-mux', action='store_true', help="separate video (OpenCV) and WAV files")
+    rec.add_argument('--vfr', action='store_true', help="skip unchanged frames, write a timecodes file (with --no-mux)")
+    rec.add_argument('--also', type=_output, action='append', default=[], metavar='NAME[:OPTION=VALUE...]',
+                     help="extra output from the same capture, e.g. window:region=0,0,1280,720:size=640x360:fps=10 "
+                          "(options: region, size, fps, codec, preset, crf, bitrate)")
+    rec.add_argument('--replay', type=float, default=0, metavar='SECONDS',
+                     help="instant replay: keep only the last SECONDS in memory, SIGUSR2 saves them")
+    rec.add_argument('--replay-mb', type=float, default=256, help="memory limit of the replay buffer")
+    rec.add_argument('--post', type=_jobs, default=(), metavar='JOBS',
+                     help="after stop, run these post-processing jobs (index,thumbnails,share)")
+    rec.add_argument('--share-height', type=int, default=720)
+    rec.add_argument('--adaptive', action='store_true',
+                     help="lower preset, frame rate and size while the machine cannot keep up")
+    rec.add_argument('--min-fps', type=float, default=None, help="adaptive frame rate floor (default: --fps)")
+    rec.add_argument('--min-scale', type=float, default=100, metavar='PERCENT',
+                     help="adaptive size floor; below 100 needs segments (default: 100)")
+    rec.add_argument('--preview-port', type=int, default=None,
+                     help="serve a live MJPEG preview on this port (0: any free port)")
+    rec.add_argument('--preview-host', default='127.0.0.1', help="address of the preview server")
+    rec.add_argument('--preview-fps', type=float, default=5.0)
+    rec.add_argument('--preview-width', type=int, default=640)
+    rec.add_argument('--segment-seconds', type=float, default=0)
+    rec.add_argument('--segment-mb', type=float, default=0)
+    rec.add_argument('--metrics', default=None, help="export metrics to this file")
+    rec.add_argument('--metrics-format', choices=('json', 'prometheus'), default='prometheus')
+    rec.add_argument('--stats-interval', type=float, default=5.0)
+    rec.add_argument('-v', '--verbose', action='store_true', help="print stats every --stats-interval")
+    rec.set_defaults(handler=record)
+
+    post_parser = commands.add_parser('post', help="seek index, thumbnails and share copy of finished recordings")
+    post_parser.add_argument('videos', nargs='+')
+    post_parser.add_argument('--jobs', type=_jobs, default=('index', 'thumbnails', 'share'))
+    post_parser.add_argument('--share-height', type=int, default=720)
+    post_parser.add_argument('--workers', type=int, default=None, help="worker processes (default: cores - 1, max 3)")
+    post_parser.set_defaults(handler=post)
+
+    recover_parser = commands.add_parser('recover', help="rebuild a segmented session from its manifest")
+    recover_parser.add_argument('manifest')
+    recover_parser.add_argument('--out', default=None, help="join the segments into this file")
+    recover_parser.set_defaults(handler=recover)
+
+    devices_parser = commands.add_parser('devices', help="list microphones and the sample rates they open with")
+    devices_parser.add_argument('--refresh', action='store_true', help="probe again even if the cache is current")
+    devices_parser.set_defaults(handler=devices)
+
+    serve_parser = commands.add_parser('serve', help="control API for several recordings (start/stop/pause/status)")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8790)
+    serve_parser.add_argument('--socket', default=None, help="listen on this Unix socket instead of TCP")
+    serve_parser.add_argument('--dir', default='.', help="directory for the recordings")
+    serve_parser.add_argument('--backend', default=None, help="capture backend shared by all sessions")
+    serve_parser.add_argument('--screen', type=_size, default=None,
+                              help="WIDTHxHEIGHT of the synthetic backend's screen")
+    serve_parser.set_defaults(handler=serve)
+
+    backends_parser = commands.add_parser('backends', help="list capture backends")
+    backends_parser.set_defaults(handler=backends)
+    return parser
+
+
+def serve(args):
+    from greenrecord.control import ControlServer
+
+    backend_options = {}
+    if args.backend == 'synthetic' and args.screen:
+        backend_options.update(width=args.screen[0], height=args.screen[1])
+    server = ControlServer(args.dir, host=args.host, port=args.port, unix_path=args.socket, backend=args.backend,
+                           backend_options=backend_options)
+    finished = threading.Event()
+
+    def stop(signum, frame):
+        finished.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.start()
+    except Exception as e:
+        print(f"Ошибка сервера управления: {e}", file=sys.stderr)
+        return 1
+    print(f"Control API on {server.address}, recordings in {server.directory} (Ctrl+C to stop)", file=sys.stderr)
+    while not finished.wait(1.0):
+        pass
+    server.stop()  # Running sessions are stopped and their files finished
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
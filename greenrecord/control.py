@@ -0,0 +1,344 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import re
+import threading
+import time
+
+from greenrecord.encoders import EncoderSettings
+
+# Control API for several recordings in one process, for scripts and lab
+# orchestration. HTTP with JSON bodies on localhost or on a Unix socket:
+#
+#   POST /sessions                  start one: {"name": "left", "region": [0, 0, 1280, 720], "fps": 30,
+#                                   "codec": "h264", "preset": "fast", "out": "left_take1"}
+#   GET  /sessions                  status of every session
+#   GET  /sessions/NAME             status of one
+#   POST /sessions/NAME/pause       (also resume, stop; stop?wait=1 returns once the file is finished)
+#   GET  /sessions/NAME/metrics     Prometheus text, ?format=json for a snapshot
+#   GET  /metrics                   snapshots of every session and the shared capture
+#
+#   curl -X POST -d '{"name": "demo", "fps": 15}' http://127.0.0.1:8790/sessions
+#   curl --unix-socket /tmp/greenrecord.sock http://localhost/sessions
+#
+# All sessions grab through one CapturePool, so overlapping regions share
+# their screen reads (see capturepool). Starting, pausing and stopping run
+# on a small thread pool, one command per session at a time; the event
+# loop only answers requests, and nothing here ever waits on a capture or
+# encoder thread. stop returns right away with state "stopping" (unless
+# ?wait=1) while the encoder finishes its queue.
+
+# JSON fields passed on to RecordingSession, with their types
+SESSION_OPTIONS = {
+    'fps': float, 'size': list, 'engine': str, 'live_mux': bool, 'audio': bool, 'audio_device': None,
+    'samplerate': int, 'queue_size': int, 'policy': str, 'vfr': bool, 'segment_seconds': float,
+    'segment_bytes': int, 'pixel_format': str, 'adaptive': bool, 'min_fps': float, 'min_scale': float,
+    'spool_bytes': int, 'preview_port': int,
+}
+ENCODER_OPTIONS = ('codec', 'preset', 'crf', 'bitrate', 'threads')
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+class ControlError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ManagedSession:
+    # A RecordingSession plus what the API reports about it
+    def __init__(self, name, session, config):
+        self.name = name
+        self.session = session
+        self.config = config
+        self.state = 'starting'
+        self.error = None
+        self.final_stats = None
+        self.created = time.time()
+        self.lock = asyncio.Lock()  # One command at a time
+        self.stopped = asyncio.Event()
+
+    def status(self):
+        session = self.session
+        stats = self.final_stats if self.final_stats is not None else session.stats()
+        status = {
+            'name': self.name,
+            'state': self.state,
+            'video': session.video_filename,
+            'region': list(session.region) if session.region else None,
+            'fps': session.fps,
+            'created': self.created,
+            'started': session.started_at,
+            'encoded': stats.get('encoded', 0),
+            'dropped': stats.get('dropped', 0),
+            'late': stats.get('late', 0),
+        }
+        if self.state in ('recording', 'paused') and session.av_clock.start is not None:
+            status['media_time'] = round(session.av_clock.media_time(time.monotonic()), 3)
+        if self.state == 'stopped':
+            status['files'] = session.recorded_files()
+        if self.error is not None:
+            status['error'] = self.error
+        return status
+
+
+class ControlServer:
+    # Serves on host:port, or on the Unix socket unix_path when given, from
+    # its own thread (start()/stop(), like preview.PreviewServer). Output
+    # files go to directory; backend/backend_options select the capture
+    # backend shared by all sessions.
+    def __init__(self, directory='.', host='127.0.0.1', port=8790, unix_path=None, backend=None,
+                 backend_options=None, workers=4):
+        self.directory = os.path.abspath(directory)
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.backend = backend
+        self.backend_options = dict(backend_options or {})
+        self.sessions = {}
+        self.pool = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="greenrecord-control")
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+        self._counter = 0
+
+    @property
+    def address(self):
+        return self.unix_path or f"http://{self.host}:{self.port}/"
+
+    def start(self):
+        from greenrecord.capturepool import CapturePool
+        os.makedirs(self.directory, exist_ok=True)
+        self.pool = CapturePool(self.backend, self.backend_options)
+        self._thread = threading.Thread(target=self._run, name="greenrecord-control", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            self.pool.close()
+            raise self._error
+
+    def stop(self):
+        # Stops every session that is still recording, then the server
+        if self._thread is None:
+            return
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._quit.set)
+        self._thread.join()
+        self._thread = None
+        self._executor.shutdown()
+        self.pool.close()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        except Exception as e:
+            self._error = e
+        finally:
+            self._loop.close()
+            self._loop = None
+            self._ready.set()
+
+    async def _serve(self):
+        self._quit = asyncio.Event()
+        if self.unix_path:
+            if os.path.exists(self.unix_path):
+                os.remove(self.unix_path)  # Left over from a previous run
+            server = await asyncio.start_unix_server(self._client, self.unix_path)
+            os.chmod(self.unix_path, 0o600)
+        else:
+            server = await asyncio.start_server(self._client, self.host, self.port)
+            self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            await self._quit.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            # A start in flight holds its session's lock until it has succeeded
+            # or failed; once it has, that session is stopped like the others
+            for managed in list(self.sessions.values()):
+                if managed.state == 'starting':
+                    async with managed.lock:
+                        pass
+            running = [managed for managed in self.sessions.values() if managed.state in ('recording', 'paused')]
+            await asyncio.gather(*(self._stop_session(managed) for managed in running))
+            await asyncio.gather(*(managed.stopped.wait() for managed in self.sessions.values()
+                                   if managed.state == 'stopping'))
+            if self.unix_path and os.path.exists(self.unix_path):
+                os.remove(self.unix_path)
+
+    async def _blocking(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    # HTTP
+
+    async def _client(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10.0)
+            lines = head.decode('latin-1').split('\r\n')
+            method, target = lines[0].split()[:2]
+            headers = {}
+            for line in lines[1:]:
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get('content-length') or 0)
+            body = await asyncio.wait_for(reader.readexactly(length), 10.0) if length else b''
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError,
+                ValueError):
+            writer.close()
+            return
+        path, _, query = target.partition('?')
+        params = dict(part.partition('=')[::2] for part in query.split('&') if part)
+        try:
+            status, result = await self._dispatch(method, path.rstrip('/') or '/', params, body)
+        except ControlError as e:
+            status, result = e.status, {'error': str(e)}
+        except Exception as e:
+            print(f"Ошибка управления: {e}")
+            status, result = 500, {'error': str(e)}
+        if isinstance(result, str):
+            payload, content_type = result.encode(), 'text/plain; version=0.0.4'
+        else:
+            payload, content_type = (json.dumps(result, indent=1) + '\n').encode(), 'application/json'
+        reason = {200: 'OK', 201: 'Created', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+                  405: 'Method Not Allowed', 409: 'Conflict', 500: 'Internal Server Error'}.get(status, 'Error')
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _dispatch(self, method, path, params, body):
+        parts = path.strip('/').split('/')
+        if path == '/metrics' and method == 'GET':
+            return 200, self.metrics()
+        if parts[0] != 'sessions':
+            raise ControlError(404, f"Unknown path: {path}")
+        if len(parts) == 1:
+            if method == 'GET':
+                return 200, {'sessions': [managed.status() for managed in self.sessions.values()]}
+            if method == 'POST':
+                try:
+                    config = json.loads(body or b'{}')
+                except ValueError as e:
+                    raise ControlError(400, f"Invalid JSON: {e}")
+                return 201, await self.start_session(config)
+            raise ControlError(405, "GET or POST")
+        managed = self.sessions.get(parts[1])
+        if managed is None:
+            raise ControlError(404, f"No session {parts[1]}")
+        command = parts[2] if len(parts) > 2 else None
+        if command is None and method == 'GET':
+            return 200, managed.status()
+        if command == 'metrics' and method == 'GET':
+            metrics = managed.session.metrics
+            if metrics is None:
+                raise ControlError(409, f"Session {managed.name} is {managed.state}")
+            if params.get('format') == 'json':
+                return 200, metrics.snapshot()
+            return 200, metrics.prometheus()
+        if method != 'POST':
+            raise ControlError(405, "POST")
+        if command in ('pause', 'resume'):
+            return 200, await self._pause_session(managed, command == 'pause')
+        if command == 'stop':
+            status = await self._stop_session(managed)
+            if params.get('wait') in ('1', 'true'):
+                await managed.stopped.wait()
+                return 200, managed.status()
+            return 202, status
+        raise ControlError(404, f"Unknown command: {command}")
+
+    # Commands
+
+    def _new_session(self, config):
+        from greenrecord.session import RecordingSession
+
+        unknown = set(config) - set(SESSION_OPTIONS) - set(ENCODER_OPTIONS) - {'name', 'out', 'region'}
+        if unknown:
+            raise ControlError(400, "Unknown options: " + ", ".join(sorted(unknown)))
+        self._counter += 1
+        name = str(config.get('name') or f"session{self._counter}")
+        if not NAME_PATTERN.match(name):
+            raise ControlError(400, f"Invalid session name: {name}")
+        if name in self.sessions and self.sessions[name].state not in ('stopped', 'failed'):
+            raise ControlError(409, f"Session {name} exists")
+        options = {'audio': False}  # Several sessions on one microphone only on request
+        for key, kind in SESSION_OPTIONS.items():
+            if key in config:
+                value = config[key]
+                try:
+                    options[key] = tuple(value) if kind is list else (kind(value) if kind else value)
+                except (TypeError, ValueError):
+                    raise ControlError(400, f"Invalid {key}: {value!r}")
+        region = config.get('region')
+        if region is not None and (not isinstance(region, list) or len(region) != 4):
+            raise ControlError(400, "region is [x, y, width, height]")
+        try:
+            encoder = EncoderSettings(**{key: config[key] for key in ENCODER_OPTIONS if key in config})
+        except (TypeError, ValueError) as e:
+            raise ControlError(400, str(e))
+        out = str(config.get('out') or f"{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+        base = os.path.join(self.directory, os.path.basename(out))
+        session = RecordingSession(base, encoder, region=tuple(region) if region else None, capture=self.pool,
+                                   **options)
+        return ManagedSession(name, session, config)
+
+    async def start_session(self, config):
+        if not isinstance(config, dict):
+            raise ControlError(400, "Expected a JSON object")
+        managed = self._new_session(config)
+        self.sessions[managed.name] = managed
+        async with managed.lock:
+            try:
+                await self._blocking(managed.session.start)
+            except Exception as e:
+                managed.state = 'failed'
+                managed.error = str(e)
+                managed.stopped.set()
+                raise ControlError(500, f"Session {managed.name} failed to start: {e}")
+            managed.state = 'recording'
+        return managed.status()
+
+    async def _pause_session(self, managed, pause):
+        async with managed.lock:
+            if managed.state not in ('recording', 'paused'):
+                raise ControlError(409, f"Session {managed.name} is {managed.state}")
+            await self._blocking(managed.session.pause if pause else managed.session.resume)
+            managed.state = 'paused' if pause else 'recording'
+        return managed.status()
+
+    async def _stop_session(self, managed):
+        if managed.state not in ('recording', 'paused'):
+            if managed.state == 'stopping':
+                return managed.status()
+            raise ControlError(409, f"Session {managed.name} is {managed.state}")
+        managed.state = 'stopping'
+        asyncio.ensure_future(self._finish_session(managed))
+        return managed.status()
+
+    async def _finish_session(self, managed):
+        async with managed.lock:
+            try:
+                managed.final_stats = await self._blocking(managed.session.stop)
+                managed.state = 'stopped'
+            except Exception as e:
+                print(f"Ошибка остановки записи {managed.name}: {e}")
+                managed.final_stats = {}
+                managed.state = 'failed'
+                managed.error = str(e)
+            managed.stopped.set()
+
+    def metrics(self):
+        sessions = {}
+        for name, managed in self.sessions.items():
+            if managed.state in ('recording', 'paused', 'stopping'):
+                sessions[name] = managed.session.metrics.snapshot()
+        return {'time': time.time(), 'capture': self.pool.stats(), 'sessions': sessions}
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+
+# Sample rates tried on every input device, in order of preference
+CANDIDATE_RATES = (48000, 44100, 96000, 32000, 22050, 16000, 8000)
+CANDIDATE_CHANNELS = (1, 2)
+
+
+def default_cache_path():
+    if sys.platform == 'win32':
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        root = os.path.expanduser('~/Library/Caches')
+    else:
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(root, 'greenrecord', 'audio_devices.json')
+
+
+def device_fingerprint(devices, hostapis=()):
+    # Identifies the set of input devices; any change (plugged in, removed,
+    # driver update changing defaults) gives a different key
+    key = [[d['name'], d['hostapi'], d['max_input_channels'], d['default_samplerate']]
+           for d in devices if d['max_input_channels'] > 0]
+    key.append([api['name'] for api in hostapis])
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def probe_device(sd, index, device, rates=CANDIDATE_RATES, channels=CANDIDATE_CHANNELS):
+    # Rates each channel count really opens with, checked by PortAudio
+    # instead of trusting default_samplerate
+    supported = {}
+    candidates = sorted(set(rates) | {int(device['default_samplerate'])}, reverse=True)
+    for count in channels:
+        if count > device['max_input_channels']:
+            continue
+        ok = []
+        for rate in candidates:
+            try:
+                sd.check_input_settings(device=index, channels=count, samplerate=rate, dtype='int16')
+            except Exception:
+                continue
+            ok.append(rate)
+        if ok:
+            supported[str(count)] = ok
+    return {
+        'index': index,
+        'name': device['name'],
+        'hostapi': device['hostapi'],
+        'max_input_channels': device['max_input_channels'],
+        'default_samplerate': int(device['default_samplerate']),
+        'rates': supported,
+    }
+
+
+class AudioDeviceService:
+    # Input device capabilities without blocking the caller. The on-disk
+    # cache is loaded at construction, so the last known devices are there
+    # at once; start() then queries PortAudio on a background thread and
+    # probes every device again only if the device list has changed since
+    # the cache was written. on_ready is called from that thread.
+    def __init__(self, cache_path=None, sd_module=None):
+        self.cache_path = cache_path or default_cache_path()
+        self._sd = sd_module
+        self.fingerprint = None
+        self.devices = []
+        self.default_input = None
+        self.error = None
+        self.ready = threading.Event()
+        self._thread = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.fingerprint = cache.get('fingerprint')
+        self.devices = cache.get('devices', [])
+        self.default_input = cache.get('default_input')
+
+    def _save(self):
+        directory = os.path.dirname(self.cache_path)
+        os.makedirs(directory, exist_ok=True)
+        temporary = self.cache_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': self.fingerprint, 'default_input': self.default_input,
+                       'devices': self.devices}, f, indent=1)
+        os.replace(temporary, self.cache_path)
+
+    @property
+    def cached(self):
+        return bool(self.devices)
+
+    def refresh(self):
+        # Synchronous; returns True if the devices were probed again
+        sd = self._sd
+        if sd is None:
+            import sounddevice as sd
+        devices = sd.query_devices()
+        try:
+            hostapis = sd.query_hostapis()
+        except Exception:
+            hostapis = ()
+        fingerprint = device_fingerprint(devices, hostapis)
+        try:
+            default_input = sd.default.device[0]
+        except Exception:
+            default_input = None
+        if default_input is not None and default_input < 0:
+            default_input = None
+        if fingerprint == self.fingerprint and default_input == self.default_input:
+            return False
+        probed = [probe_device(sd, index, device) for index, device in enumerate(devices)
+                  if device['max_input_channels'] > 0]
+        self.devices = probed
+        self.default_input = default_input
+        self.fingerprint = fingerprint
+        try:
+            self._save()
+        except OSError as e:
+            print(f"Ошибка записи кэша аудиоустройств: {e}")
+        return True
+
+    def _run(self, on_ready):
+        try:
+            self.refresh()
+        except Exception as e:
+            self.error = e
+            print(f"Ошибка опроса аудиоустройств: {e}")
+        finally:
+            self.ready.set()
+            if on_ready is not None:
+                on_ready()
+
+    def start(self, on_ready=None):
+        self._thread = threading.Thread(target=self._run, args=(on_ready,), name="greenrecord-devices",
+                                        daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def device(self, index=None):
+        # Info for a device index, the default input when None
+        index = self.default_input if index is None else index
+        for info in self.devices:
+            if info['index'] == index:
+                return info
+        return self.devices[0] if self.devices and index is None else None
+
+    def samplerates(self, device=None, channels=1):
+        info = self.device(device)
+        if info is None:
+            return []
+        return info['rates'].get(str(channels), [])
+
+    def best_samplerate(self, preferred=None, device=None, channels=1):
+        # preferred if the device opens with it, else the best verified rate;
+        # None while nothing is known about the device
+        rates = self.samplerates(device, channels)
+        if not rates:
+            return None
+        if preferred in rates:
+            return preferred
+        for rate in CANDIDATE_RATES:
+            if rate in rates:
+                return rate
+        return rates[0]
@@ -0,0 +1,77 @@
+import collections
+
+import numpy as np
+
+
+def _word_dtype(row_bytes):
+    for dtype in (np.uint64, np.uint32, np.uint16):
+        if row_bytes % np.dtype(dtype).itemsize == 0:
+            return dtype
+    return np.uint8
+
+
+class ChangeDetector:
+    # Compares each frame with the previous one tile by tile. Rows are
+    # compared as machine words (8 bytes at a time) into preallocated
+    # scratch arrays and then OR-reduced per tile, so a 1080p frame costs a
+    # couple of vectorized passes. With downsample > 1 only every n-th pixel
+    # of every n-th row is compared.
+    def __init__(self, shape, tile=32, downsample=1, history=300):
+        self.tile = tile
+        self.downsample = downsample
+        self._small = np.empty(shape, np.uint8)[::downsample, ::downsample].copy()
+        height, width = self._small.shape[:2]
+        channels = self._small.shape[2] if self._small.ndim == 3 else 1  # 4:2:0 frames are one 2-D array
+        row_bytes = width * channels
+        self._dtype = _word_dtype(row_bytes)
+        itemsize = np.dtype(self._dtype).itemsize
+        self._previous = np.zeros((height, row_bytes // itemsize), self._dtype)
+        self._changed = np.empty(self._previous.shape, bool)
+        step = max(1, tile // downsample)
+        self._rows = np.arange(0, height, step)
+        self._cols = np.unique(np.arange(0, width, step) * channels // itemsize)
+        self.tiles = (len(self._rows), len(self._cols))
+        self.dirty = np.ones(self.tiles, bool)
+        self.frames = 0
+        self.unchanged = 0
+        self.last_ratio = 1.0
+        self._ratio_sum = 0.0
+        self.history = collections.deque(maxlen=history)
+        self._primed = False
+
+    def _words(self, frame):
+        if self.downsample == 1 and frame.flags.c_contiguous:
+            small = frame
+        else:
+            np.copyto(self._small, frame[::self.downsample, ::self.downsample])
+            small = self._small
+        return small.reshape(small.shape[0], -1).view(self._dtype)
+
+    def update(self, frame, index=None):
+        # Returns the share of tiles that changed since the previous frame
+        words = self._words(frame)
+        if not self._primed:
+            self.dirty[:] = True
+            self._primed = True
+        else:
+            np.not_equal(words, self._previous, out=self._changed)
+            by_rows = np.logical_or.reduceat(self._changed, self._rows, axis=0)
+            np.logical_or.reduceat(by_rows, self._cols, axis=1, out=self.dirty)
+        np.copyto(self._previous, words)
+
+        ratio = float(self.dirty.mean())
+        self.frames += 1
+        if ratio == 0.0:
+            self.unchanged += 1
+        self.last_ratio = ratio
+        self._ratio_sum += ratio
+        self.history.append((self.frames - 1 if index is None else index, ratio))
+        return ratio
+
+    def dirty_rects(self):
+        # Changed tiles as (x, y, w, h) in full-resolution pixels
+        ys, xs = np.nonzero(self.dirty)
+        return [(int(x) * self.tile, int(y) * self.tile, self.tile, self.tile) for y, x in zip(ys, xs)]
+
+    def mean_ratio(self):
+        return self._ratio_sum / self.frames if self.frames else 0.0
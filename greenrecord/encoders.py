@@ -0,0 +1,139 @@
+# Video encoder choices. Each codec has a matching container, a FourCC for
+# the cv2.VideoWriter fallback and ffmpeg arguments per preset; presets trade
+# CPU time for file size at about the same quality ("fast" = least CPU,
+# "small" = smallest file).
+
+PRESETS = ("fast", "balanced", "small")
+
+# Segments are written as Matroska when ffmpeg is used: an unfinished .mkv
+# plays up to the last written cluster, while an .mp4 needs the index that
+# is only written on close. Every codec here fits in it.
+SEGMENT_CONTAINER = '.mkv'
+
+
+class Codec:
+    def __init__(self, name, label, ffmpeg_codec, fourcc, container, audio_codec, presets,
+                 crf_option=None, pix_fmt='yuv420p', lossless=False, fallback_fourcc=None):
+        self.name = name
+        self.label = label
+        self.ffmpeg_codec = ffmpeg_codec
+        self.fourcc = fourcc
+        self.fallback_fourcc = fallback_fourcc
+        self.container = container
+        self.audio_codec = audio_codec
+        self.presets = presets
+        self.crf_option = crf_option
+        self.pix_fmt = pix_fmt
+        self.lossless = lossless
+
+
+CODECS = {}
+
+
+def _register(codec):
+    CODECS[codec.name] = codec
+
+
+_register(Codec(
+    'h264', "H.264 (libx264)", 'libx264', 'avc1', '.mp4', ('-c:a', 'aac', '-b:a', '160k'),
+    {
+        'fast': ('-preset', 'ultrafast', '-crf', '23'),
+        'balanced': ('-preset', 'veryfast', '-crf', '23'),
+        'small': ('-preset', 'medium', '-crf', '23'),
+    },
+    # OpenCV wheels often ship without an H.264 encoder
+    crf_option='-crf', fallback_fourcc='mp4v'))
+_register(Codec(
+    'mpeg4', "MPEG-4 Part 2", 'mpeg4', 'mp4v', '.mp4', ('-c:a', 'aac', '-b:a', '160k'),
+    {
+        'fast': ('-q:v', '5'),
+        'balanced': ('-q:v', '5', '-mbd', 'bits'),
+        'small': ('-q:v', '5', '-mbd', 'rd', '-trellis', '1'),
+    },
+    crf_option='-q:v'))
+_register(Codec(
+    # Intra-only, so it costs the least CPU, at the price of large files
+    'mjpeg', "Motion JPEG (lowest CPU)", 'mjpeg', 'MJPG', '.avi', ('-c:a', 'pcm_s16le'),
+    {
+        'fast': ('-q:v', '5'),
+        'balanced': ('-q:v', '5'),
+        'small': ('-q:v', '8'),
+    },
+    crf_option='-q:v', pix_fmt='yuvj420p'))
+_register(Codec(
+    'ffv1', "FFV1 (lossless)", 'ffv1', 'FFV1', '.mkv', ('-c:a', 'flac'),
+    {
+        'fast': ('-level', '3', '-coder', '0', '-context', '0', '-g', '1', '-slices', '4'),
+        'balanced': ('-level', '3', '-coder', '1', '-context', '0', '-g', '1', '-slices', '16'),
+        'small': ('-level', '3', '-coder', '1', '-context', '1', '-g', '1', '-slices', '16'),
+    },
+    pix_fmt='yuv444p', lossless=True))
+
+
+class EncoderSettings:
+    # crf overrides the preset's quality (CRF for x264, qscale for MPEG-4 and
+    # MJPEG); bitrate (e.g. "4M") switches to average-bitrate mode instead.
+    # threads=0 lets the encoder use every core.
+    def __init__(self, codec='h264', preset='balanced', crf=None, bitrate=None, threads=0):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec}")
+        if preset not in PRESETS:
+            raise ValueError(f"Unknown encoder preset: {preset}")
+        self.codec = CODECS[codec]
+        self.preset = preset
+        self.crf = crf
+        self.bitrate = bitrate
+        self.threads = threads
+
+    @property
+    def container(self):
+        return self.codec.container
+
+    @property
+    def fourcc(self):
+        return self.codec.fourcc
+
+    @property
+    def fallback_fourcc(self):
+        return self.codec.fallback_fourcc
+
+    @property
+    def pix_fmt(self):
+        return self.codec.pix_fmt
+
+    def filename(self, base, container=None):
+        return base + (container or self.codec.container)
+
+    def video_args(self, container=None):
+        args = ['-c:v', self.codec.ffmpeg_codec]
+        preset = list(self.codec.presets[self.preset])
+        if self.codec.lossless:
+            pass  # no rate control for lossless output
+        elif self.bitrate:
+            if self.codec.crf_option in preset:
+                index = preset.index(self.codec.crf_option)
+                del preset[index:index + 2]
+            preset += ['-b:v', str(self.bitrate), '-maxrate', str(self.bitrate), '-bufsize', str(self.bitrate)]
+        elif self.crf is not None and self.codec.crf_option:
+            if self.codec.crf_option in preset:
+                preset[preset.index(self.codec.crf_option) + 1] = str(self.crf)
+            else:
+                preset += [self.codec.crf_option, str(self.crf)]
+        args += preset
+        args += ['-threads', str(self.threads), '-pix_fmt', self.codec.pix_fmt]
+        if (container or self.codec.container) == '.mp4':
+            # Index at the front so the file can be played while it downloads
+            args += ['-movflags', '+faststart']
+        return args
+
+    def audio_args(self):
+        return list(self.codec.audio_codec)
+
+    def opencv_params(self):
+        # Extra cv2.VideoWriter parameters for the fallback sink
+        import cv2
+        params = []
+        if self.codec.name == 'mjpeg' and hasattr(cv2, 'VIDEOWRITER_PROP_QUALITY'):
+            quality = {'fast': 80, 'balanced': 90, 'small': 70}[self.preset]
+            params += [cv2.VIDEOWRITER_PROP_QUALITY, quality]
+        return params
@@ -0,0 +1,351 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+from greenrecord.metrics import Metrics
+from greenrecord.pacing import AVClock, ConstantRateMapper, FramePacer
+from greenrecord.pipeline import BLOCK, DROP_NEWEST, POLICIES, EncoderWorker, Frame, PauseGate
+
+# Capture once, encode many: one grab per tick goes into a shared buffer and
+# every output pipeline (own crop, scale, frame rate and encoder) reads it.
+#
+#   capture -> SharedFrames --> OutputPipeline (full screen, 30 fps, h264)
+#                           \-> OutputPipeline (window crop, 1280x720, 10 fps)
+
+
+def union_region(regions):
+    # Bounding box of all regions; None (full screen) if any of them is
+    boxes = []
+    for region in regions:
+        if not region or region[2] <= 0 or region[3] <= 0:
+            return None
+        boxes.append(region)
+    left = min(x for x, y, w, h in boxes)
+    top = min(y for x, y, w, h in boxes)
+    right = max(x + w for x, y, w, h in boxes)
+    bottom = max(y + h for x, y, w, h in boxes)
+    return (left, top, right - left, bottom - top)
+
+
+def relative_region(region, captured):
+    # region (screen coordinates) inside the captured rectangle
+    if not region or region[2] <= 0 or region[3] <= 0:
+        return None
+    return (region[0] - captured[0], region[1] - captured[1], region[2], region[3])
+
+
+class SharedFrames:
+    # Capture buffers shared by every output. A published frame carries a
+    # reference count (the outputs that took it) and its slot is reused once
+    # the last of them has released it. Outputs only see read-only views, so
+    # none of them can change a frame that another one is still reading.
+    def __init__(self, shape, size, dtype=np.uint8):
+        self.buffers = [np.empty(shape, dtype) for _ in range(size)]
+        self.views = []
+        for buffer in self.buffers:
+            view = buffer.view()
+            view.flags.writeable = False
+            self.views.append(view)
+        self._refs = [0] * size
+        self._free = collections.deque(range(size))
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def acquire(self):
+        # A free slot for the next grab, None once closed
+        with self._cond:
+            while not self._free and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            return self._free.popleft()
+
+    def share(self, slot, count):
+        # Set before the frame is offered, an output may release it right away
+        with self._cond:
+            self._refs[slot] = count
+            if count == 0:
+                self._free.append(slot)
+                self._cond.notify_all()
+
+    def release(self, slot):
+        with self._cond:
+            self._refs[slot] -= 1
+            if self._refs[slot] <= 0:
+                self._refs[slot] = 0
+                self._free.append(slot)
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FrameDecimator:
+    # Lets frames through at `fps` out of a faster capture
+    def __init__(self, fps):
+        self.interval = 1.0 / fps
+        self.next_due = None
+        self.skipped = 0
+
+    def accept(self, timestamp):
+        # A quarter interval of slack, capture ticks jitter around the due time
+        if self.next_due is not None and timestamp < self.next_due - self.interval * 0.25:
+            self.skipped += 1
+            return False
+        if self.next_due is None or timestamp - self.next_due > self.interval:
+            self.next_due = timestamp + self.interval  # First frame, or after a pause or stall
+        else:
+            self.next_due += self.interval
+        return True
+
+
+class OutputPipeline:
+    # One output of a FanOutEngine: decimation, crop/scale and encoding on its
+    # own thread, so a slow encoder only holds up its own output. When its
+    # queue is full the output drops its oldest frame (drop_newest: the new
+    # one); block is treated as drop_oldest, since waiting would hold up the
+    # shared capture thread and with it every other output. To the
+    # EncoderWorker it looks like a FrameQueue whose buffers are the shared
+    # read-only frames plus one scratch buffer: an output without crop/scale
+    # encodes the shared frame itself, one with a transform copies only its
+    # own (usually smaller) result and releases the shared frame at once.
+    def __init__(self, name, sink, fps, transform=None, detector=None, vfr=False, queue_size=4, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.name = name
+        self.sink = sink
+        self.fps = fps
+        self.transform = transform
+        self.detector = detector
+        self.vfr = vfr
+        self.queue_size = queue_size
+        self.policy = policy
+        self.decimator = FrameDecimator(fps)
+        self.dropped = 0
+        self.buffers = None
+        self.mapper = None
+        self.worker = None
+        self._shared = None
+        self._scratch_slot = None
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def attach(self, shared, shape, av_clock, metrics):
+        if self.transform is not None and self.transform.is_identity(shape):
+            self.transform = None
+        self._shared = shared
+        self.buffers = list(shared.views)
+        if self.transform is not None:
+            self._scratch_slot = len(self.buffers)
+            self.buffers.append(np.empty(self.transform.out_shape, np.uint8))
+        self.metrics = metrics
+        self.mapper = ConstantRateMapper(self.fps, av_clock)
+        self.worker = EncoderWorker(self.sink, self, self.mapper, self.detector, self.vfr, metrics=metrics)
+        self.worker.name = f"greenrecord-encoder-{self.name}"
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def offer(self, frame):
+        # Called by the capture thread; False if the output did not take the frame
+        with self._cond:
+            if len(self._pending) >= self.queue_size and not self._closed:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                self._shared.release(self._pending.popleft().slot)
+                self.dropped += 1
+            if self._closed:
+                return False
+            self._pending.append(frame)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._cond.wait(timeout)
+                if timeout is not None and not self._pending:
+                    return None
+            frame = self._pending.popleft()
+            self._cond.notify_all()
+        if self.transform is None:
+            return frame
+        started = time.perf_counter()
+        try:
+            self.transform.apply(self._shared.views[frame.slot], self.buffers[self._scratch_slot])
+        finally:
+            self._shared.release(frame.slot)
+        self.metrics.observe('convert', time.perf_counter() - started)
+        return Frame(self._scratch_slot, frame.index, frame.timestamp)
+
+    def release(self, slot):
+        if slot != self._scratch_slot:
+            self._shared.release(slot)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            if threading.current_thread() is self.worker:
+                # The encoder failed: what it will never take goes back to capture
+                while self._pending:
+                    self._shared.release(self._pending.popleft().slot)
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            'encoded': self.worker.encoded,
+            'dropped': self.dropped,
+            'duplicated': self.mapper.duplicated,
+            'skipped': self.mapper.dropped,
+            'decimated': self.decimator.skipped,
+            'unchanged': self.worker.unchanged,
+            'dirty_ratio': self.detector.last_ratio if self.detector else None,
+            'dirty_mean': self.detector.mean_ratio() if self.detector else None,
+            'queue_depth': self.depth(),
+        }
+
+
+class FanOutCaptureWorker(threading.Thread):
+    def __init__(self, source, shared, outputs, fps, stop_event, pause_event, metrics):
+        super().__init__(name="greenrecord-capture", daemon=True)
+        self.source = source
+        self.shared = shared
+        self.outputs = outputs
+        self.metrics = metrics
+        self.pacer = FramePacer(fps)
+        self.stop_event = stop_event
+        self.pause_event = pause_event
+        self.captured = 0
+        self.late = 0
+        self.error = None
+
+    def run(self):
+        try:
+            self._loop()
+        except Exception as e:
+            self.error = e
+            print(f"Ошибка захвата видео: {e}")
+        finally:
+            for output in self.outputs:
+                output.close()
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            if self.pause_event.is_set():
+                self.pause_event.wait()
+                self.pacer.reset()
+                continue
+            takers = [output for output in self.outputs if not output.closed]
+            if not takers:
+                break
+            started = time.perf_counter()
+            slot = self.shared.acquire()
+            grabbed = time.perf_counter()
+            self.metrics.observe('acquire', grabbed - started)
+            if slot is None:
+                break
+            timestamp = time.monotonic()
+            try:
+                self.source.grab_into(self.shared.buffers[slot])
+            except Exception:
+                self.shared.share(slot, 0)
+                raise
+            self.metrics.observe('grab', time.perf_counter() - grabbed)
+            frame = Frame(slot, self.captured, timestamp)
+            takers = [output for output in takers if output.decimator.accept(timestamp)]
+            self.shared.share(slot, len(takers))
+            for output in takers:
+                if not output.offer(frame):
+                    self.shared.release(slot)
+            self.captured += 1
+            self.late += self.pacer.wait()
+
+
+class FanOutEngine:
+    # RecordingEngine for several outputs: one capture thread grabs at the
+    # highest output frame rate into SharedFrames, each OutputPipeline takes
+    # the frames it needs. Capture cost stays the same however many outputs
+    # there are. The first output's stats keep the RecordingEngine names
+    # (and its stages the plain ones), the others are prefixed with their name.
+    def __init__(self, source, outputs, fps=None, queue_size=4, av_clock=None, metrics=None):
+        if not outputs:
+            raise ValueError("FanOutEngine needs at least one output")
+        self.source = source
+        self.outputs = list(outputs)
+        self.fps = fps or max(output.fps for output in self.outputs)
+        self.av_clock = av_clock or AVClock()
+        self.metrics = metrics or Metrics()
+        self.metrics.add_source(self.stats)
+        # A slow output holds at most a full queue plus the frame it encodes;
+        # two slots for each of the others (one queued, one encoding) keep
+        # capture from waiting on the slow one for a free slot
+        self.shared = SharedFrames(source.shape, queue_size + 2 * len(self.outputs) - 1)
+        for index, output in enumerate(self.outputs):
+            scope = self.metrics if index == 0 else self.metrics.scoped(output.name)
+            output.attach(self.shared, source.shape, self.av_clock, scope)
+        self._stop = threading.Event()
+        self._pause = PauseGate()
+        self.capture_worker = FanOutCaptureWorker(source, self.shared, self.outputs, self.fps, self._stop,
+                                                  self._pause, self.metrics)
+
+    def start(self):
+        if self.av_clock.start is None:
+            self.av_clock.begin()
+        for output in self.outputs:
+            output.worker.start()
+        self.capture_worker.start()
+
+    def pause(self):
+        self._pause.set()
+        self.av_clock.pause()
+
+    def resume(self):
+        self.av_clock.resume()
+        self._pause.clear()
+
+    @property
+    def is_paused(self):
+        return self._pause.is_set()
+
+    def set_fps(self, fps):
+        # Capture rate; outputs slower than that keep decimating to their own
+        self.capture_worker.pacer.set_fps(max([fps] + [output.fps for output in self.outputs[1:]]))
+
+    @property
+    def is_running(self):
+        return self.capture_worker.is_alive() or any(output.worker.is_alive() for output in self.outputs)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._pause.clear()
+        self.capture_worker.join(timeout)
+        for output in self.outputs:
+            output.close()
+        for output in self.outputs:
+            output.worker.join(timeout)
+        self.shared.close()
+        self.source.close()
+
+    def stats(self):
+        stats = {
+            'captured': self.capture_worker.captured,
+            'late': self.capture_worker.late,
+            'av_drift': self.av_clock.drift(),
+        }
+        for index, output in enumerate(self.outputs):
+            prefix = '' if index == 0 else output.name + '_'
+            stats.update({prefix + key: value for key, value in output.stats().items()})
+        return stats
@@ -0,0 +1,176 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Upper bounds (seconds) of the duration histogram buckets, shared by every
+# stage so the Prometheus output has one fixed set of "le" labels
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+class StageHistogram:
+    # Durations of one pipeline stage. Bucket counts, sum and count grow for
+    # the whole recording (Prometheus histogram semantics); the percentiles
+    # come from the last `window` samples only, so the live readout follows
+    # what the pipeline does now. One thread observes, others only read.
+    def __init__(self, window=512):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self._recent = np.zeros(window)
+        self._window = window
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self._recent[self.count % self._window] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def recent(self):
+        return self._recent[:min(self.count, self._window)].copy()
+
+    def snapshot(self):
+        recent = self.recent()
+        if not len(recent):
+            return {'count': 0}
+        p50, p90, p99 = np.percentile(recent, (50, 90, 99)) * 1000.0
+        return {
+            'count': self.count,
+            'mean_ms': round(recent.mean() * 1000.0, 3),
+            'p50_ms': round(p50, 3),
+            'p90_ms': round(p90, 3),
+            'p99_ms': round(p99, 3),
+            'max_ms': round(self.maximum * 1000.0, 3),
+        }
+
+
+class Metrics:
+    # Stage timings plus the counters and gauges of whatever registered a
+    # stats() source (engine, audio recorder). Hooks are a perf_counter()
+    # pair around the stage and an observe() call:
+    #
+    #   started = time.perf_counter()
+    #   source.grab_into(buffer)
+    #   metrics.observe('grab', time.perf_counter() - started)
+    def __init__(self, window=512):
+        self.window = window
+        self.stages = {}
+        self._sources = []
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        histogram = self.stages.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(name, StageHistogram(self.window))
+        return histogram
+
+    def observe(self, name, seconds):
+        self.stage(name).observe(seconds)
+
+    def scoped(self, prefix):
+        # Same histograms under '<prefix>_<stage>', for one of several outputs
+        return ScopedMetrics(self, prefix)
+
+    def add_source(self, stats):
+        # stats() returns a flat dict of numbers (None = not available)
+        self._sources.append(stats)
+
+    def counters(self):
+        values = {}
+        for stats in self._sources:
+            try:
+                values.update(stats())
+            except Exception as e:
+                print(f"Ошибка сбора статистики: {e}")
+        return values
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'stages': {name: histogram.snapshot() for name, histogram in list(self.stages.items())},
+            'counters': self.counters(),
+        }
+
+    def prometheus(self, prefix='greenrecord'):
+        # Prometheus text exposition format (version 0.0.4)
+        lines = [f'# HELP {prefix}_stage_seconds Duration of each recording pipeline stage.',
+                 f'# TYPE {prefix}_stage_seconds histogram']
+        for name, histogram in sorted(self.stages.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), histogram.buckets):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {histogram.total!r}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+        for name, value in sorted(self.counters().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name} {value!r}')
+        return '\n'.join(lines) + '\n'
+
+
+class ScopedMetrics:
+    def __init__(self, metrics, prefix):
+        self.metrics = metrics
+        self.prefix = prefix
+
+    def stage(self, name):
+        return self.metrics.stage(f"{self.prefix}_{name}")
+
+    def observe(self, name, seconds):
+        self.metrics.observe(f"{self.prefix}_{name}", seconds)
+
+
+class MetricsExporter:
+    # Rewrites a JSON or Prometheus-text file every `interval` seconds (and
+    # once more on stop). The file is replaced atomically, so a collector
+    # (e.g. node_exporter's textfile collector) never reads half a file.
+    def __init__(self, metrics, path, format='json', interval=5.0):
+        if format not in ('json', 'prometheus'):
+            raise ValueError(f"Unknown metrics format: {format}")
+        self.metrics = metrics
+        self.path = path
+        self.format = format
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        if self.format == 'json':
+            text = json.dumps(self.metrics.snapshot(), indent=2)
+        else:
+            text = self.metrics.prometheus()
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temporary, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Ошибка экспорта метрик: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="greenrecord-metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.write()
+        except OSError as e:
+            print(f"Ошибка экспорта метрик: {e}")
@@ -0,0 +1,344 @@
+import threading
+import time
+
+import numpy as np
+
+from greenrecord.audio import AudioRingBuffer, WavFileSink
+
+# Several input devices in one recording, e.g. the microphone and the
+# system output (a PulseAudio/PipeWire monitor source):
+#
+#   mic     48000 Hz -> ring -> resampler ---------------------\
+#   monitor 44100 Hz -> ring -> resampler (drift-corrected) -> FIFO -> mix / tracks -> sink
+#
+# Every device runs at its native rate and on its own clock. The first
+# input is the master: its blocks drive the output and its samples are the
+# recording's audio timeline (AVClock). The others are resampled to the
+# output rate and their FIFO level steers a small correction of their
+# resampling ratio, so a device whose crystal runs a little fast or slow
+# neither drifts away nor over/underruns. All of it is block-wise numpy.
+
+# Drift controller gains (per second of FIFO level error)
+DRIFT_KP = 0.2
+DRIFT_KI = 0.02
+DRIFT_SMOOTHING = 2.0  # seconds
+
+
+class AudioInputSpec:
+    # device as sounddevice takes it (index, name or None for the default);
+    # samplerate / channels None: the device's own (see resolve_inputs)
+    def __init__(self, device=None, samplerate=None, channels=None):
+        self.device = device
+        self.samplerate = samplerate
+        self.channels = channels
+
+    def __repr__(self):
+        return f"AudioInputSpec({self.device!r}, {self.samplerate}, {self.channels})"
+
+
+def resolve_inputs(specs, sd=None, default_samplerate=48000):
+    # Fills in native rates and channel counts (at most stereo) from
+    # PortAudio; without device info the rate is default_samplerate, mono
+    if sd is None:
+        import sounddevice as sd
+    resolved = []
+    for spec in specs:
+        samplerate, channels = spec.samplerate, spec.channels
+        if samplerate is None or channels is None:
+            try:
+                info = sd.query_devices(spec.device, 'input')
+            except Exception:
+                info = None
+            if samplerate is None:
+                samplerate = int(info['default_samplerate']) if info else default_samplerate
+            if channels is None:
+                channels = min(2, int(info['max_input_channels'])) if info else 1
+        resolved.append(AudioInputSpec(spec.device, int(samplerate), max(1, int(channels))))
+    return resolved
+
+
+class StreamingResampler:
+    # Linear interpolation over a continuous stream, one block at a time.
+    # The output phase and the last input sample carry over to the next
+    # block, so block boundaries leave no clicks and no samples are lost.
+    # set_correction() stretches the ratio by a few hundred ppm for drift
+    # compensation. Linear interpolation is cheap and plenty for speech and
+    # system sound; it does not low-pass, so content right below the input
+    # Nyquist frequency aliases slightly when rates go down.
+    def __init__(self, in_rate, out_rate, channels):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.base_step = in_rate / out_rate  # input frames per output frame
+        self.step = self.base_step
+        self._last = np.zeros((1, channels), np.float32)
+        self._phase = 1.0  # position of the next output in [last, block...] coordinates
+        self._extended = np.zeros((0, channels), np.float32)
+
+    def set_correction(self, correction):
+        self.step = self.base_step * correction
+
+    def process(self, block):
+        # block: (frames, channels) float32; returns the resampled frames
+        count = len(block)
+        if not count:
+            return block[:0]
+        if len(self._extended) < count + 1:
+            self._extended = np.empty((count + 1, block.shape[1]), np.float32)
+        extended = self._extended[:count + 1]
+        extended[0] = self._last[0]
+        extended[1:] = block
+        # Outputs at phase + k * step while there is a sample on both sides
+        outputs = max(0, int(np.ceil((count - self._phase) / self.step)))
+        positions = self._phase + np.arange(outputs) * self.step
+        index = positions.astype(np.intp)
+        fraction = (positions - index).astype(np.float32)[:, None]
+        out = extended[index] + (extended[index + 1] - extended[index]) * fraction
+        self._phase += outputs * self.step - count
+        self._last[0] = block[-1]
+        return out
+
+
+class _Input:
+    # One device: PortAudio stream -> raw ring -> (mixer thread) resampler -> FIFO
+    def __init__(self, recorder, index, spec, blocksize, buffer_seconds):
+        self.recorder = recorder
+        self.index = index
+        self.spec = spec
+        self.samplerate = spec.samplerate
+        self.channels = spec.channels
+        self.ring = AudioRingBuffer(max(blocksize * 2, int(spec.samplerate * buffer_seconds)), spec.channels)
+        self.resampler = StreamingResampler(spec.samplerate, recorder.samplerate, spec.channels)
+        self.fifo = AudioRingBuffer(max(blocksize * 4, int(recorder.samplerate * buffer_seconds)), spec.channels,
+                                    np.float32)
+        self.chunk = np.empty((max(blocksize, spec.samplerate // 10), spec.channels), np.int16)
+        self.stream = None
+        self.overflows = 0
+        self.underflows = 0
+        self.frames_captured = 0
+        self.paused_frames = 0
+        self.underruns = 0  # output frames filled with silence
+        self.correction = 1.0
+        self.primed = False
+        self._level = None
+        self._integral = 0.0
+
+    def callback(self, indata, frames, time_info, status):
+        timestamp = time.monotonic() - frames / self.samplerate
+        if status:
+            if status.input_overflow:
+                self.overflows += 1
+            if status.input_underflow:
+                self.underflows += 1
+        paused_at = self.recorder.paused_at
+        if paused_at is not None:
+            keep = min(frames, max(0, int((paused_at - timestamp) * self.samplerate)))
+            self.paused_frames += frames - keep
+            if not keep:
+                return
+            indata = indata[:keep]
+        stored = self.ring.write(indata)
+        self.frames_captured += stored
+        if self.index == 0 and self.recorder.av_clock is not None:
+            self.recorder.av_clock.add_audio(stored, self.samplerate, timestamp)
+
+    def pull(self):
+        # Moves everything the device delivered through the resampler into the FIFO
+        while True:
+            count = self.ring.read_into(self.chunk, timeout=0)
+            if not count:
+                return
+            self.fifo.write(self.resampler.process(self.chunk[:count] * np.float32(1.0 / 32768.0)))
+
+    def take(self, out, target):
+        # Fills out from the FIFO (silence for what is missing) and steers the
+        # resampling ratio so that about `target` frames stay buffered
+        if not self.primed:
+            if self.fifo.available() < target + len(out):  # Still at target after this read
+                out[:] = 0.0
+                return
+            self.primed = True
+        count = self.fifo.read_into(out, timeout=0)
+        if count < len(out):
+            out[count:] = 0.0
+            self.underruns += len(out) - count
+        # The level saws up and down by a device block with every callback;
+        # averaged over DRIFT_SMOOTHING seconds only the drift is left
+        level = self.fifo.available()
+        seconds = len(out) / self.recorder.samplerate
+        if self._level is None:
+            self._level = level
+        else:
+            self._level += min(1.0, seconds / DRIFT_SMOOTHING) * (level - self._level)
+        # PI control on the level error in seconds; a fast device fills the
+        # FIFO, so it gets a larger step (fewer outputs per input). The
+        # integral is what ends up holding the drift.
+        error = (self._level - target) / self.recorder.samplerate
+        limit = self.recorder.max_correction
+        integral = self._integral + DRIFT_KI * error * seconds
+        adjust = DRIFT_KP * error + integral
+        if abs(adjust) < limit:
+            self._integral = integral  # No wind-up while the correction is clamped
+        self.correction = 1.0 + min(max(adjust, -limit), limit)
+        self.resampler.set_correction(self.correction)
+
+
+class MultiSourceRecorder:
+    # AudioRecorder for several devices (see the top of this module). Same
+    # interface: start(), pause(at), resume(), stop(), stats(). With
+    # tracks=False the inputs are mixed (mono inputs are spread over stereo,
+    # stereo is averaged for a mono mix); with tracks=True each input keeps
+    # its own channels, side by side in one interleaved stream, and
+    # track_layout() tells the sink how to split it into audio tracks.
+    def __init__(self, filename, samplerate, inputs, tracks=False, blocksize=1024, latency='low',
+                 buffer_seconds=2.0, av_clock=None, sd_module=None, sink=None, metrics=None,
+                 max_correction=0.005):
+        if not inputs:
+            raise ValueError("MultiSourceRecorder needs at least one input")
+        if sd_module is None:
+            import sounddevice as sd_module
+        self._sd = sd_module
+        self.filename = filename
+        self.samplerate = int(samplerate)
+        self.tracks = tracks
+        self.blocksize = blocksize
+        self.latency = latency
+        self.av_clock = av_clock
+        self.sink = sink
+        self.max_correction = max_correction
+        self.inputs = [_Input(self, index, spec, blocksize, buffer_seconds) for index, spec in enumerate(inputs)]
+        self.channels = output_channels(inputs, tracks)
+        self.frames_written = 0
+        self.error = None
+        self.paused_at = None
+        # Frames kept in each secondary FIFO: enough to ride out a couple of
+        # device blocks arriving late
+        self.target = int(3 * blocksize * self.samplerate / min(spec.samplerate for spec in inputs))
+        self._mixer = None
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.add_source(self.stats)
+
+    def track_layout(self):
+        return [spec.channels for spec in (source.spec for source in self.inputs)] if self.tracks else None
+
+    def start(self):
+        if self.sink is None:
+            self.sink = WavFileSink(self.filename, self.samplerate, self.channels)
+        self._mixer = threading.Thread(target=self._mix_loop, name="greenrecord-audio-mixer", daemon=True)
+        self._mixer.start()
+        try:
+            for source in self.inputs:
+                source.stream = self._sd.InputStream(
+                    samplerate=source.samplerate, channels=source.channels, dtype='int16',
+                    blocksize=self.blocksize, latency=self.latency, device=source.spec.device,
+                    callback=source.callback)
+                source.stream.start()
+        except Exception:
+            self.stop()
+            raise
+
+    def pause(self, at=None):
+        if self.paused_at is not None:
+            return
+        self.paused_at = time.monotonic() if at is None else at
+        for source in self.inputs:
+            if source.stream is not None:
+                source.stream.stop()
+
+    def resume(self):
+        if self.paused_at is None:
+            return
+        self.paused_at = None
+        for source in self.inputs:
+            if source.stream is not None:
+                source.stream.start()
+
+    @property
+    def is_paused(self):
+        return self.paused_at is not None
+
+    def _mix_loop(self):
+        master, others = self.inputs[0], self.inputs[1:]
+        scale = np.float32(1.0 / 32768.0)
+        buffers = {}
+        try:
+            while not master.ring.drained:
+                count = master.ring.read_into(master.chunk, timeout=0.2)
+                if not count:
+                    continue
+                started = time.perf_counter()
+                blocks = [master.resampler.process(master.chunk[:count] * scale)]
+                frames = len(blocks[0])
+                for source in others:
+                    source.pull()
+                    block = buffers.get(source.index)
+                    if block is None or len(block) < frames:
+                        block = buffers[source.index] = np.empty((max(frames, len(master.chunk) * 2),
+                                                                  source.channels), np.float32)
+                    source.take(block[:frames], self.target)
+                    blocks.append(block[:frames])
+                if frames:
+                    self.sink.write(self._combine(blocks, frames))
+                    self.frames_written += frames
+                if self.metrics is not None:
+                    self.metrics.observe('audio_mix', time.perf_counter() - started)
+        except Exception as e:
+            self.error = e
+            print(f"Ошибка сведения аудио: {e}")
+        finally:
+            self.sink.close()
+
+    def _combine(self, blocks, frames):
+        out = np.empty((frames, self.channels), np.float32)
+        if self.tracks:
+            offset = 0
+            for block in blocks:
+                out[:, offset:offset + block.shape[1]] = block
+                offset += block.shape[1]
+        else:
+            out[:] = 0.0
+            for block in blocks:
+                if block.shape[1] == self.channels:
+                    out += block
+                elif block.shape[1] == 1:
+                    out += block  # Broadcast over every output channel
+                else:
+                    out += block.mean(axis=1, keepdims=True)
+        np.clip(out, -1.0, 32767.0 / 32768.0, out=out)
+        return (out * 32768.0).astype(np.int16)
+
+    def stop(self):
+        for source in self.inputs:
+            if source.stream is not None:
+                source.stream.stop()
+                source.stream.close()
+                source.stream = None
+        for source in self.inputs:
+            source.ring.close()
+        if self._mixer is not None:
+            self._mixer.join()
+            self._mixer = None
+
+    def stats(self):
+        master = self.inputs[0]
+        stats = {
+            'audio_frames': self.frames_written,
+            'audio_overflows': sum(source.overflows for source in self.inputs),
+            'audio_underflows': sum(source.underflows for source in self.inputs),
+            'audio_overruns': sum(source.ring.overruns + source.fifo.overruns for source in self.inputs),
+            'audio_buffered': master.ring.available(),
+            'audio_paused_frames': master.paused_frames,
+        }
+        for source in self.inputs[1:]:
+            prefix = f'audio_{source.index}_'
+            stats[prefix + 'drift_ppm'] = round((source.correction - 1.0) * 1e6, 1)
+            stats[prefix + 'underruns'] = source.underruns
+            stats[prefix + 'buffered'] = source.fifo.available()
+        return stats
+
+
+def output_channels(inputs, tracks=False):
+    # Channels of the recorded stream: all inputs side by side, or the widest one
+    if tracks:
+        return sum(spec.channels for spec in inputs)
+    return max(spec.channels for spec in inputs)
@@ -0,0 +1,379 @@
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from greenrecord.pacing import AVClock, ConstantRateMapper, FramePacer
+from greenrecord.pipeline import BLOCK, DROP_NEWEST, DROP_OLDEST, POLICIES
+
+# Process-based variant of RecordingEngine. Capture, conversion (crop/scale)
+# and encoding each run in their own process, so per-frame Python work does
+# not compete for the GIL with the Qt UI or the audio callback. Frames live
+# in pools of multiprocessing.shared_memory slots; the queues only carry
+# (slot, index, timestamp) tuples and free slot numbers.
+
+# Indexes into the shared counter array
+CAPTURED, LATE, DROPPED, CONVERTED, ENCODED, DUPLICATED, SKIPPED, UNCHANGED = range(8)
+_COUNTERS = 8
+
+# Shared clock state published by the parent: start, time paused before the
+# latest pause, that pause's start and end (NaN: none yet / still paused), drift
+_CLOCK_FIELDS = 5
+
+
+class SharedFramePool:
+    # One shared memory block split into equally sized frame slots
+    def __init__(self, shape, slots, name=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_bytes = int(np.prod(self.shape))
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=frame_bytes * slots)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self.name = self._shm.name
+        self.buffers = np.ndarray((slots,) + self.shape, np.uint8, buffer=self._shm.buf)
+
+    def spec(self):
+        return (self.shape, self.slots, self.name)
+
+    @classmethod
+    def attach(cls, spec):
+        shape, slots, name = spec
+        return cls(shape, slots, name)
+
+    def close(self):
+        self.buffers = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class _ClockView:
+    # Read-only AVClock stand-in for the encoder process. As in AVClock only
+    # pauses before the timestamp count, so a frame grabbed before a pause
+    # and encoded after the resume keeps its place; only the latest pause is
+    # known here, which covers every frame still queued at a resume.
+    def __init__(self, state):
+        self._state = state
+
+    def media_time(self, timestamp):
+        start, paused, began, ended, drift = self._state[:]
+        if not math.isnan(began) and began < timestamp:
+            paused += (timestamp if math.isnan(ended) else min(ended, timestamp)) - began
+        return timestamp - start - paused + drift
+
+
+def _acquire(free, ready, policy, counters, stop):
+    # Backpressure at the capture stage, same policies as FrameQueue
+    if policy == DROP_NEWEST:
+        try:
+            return free.get_nowait()
+        except queue.Empty:
+            counters[DROPPED] += 1
+            return None
+    if policy == DROP_OLDEST:
+        try:
+            return free.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            item = ready.get_nowait()
+        except queue.Empty:
+            item = None
+        if item is not None:
+            counters[DROPPED] += 1
+            return item[0]
+    while not stop.is_set():
+        try:
+            return free.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+
+# Every stage sets itself up inside its try, so whatever fails, the None
+# sentinel still goes downstream and stop() does not wait forever.
+
+
+def _capture_main(backend, options, pool_spec, free, ready, fps, policy, stop, running, counters, target_fps):
+    from greenrecord.capture import create_backend
+    source = pool = None
+    try:
+        source = create_backend(backend, **options)
+        pool = SharedFramePool.attach(pool_spec)
+        pacer = FramePacer(fps)
+        index = 0
+        while not stop.is_set():
+            if not running.is_set():
+                # Paused: parked on the event until resume or stop
+                running.wait()
+                pacer.reset()
+                continue
+            if target_fps.value != pacer.fps:
+                pacer.set_fps(target_fps.value)
+            slot = _acquire(free, ready, policy, counters, stop)
+            if slot is not None:
+                timestamp = time.monotonic()
+                source.grab_into(pool.buffers[slot])
+                ready.put((slot, index, timestamp))
+                index += 1
+                counters[CAPTURED] += 1
+            counters[LATE] += pacer.wait()
+    except Exception as e:
+        print(f"Ошибка захвата видео: {e}")
+    finally:
+        ready.put(None)
+        if source is not None:
+            source.close()
+        if pool is not None:
+            pool.close()
+
+
+def _free_slot(free, encoder_done):
+    # A slot the encoder gave back; None once the encoder is gone and never will
+    while True:
+        try:
+            return free.get(timeout=0.1)
+        except queue.Empty:
+            if encoder_done.is_set():
+                return None
+
+
+def _convert_main(transform_args, raw_spec, out_spec, raw_free, raw_ready, out_free, out_ready, counters,
+                  encoder_done):
+    from greenrecord.transform import FrameTransform
+    raw = out = None
+    try:
+        raw = SharedFramePool.attach(raw_spec)
+        out = SharedFramePool.attach(out_spec)
+        transform = FrameTransform(*transform_args)
+        while True:
+            item = raw_ready.get()
+            if item is None:
+                break
+            slot, index, timestamp = item
+            out_slot = _free_slot(out_free, encoder_done)
+            if out_slot is None:
+                raw_free.put(slot)
+                break
+            transform.apply(raw.buffers[slot], out.buffers[out_slot])
+            raw_free.put(slot)
+            out_ready.put((out_slot, index, timestamp))
+            counters[CONVERTED] += 1
+    except Exception as e:
+        print(f"Ошибка преобразования кадра: {e}")
+    finally:
+        out_ready.put(None)
+        if raw is not None:
+            raw.close()
+        if out is not None:
+            out.close()
+
+
+def _encode_main(sink_factory, pool_spec, free, ready, fps, clock_state, counters, encoder_done,
+                 vfr=False, timecodes=None, change_tile=None, segments=None):
+    from greenrecord.dirty import ChangeDetector
+    from greenrecord.segments import SegmentedSink
+    from greenrecord.sinks import TimecodeSink
+    pool = sink = None
+    try:
+        pool = SharedFramePool.attach(pool_spec)
+        clock = _ClockView(clock_state)
+        mapper = ConstantRateMapper(fps, clock)
+        detector = ChangeDetector(pool.shape, tile=change_tile) if change_tile else None
+        if segments:
+            # sink_factory(filename) then makes one segment
+            sink = SegmentedSink(sink_factory, av_clock=clock, **segments)
+        else:
+            sink = sink_factory()
+        if timecodes:
+            sink = TimecodeSink(sink, timecodes, clock)
+        last_written = None
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            slot, index, timestamp = item
+            buffer = pool.buffers[slot]
+            try:
+                if detector is not None:
+                    ratio = detector.update(buffer, index)
+                    if vfr and ratio == 0.0 and last_written is not None and timestamp - last_written < 1.0:
+                        counters[UNCHANGED] += 1
+                        continue
+                if vfr:
+                    sink.write(buffer, timestamp)
+                else:
+                    repeats = mapper.repeats(timestamp)
+                    for _ in range(repeats):
+                        sink.write(buffer, timestamp)
+                    counters[DUPLICATED] = mapper.duplicated
+                    counters[SKIPPED] = mapper.dropped
+                last_written = timestamp
+                counters[ENCODED] += 1
+            finally:
+                free.put(slot)
+    except Exception as e:
+        print(f"Ошибка кодирования видео: {e}")
+    finally:
+        # Upstream stops waiting for slots from here on
+        encoder_done.set()
+        try:
+            if sink is not None:
+                sink.close()
+        finally:
+            if pool is not None:
+                pool.close()
+
+
+class MultiProcessEngine:
+    # Same control surface as RecordingEngine (start/pause/resume/stop/stats).
+    # The backend is given by name and created inside the capture process;
+    # sink_factory must be picklable (a class or functools.partial of one)
+    # and is called inside the encoder process. segments holds SegmentedSink
+    # keyword arguments (base, extension, segment_seconds, segment_bytes);
+    # the audio of a segmented recording is not split across processes, so
+    # it goes to its own file. Stage timings stay in the worker processes;
+    # `metrics` only gets the shared counters through stats().
+    def __init__(self, backend, backend_options, source_shape, sink_factory, fps=20.0,
+                 queue_size=4, policy=BLOCK, av_clock=None, transform=None,
+                 vfr=False, timecodes=None, change_tile=None, segments=None, metrics=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        ctx = multiprocessing.get_context('spawn')
+        self.fps = fps
+        self.av_clock = av_clock or AVClock()
+        self._stop = ctx.Event()
+        self._running = ctx.Event()  # cleared while paused
+        self._running.set()
+        self._target_fps = ctx.Value('d', fps, lock=False)  # set_fps() from the parent
+        self._counters = ctx.Array('q', _COUNTERS, lock=False)
+        self._clock_state = ctx.Array('d', _CLOCK_FIELDS, lock=False)
+        self._publishing = threading.Event()
+        self._encoder_done = ctx.Event()
+        self._publish_lock = threading.Lock()
+        if metrics is not None:
+            metrics.add_source(self.stats)
+
+        if transform is not None and transform.is_identity(source_shape):
+            transform = None
+        self.frame_shape = transform.out_shape if transform is not None else tuple(source_shape)
+        self._pools = []
+        # Process.start() drops its args under spawn; the queues must stay
+        # referenced here or their semaphores vanish before a child attaches
+        self._queues_alive = []
+        capture_pool = self._pool(ctx, source_shape, queue_size)
+        capture_free, capture_ready = self._queues(ctx, capture_pool)
+        self._processes = [ctx.Process(
+            target=_capture_main, name="greenrecord-capture",
+            args=(backend, backend_options, capture_pool.spec(), capture_free, capture_ready,
+                  fps, policy, self._stop, self._running, self._counters, self._target_fps))]
+        encode_pool, encode_free, encode_ready = capture_pool, capture_free, capture_ready
+        if transform is not None:
+            encode_pool = self._pool(ctx, self.frame_shape, queue_size)
+            encode_free, encode_ready = self._queues(ctx, encode_pool)
+            # The capture process always fills its pool with bgr24
+            transform_args = (tuple(source_shape), transform.out_size, transform.crop, transform.interpolation,
+                              'bgr24', transform.out_format)
+            self._processes.append(ctx.Process(
+                target=_convert_main, name="greenrecord-convert",
+                args=(transform_args, capture_pool.spec(), encode_pool.spec(), capture_free, capture_ready,
+                      encode_free, encode_ready, self._counters, self._encoder_done)))
+        self._processes.append(ctx.Process(
+            target=_encode_main, name="greenrecord-encoder",
+            args=(sink_factory, encode_pool.spec(), encode_free, encode_ready, fps, self._clock_state,
+                  self._counters, self._encoder_done, vfr, timecodes, change_tile, segments)))
+        self._queue_ready = encode_ready
+
+    def _pool(self, ctx, shape, slots):
+        pool = SharedFramePool(shape, slots)
+        self._pools.append(pool)
+        return pool
+
+    def _queues(self, ctx, pool):
+        free = ctx.Queue()
+        for slot in range(pool.slots):
+            free.put(slot)
+        ready = ctx.Queue()
+        self._queues_alive += [free, ready]
+        return free, ready
+
+    def _publish(self):
+        with self._publish_lock:
+            paused, began, ended = self.av_clock.pause_state()
+            self._clock_state[:] = [self.av_clock.start, paused, math.nan if began is None else began,
+                                    math.nan if ended is None else ended, self.av_clock.drift()]
+
+    def _publish_clock(self):
+        # Keeps the encoder's view of the (audio-locked) clock current
+        while self._publishing.is_set():
+            self._publish()
+            time.sleep(0.1)
+
+    def start(self):
+        if self.av_clock.start is None:
+            self.av_clock.begin()
+        self._publish()
+        self._publishing.set()
+        threading.Thread(target=self._publish_clock, name="greenrecord-clock", daemon=True).start()
+        for process in reversed(self._processes):
+            process.start()
+
+    def pause(self):
+        self._running.clear()
+        self.av_clock.pause()
+        self._publish()
+
+    def resume(self):
+        # Published before capture goes on, so no new frame meets the old state
+        self.av_clock.resume()
+        self._publish()
+        self._running.set()
+
+    @property
+    def is_paused(self):
+        return not self._running.is_set()
+
+    def set_fps(self, fps):
+        self._target_fps.value = fps
+
+    @property
+    def is_running(self):
+        return any(process.is_alive() for process in self._processes)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._running.set()
+        # Sentinels travel down the pipeline, so later stages drain what is queued
+        for process in self._processes:
+            process.join(timeout)
+        self._publishing.clear()
+        for pool in self._pools:
+            pool.close()
+
+    def stats(self):
+        counters = self._counters
+        try:
+            depth = self._queue_ready.qsize()
+        except NotImplementedError:  # macOS
+            depth = None
+        return {
+            'captured': counters[CAPTURED],
+            'encoded': counters[ENCODED],
+            'dropped': counters[DROPPED],
+            'late': counters[LATE],
+            'duplicated': counters[DUPLICATED],
+            'skipped': counters[SKIPPED],
+            'av_drift': self.av_clock.drift(),
+            'unchanged': counters[UNCHANGED],
+            'dirty_ratio': None,
+            'dirty_mean': None,
+            'queue_depth': depth,
+        }
@@ -0,0 +1,190 @@
+import threading
+import time
+
+# Below this much remaining time the pacer stops relying on a single
+# time.sleep() (which can overshoot by a scheduler tick) and sleeps in
+# short slices instead.
+FINE_SLEEP_WINDOW = 0.002
+FINE_SLEEP_SLICE = 0.0002
+
+
+def precise_sleep_until(deadline, clock=time.monotonic):
+    remaining = deadline - clock()
+    if remaining > FINE_SLEEP_WINDOW:
+        time.sleep(remaining - FINE_SLEEP_WINDOW)
+    while True:
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, FINE_SLEEP_SLICE))
+
+
+class FramePacer:
+    # Fixed-rate tick scheduler. Ticks sit on a grid of start + n / fps so
+    # rounding errors never accumulate; when the caller falls behind, whole
+    # missed ticks are skipped instead of being fired back to back.
+    def __init__(self, fps, clock=time.monotonic):
+        if fps <= 0:
+            raise ValueError("fps must be positive")
+        self.fps = float(fps)
+        self.interval = 1.0 / self.fps
+        self.clock = clock
+        self.start = None
+        self.tick = 0
+        self.missed = 0
+
+    def reset(self):
+        self.start = self.clock()
+        self.tick = 0
+
+    def set_fps(self, fps):
+        # New rate from the next tick on; the grid restarts at the current time
+        if fps <= 0:
+            raise ValueError("fps must be positive")
+        self.fps = float(fps)
+        self.interval = 1.0 / self.fps
+        if self.start is not None:
+            self.reset()
+
+    def wait(self):
+        # Sleeps until the next tick; returns the number of ticks skipped
+        if self.start is None:
+            self.reset()
+            return 0
+        self.tick += 1
+        deadline = self.start + self.tick * self.interval
+        now = self.clock()
+        if now < deadline:
+            precise_sleep_until(deadline, self.clock)
+            return 0
+        skipped = int((now - deadline) / self.interval)
+        self.tick += skipped
+        self.missed += skipped
+        return skipped
+
+
+class AVClock:
+    # Shared timeline for one recording. Every video frame and audio block is
+    # stamped with time.monotonic() at capture; comparing how much media the
+    # audio device actually produced with the elapsed monotonic time gives
+    # the drift of the audio clock, which the video side follows.
+    def __init__(self, clock=time.monotonic, smoothing=0.1):
+        self.clock = clock
+        self.smoothing = smoothing
+        self.start = None
+        self.audio_samples = 0
+        self.audio_rate = None
+        self.paused_total = 0.0
+        self._paused_at = None
+        self._pauses = []  # (began, ended) of finished pauses
+        self._drift = 0.0
+        self._lock = threading.Lock()
+
+    def begin(self, start=None):
+        with self._lock:
+            self.start = self.clock() if start is None else start
+            self.audio_samples = 0
+            self.paused_total = 0.0
+            self._paused_at = None
+            self._pauses = []
+            self._drift = 0.0
+
+    def pause(self, at=None):
+        # Returns the moment the pause began (the first call wins)
+        with self._lock:
+            if self._paused_at is None:
+                self._paused_at = self.clock() if at is None else at
+            return self._paused_at
+
+    def resume(self, at=None):
+        # Returns how long the pause lasted; that span is cut from the timeline
+        with self._lock:
+            if self._paused_at is None:
+                return 0.0
+            ended = self.clock() if at is None else at
+            duration = ended - self._paused_at
+            self._pauses.append((self._paused_at, ended))
+            self.paused_total += duration
+            self._paused_at = None
+            return duration
+
+    def pause_state(self):
+        # (time paused before the latest pause, its start, its end) for a
+        # view of this clock in another process; start and end are None when
+        # there was no pause yet or it still goes on
+        with self._lock:
+            if self._paused_at is not None:
+                return self.paused_total, self._paused_at, None
+            if self._pauses:
+                began, ended = self._pauses[-1]
+                return self.paused_total - (ended - began), began, ended
+            return 0.0, None, None
+
+    @property
+    def paused_at(self):
+        with self._lock:
+            return self._paused_at
+
+    def elapsed(self, timestamp):
+        # Recording time of a capture timestamp, not counting pauses
+        with self._lock:
+            return self._elapsed(timestamp)
+
+    def _elapsed(self, timestamp):
+        # Only pauses before the timestamp count, so a frame grabbed before a
+        # pause keeps its place even if it is encoded after the resume; a
+        # timestamp inside a pause lands on the splice point
+        paused = 0.0
+        for began, ended in self._pauses:
+            if began >= timestamp:
+                break
+            paused += min(ended, timestamp) - began
+        if self._paused_at is not None and self._paused_at < timestamp:
+            paused += timestamp - self._paused_at
+        return timestamp - self.start - paused
+
+    def add_audio(self, frames, rate, timestamp):
+        # timestamp is the monotonic time at which the block started
+        with self._lock:
+            if self.start is None:
+                return
+            self.audio_rate = rate
+            media_time = self.audio_samples / rate
+            measured = media_time - self._elapsed(timestamp)
+            self._drift += self.smoothing * (measured - self._drift)
+            self.audio_samples += frames
+
+    def drift(self):
+        # Seconds the audio timeline is ahead (+) or behind (-) the wall clock
+        with self._lock:
+            return self._drift
+
+    def media_time(self, timestamp):
+        # Position of a capture timestamp on the audio-locked timeline
+        return self.elapsed(timestamp) + self.drift()
+
+
+class ConstantRateMapper:
+    # Maps timestamped frames onto a constant-rate output. Each frame is
+    # written as many times as output ticks it covers: zero when it lands in
+    # a tick that is already filled (dropped), more than one when capture
+    # fell behind (duplicated).
+    def __init__(self, fps, av_clock):
+        self.fps = float(fps)
+        self.av_clock = av_clock
+        self.next_index = 0
+        self.duplicated = 0
+        self.dropped = 0
+
+    def repeats(self, timestamp):
+        target = int(round(self.av_clock.media_time(timestamp) * self.fps))
+        if target < self.next_index:
+            self.dropped += 1
+            return 0
+        count = target - self.next_index + 1
+        self.duplicated += count - 1
+        self.next_index = target + 1
+        return count
+
+    def video_time(self):
+        return self.next_index / self.fps
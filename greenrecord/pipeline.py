@@ -0,0 +1,332 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+from greenrecord.metrics import Metrics
+from greenrecord.pacing import AVClock, ConstantRateMapper, FramePacer
+
+# Backpressure policies used when every frame buffer is in use
+BLOCK = "block"              # capture waits for the encoder
+DROP_OLDEST = "drop_oldest"  # the oldest queued frame is overwritten
+DROP_NEWEST = "drop_newest"  # the frame that is about to be captured is skipped
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class PauseGate:
+    # Pause flag that paused workers can sleep on: wait() blocks on a
+    # condition variable until resume, so a pause costs no CPU at all.
+    # set()/clear()/is_set() mirror threading.Event (set = paused).
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._paused = False
+
+    def set(self):
+        with self._cond:
+            self._paused = True
+
+    def clear(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    def is_set(self):
+        return self._paused
+
+    def wait(self):
+        with self._cond:
+            while self._paused:
+                self._cond.wait()
+
+
+class Frame:
+    __slots__ = ("slot", "index", "timestamp")
+
+    def __init__(self, slot, index, timestamp):
+        self.slot = slot
+        self.index = index
+        self.timestamp = timestamp
+
+
+class FrameQueue:
+    # Bounded queue over a fixed set of preallocated frame buffers. Capture
+    # acquires a free slot, fills it in place and publishes it; the encoder
+    # takes published frames in order and releases their slots when done.
+    def __init__(self, shape, size=4, policy=BLOCK, dtype=np.uint8):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        if size < 2:
+            raise ValueError("Frame queue needs at least two buffers")
+        self.buffers = [np.empty(shape, dtype) for _ in range(size)]
+        self.policy = policy
+        self.dropped = 0
+        self._free = collections.deque(range(size))
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self.buffers)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def acquire(self):
+        # Returns a free slot index, or None if the new frame has to be dropped
+        with self._cond:
+            if not self._free:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return None
+                if self.policy == DROP_OLDEST and self._pending:
+                    self.dropped += 1
+                    return self._pending.popleft().slot
+                while not self._free and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return None
+            return self._free.popleft()
+
+    def publish(self, frame):
+        with self._cond:
+            self._pending.append(frame)
+            self._cond.notify_all()
+
+    def discard(self, slot):
+        # Returns a slot that was acquired but never published
+        self.release(slot)
+
+    def get(self, timeout=None):
+        # Returns the next frame, or None once the queue is closed and drained
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._pending:
+                if self._closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._pending.popleft()
+
+    def release(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class CaptureWorker(threading.Thread):
+    def __init__(self, source, frames, fps, stop_event, pause_event, transform=None, metrics=None):
+        super().__init__(name="greenrecord-capture", daemon=True)
+        self.source = source
+        self.frames = frames
+        self.transform = transform
+        self.metrics = metrics or Metrics()
+        # With a transform the grab lands in one reused scratch buffer (or,
+        # for a transform from the backend's native format, stays in the
+        # backend's own memory) and the queue slots hold the output frames
+        self._native = transform is not None and transform.in_format != 'bgr24'
+        self._raw = np.empty(source.shape, np.uint8) if transform is not None and not self._native else None
+        self.pacer = FramePacer(fps)
+        self.stop_event = stop_event
+        self.pause_event = pause_event
+        self.captured = 0
+        self.late = 0
+        self.error = None
+
+    def run(self):
+        try:
+            self._loop()
+        except Exception as e:
+            self.error = e
+            print(f"Ошибка захвата видео: {e}")
+        finally:
+            self.frames.close()
+
+    def _loop(self):
+        while not self.stop_event.is_set() and not self.frames.closed:
+            if self.pause_event.is_set():
+                # Parked until resume (stop() resumes too); the schedule
+                # restarts from there instead of counting the pause as late
+                self.pause_event.wait()
+                self.pacer.reset()
+                continue
+            started = time.perf_counter()
+            slot = self.frames.acquire()
+            grabbed = time.perf_counter()
+            # Time spent waiting for a free buffer = backpressure from the encoder
+            self.metrics.observe('acquire', grabbed - started)
+            if slot is not None:
+                timestamp = time.monotonic()
+                try:
+                    if self.transform is None:
+                        self.source.grab_into(self.frames.buffers[slot])
+                        self.metrics.observe('grab', time.perf_counter() - grabbed)
+                    else:
+                        raw = self.source.grab_native() if self._native else self.source.grab_into(self._raw)
+                        converted = time.perf_counter()
+                        self.metrics.observe('grab', converted - grabbed)
+                        self.transform.apply(raw, self.frames.buffers[slot])
+                        self.metrics.observe('convert', time.perf_counter() - converted)
+                except Exception:
+                    self.frames.discard(slot)
+                    raise
+                self.frames.publish(Frame(slot, self.captured, timestamp))
+                self.captured += 1
+            # Ticks that passed while this frame was grabbed are counted as late
+            self.late += self.pacer.wait()
+
+
+class EncoderWorker(threading.Thread):
+    def __init__(self, sink, frames, mapper, detector=None, vfr=False, max_interval=1.0, metrics=None):
+        super().__init__(name="greenrecord-encoder", daemon=True)
+        self.metrics = metrics or Metrics()
+        self.sink = sink
+        self.frames = frames
+        self.mapper = mapper
+        self.detector = detector
+        self.vfr = vfr
+        self.max_interval = max_interval
+        self.encoded = 0
+        self.unchanged = 0
+        self._last_written = None
+        self.error = None
+
+    def run(self):
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                try:
+                    self._encode(frame)
+                finally:
+                    self.frames.release(frame.slot)
+        except Exception as e:
+            self.error = e
+            print(f"Ошибка кодирования видео: {e}")
+            self.frames.close()
+        finally:
+            self.sink.close()
+
+    def _encode(self, frame):
+        buffer = self.frames.buffers[frame.slot]
+        if self.detector is not None:
+            started = time.perf_counter()
+            ratio = self.detector.update(buffer, frame.index)
+            self.metrics.observe('detect', time.perf_counter() - started)
+            if self.vfr and ratio == 0.0 and self._last_written is not None \
+                    and frame.timestamp - self._last_written < self.max_interval:
+                # Nothing changed: the previous frame simply stays on screen longer
+                self.unchanged += 1
+                return
+        started = time.perf_counter()
+        if self.vfr:
+            self.sink.write(buffer, frame.timestamp)
+        else:
+            # Duplicate or skip so the output stays at the header frame rate
+            for _ in range(self.mapper.repeats(frame.timestamp)):
+                self.sink.write(buffer, frame.timestamp)
+        # encode: the sink's write (cv2 encode + disk, or the pipe to ffmpeg);
+        # latency: from the grab until the frame was handed over
+        self.metrics.observe('encode', time.perf_counter() - started)
+        self.metrics.observe('latency', time.monotonic() - frame.timestamp)
+        self._last_written = frame.timestamp
+        self.encoded += 1
+
+
+class RecordingEngine:
+    # Runs capture and encoding on two threads joined by a FrameQueue, so a
+    # slow write never stalls the grab of the next frame (and vice versa).
+    # Stage timings go to `metrics`, which also gets stats() as a source.
+    # With spool_bytes the queue overflows into a file in spool_dir instead
+    # of applying the policy (see spool.SpoolingFrameQueue).
+    def __init__(self, source, sink, fps=20.0, queue_size=4, policy=BLOCK, av_clock=None,
+                 detector=None, vfr=False, transform=None, metrics=None, spool_bytes=0, spool_dir=None):
+        self.source = source
+        self.sink = sink
+        self.fps = fps
+        if transform is not None and transform.is_identity(source.shape):
+            transform = None
+        self.transform = transform
+        self.av_clock = av_clock or AVClock()
+        self.mapper = ConstantRateMapper(fps, self.av_clock)
+        self.frame_shape = transform.out_shape if transform is not None else source.shape
+        if spool_bytes:
+            from greenrecord.spool import SpoolingFrameQueue
+            self.frames = SpoolingFrameQueue(self.frame_shape, queue_size, policy, spool_bytes, spool_dir)
+        else:
+            self.frames = FrameQueue(self.frame_shape, queue_size, policy)
+        self._stop = threading.Event()
+        self._pause = PauseGate()
+        self.metrics = metrics or Metrics()
+        self.metrics.add_source(self.stats)
+        self.capture_worker = CaptureWorker(source, self.frames, fps, self._stop, self._pause, transform,
+                                            self.metrics)
+        self.detector = detector
+        self.encoder_worker = EncoderWorker(sink, self.frames, self.mapper, detector, vfr, metrics=self.metrics)
+
+    def start(self):
+        if self.av_clock.start is None:
+            self.av_clock.begin()
+        self.encoder_worker.start()
+        self.capture_worker.start()
+
+    def pause(self):
+        self._pause.set()
+        self.av_clock.pause()
+
+    def resume(self):
+        self.av_clock.resume()
+        self._pause.clear()
+
+    @property
+    def is_paused(self):
+        return self._pause.is_set()
+
+    def set_fps(self, fps):
+        # Capture rate only; the output keeps its rate by repeating frames
+        self.capture_worker.pacer.set_fps(fps)
+
+    @property
+    def is_running(self):
+        return self.capture_worker.is_alive() or self.encoder_worker.is_alive()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._pause.clear()
+        self.capture_worker.join(timeout)
+        self.frames.close()
+        self.encoder_worker.join(timeout)
+        self.source.close()
+        if hasattr(self.frames, 'dispose') and not self.encoder_worker.is_alive():
+            self.frames.dispose()
+
+    def stats(self):
+        stats = {
+            'captured': self.capture_worker.captured,
+            'encoded': self.encoder_worker.encoded,
+            'dropped': self.frames.dropped,
+            'late': self.capture_worker.late,
+            'duplicated': self.mapper.duplicated,
+            'skipped': self.mapper.dropped,
+            'av_drift': self.av_clock.drift(),
+            'unchanged': self.encoder_worker.unchanged,
+            'dirty_ratio': self.detector.last_ratio if self.detector else None,
+            'dirty_mean': self.detector.mean_ratio() if self.detector else None,
+            'queue_depth': self.frames.depth(),
+        }
+        if hasattr(self.frames, 'spool_depth'):
+            stats.update(self.frames.stats())
+        return stats
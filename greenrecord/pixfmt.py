@@ -0,0 +1,93 @@
+# Pixel formats a frame can travel in between capture and the encoder, named
+# as ffmpeg names them so they go straight to -pix_fmt. Packed formats are
+# (height, width, channels) arrays, the 4:2:0 ones a single (height * 3 / 2,
+# width) array: the Y plane followed by U and V (yuv420p) or by interleaved
+# UV (nv12), the layout ffmpeg reads from rawvideo.
+#
+# Bytes per pixel: bgra 4, bgr24 3, yuv420p / nv12 1.5. Screens hand out
+# BGRA; converting that straight to the encoder's 4:2:0 format in one pass
+# halves what goes through the frame queue and the pipe to ffmpeg, and
+# ffmpeg has nothing left to convert. numpy and cv2 are only imported by
+# ColorConverter, so the names here are cheap to import.
+
+PACKED = {'bgr24': 3, 'bgra': 4}
+PLANAR = ('yuv420p', 'nv12')
+PIXEL_FORMATS = tuple(PACKED) + PLANAR
+
+
+def frame_shape(pixel_format, width, height):
+    if pixel_format in PACKED:
+        return (height, width, PACKED[pixel_format])
+    if pixel_format in PLANAR:
+        if width % 2 or height % 2:
+            raise ValueError(f"{pixel_format} needs even dimensions: {width}x{height}")
+        return (height * 3 // 2, width)
+    raise ValueError(f"Unknown pixel format: {pixel_format}")
+
+
+def frame_size(pixel_format, shape):
+    # (width, height) of a frame buffer of that format
+    if pixel_format in PLANAR:
+        return (shape[1], shape[0] * 2 // 3)
+    return (shape[1], shape[0])
+
+
+def negotiate(encoder_format, sink_formats, requested=None):
+    # Format the pipeline delivers to a sink that reads sink_formats and
+    # feeds an encoder working in encoder_format (e.g. 'yuv420p'): that one
+    # if the sink takes it, so nobody converts again, else bgr24 (the one
+    # format every sink reads). requested overrides when the sink takes it.
+    if requested and requested != 'auto':
+        if requested not in sink_formats:
+            raise ValueError(f"The output does not accept {requested} frames")
+        return requested
+    if encoder_format in PLANAR and encoder_format in sink_formats:
+        return encoder_format
+    return 'bgr24'
+
+
+class ColorConverter:
+    # Packed BGR(A) -> any pipeline format, written into the caller's buffer.
+    # cv2 does the 4:2:0 conversion in one vectorised pass (BT.601, limited
+    # range, as ffmpeg assumes for untagged input); nv12 goes through one
+    # preallocated yuv420p buffer and an interleave of the chroma planes.
+    def __init__(self, in_format, out_format, size):
+        import cv2
+        import numpy as np
+        if in_format not in PACKED:
+            raise ValueError(f"Cannot convert from {in_format}")
+        self.in_format = in_format
+        self.out_format = out_format
+        self.out_shape = frame_shape(out_format, *size)
+        width, height = size
+        self._scratch = None
+        if out_format in PLANAR:
+            self._code = cv2.COLOR_BGRA2YUV_I420 if in_format == 'bgra' else cv2.COLOR_BGR2YUV_I420
+            if out_format == 'nv12':
+                self._scratch = np.empty(self.out_shape, np.uint8)
+                self._luma = width * height
+                planes = self._scratch.reshape(-1)
+                self._u = planes[self._luma:self._luma * 5 // 4]
+                self._v = planes[self._luma * 5 // 4:]
+        elif in_format == out_format:
+            self._code = None
+        elif out_format == 'bgr24':
+            self._code = cv2.COLOR_BGRA2BGR
+        else:
+            self._code = cv2.COLOR_BGR2BGRA
+        self._cv2 = cv2
+        self._np = np
+
+    def apply(self, frame, out):
+        if self._code is None:
+            self._np.copyto(out, frame)
+        elif self._scratch is None:
+            self._cv2.cvtColor(frame, self._code, dst=out)
+        else:
+            self._cv2.cvtColor(frame, self._code, dst=self._scratch)
+            flat = out.reshape(-1)
+            flat[:self._luma] = self._scratch.reshape(-1)[:self._luma]
+            uv = flat[self._luma:].reshape(-1, 2)
+            uv[:, 0] = self._u
+            uv[:, 1] = self._v
+        return out
@@ -0,0 +1,318 @@
+import bisect
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+from greenrecord.sinks import find_ffmpeg
+
+# Jobs run on a finished recording after stop, each in a worker process of
+# a PostProcessor pool (they are CPU bound: decoding, scaling, encoding):
+#
+#   index       <video>.seekidx.json  keyframe times/byte offsets + frame timestamps
+#   thumbnails  <video>.thumbs.jpg    strip of evenly spaced frames
+#   share       <root>_share.mp4      smaller H.264/AAC copy for sharing
+#
+# Every job is job(video, output, progress, **options) and reports its
+# progress as a fraction 0..1 through progress().
+
+SEEK_INDEX_VERSION = 1
+DEFAULT_JOBS = ('index', 'thumbnails', 'share')
+
+
+def job_output(job, video):
+    root, extension = os.path.splitext(video)
+    return {
+        'index': video + ".seekidx.json",
+        'thumbnails': video + ".thumbs.jpg",
+        'share': root + "_share.mp4",
+    }[job]
+
+
+def find_ffprobe(ffmpeg=None):
+    # ffprobe next to ffmpeg, or on PATH; None if there is none
+    if os.environ.get('GREENRECORD_FFPROBE'):
+        return os.environ['GREENRECORD_FFPROBE']
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if ffmpeg:
+        directory, name = os.path.split(ffmpeg)
+        candidate = os.path.join(directory, name.replace('ffmpeg', 'ffprobe'))
+        if candidate != ffmpeg and os.path.isfile(candidate):
+            return candidate
+    return shutil.which('ffprobe')
+
+
+def _duration(video):
+    import cv2
+    capture = cv2.VideoCapture(video)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frames = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+    finally:
+        capture.release()
+    return frames / fps if fps > 0 and frames > 0 else None
+
+
+def _run_ffmpeg(command, duration, progress):
+    # ffmpeg with -progress on stdout; out_time_us against the duration
+    process = subprocess.Popen(command + ['-progress', 'pipe:1', '-nostats'], stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True)
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.extend(process.stderr), daemon=True)
+    reader.start()
+    for line in process.stdout:
+        if duration and line.startswith('out_time_us='):
+            try:
+                done = int(line.split('=', 1)[1]) / 1e6
+            except ValueError:
+                continue
+            progress(min(0.99, done / duration))
+    process.wait()
+    reader.join()
+    if process.returncode != 0:
+        raise RuntimeError("ffmpeg: " + "".join(stderr).strip()[-2000:])
+
+
+def _packets_ffprobe(ffprobe, video):
+    # (time, byte offset, keyframe) of every video packet, in decode order
+    result = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                             'packet=pts_time,dts_time,pos,flags', '-of', 'csv=p=0', video],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("ffprobe: " + result.stderr.strip()[-2000:])
+    packets = []
+    for line in result.stdout.splitlines():
+        fields = dict(zip(('pts_time', 'dts_time', 'pos', 'flags'), line.split(',')))
+        time_text = fields.get('pts_time') if fields.get('pts_time') not in (None, '', 'N/A') \
+            else fields.get('dts_time')
+        if time_text in (None, '', 'N/A'):
+            continue
+        pos = fields.get('pos')
+        packets.append((float(time_text), int(pos) if pos and pos.isdigit() else None,
+                        'K' in fields.get('flags', '')))
+    return packets
+
+
+def _packets_ffmpeg(ffmpeg, video):
+    # Without ffprobe: packet times from a stream copy (-f framecrc), keyframe
+    # times from decoding the keyframes only (-skip_frame nokey); no offsets
+    result = subprocess.run([ffmpeg, '-hide_banner', '-nostats', '-i', video, '-map', '0:v:0', '-c', 'copy',
+                             '-f', 'framecrc', '-'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("ffmpeg: " + result.stderr.strip()[-2000:])
+    time_base = 1.0
+    times = []
+    for line in result.stdout.splitlines():
+        if line.startswith('#tb 0:'):
+            numerator, denominator = line.split(':', 1)[1].strip().split('/')
+            time_base = int(numerator) / int(denominator)
+        elif line and not line.startswith('#'):
+            fields = [field.strip() for field in line.split(',')]
+            times.append(int(fields[2]) * time_base)
+    result = subprocess.run([ffmpeg, '-hide_banner', '-nostats', '-skip_frame', 'nokey', '-i', video,
+                             '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("ffmpeg: " + result.stderr.strip()[-2000:])
+    keys = sorted(float(value) for value in re.findall(r'pts_time:\s*(-?[\d.]+)', result.stderr))
+    packets = []
+    for time in times:
+        nearest = bisect.bisect_left(keys, time - 1e-4)
+        packets.append((time, None, nearest < len(keys) and abs(keys[nearest] - time) < 1e-3))
+    return packets
+
+
+def build_seek_index(video, output, progress, ffmpeg=None, ffprobe=None):
+    # Sidecar for random access into long recordings: every keyframe (time,
+    # frame number, byte offset when known) plus the frame timestamps. A
+    # constant-rate file stores only fps instead of one timestamp per frame.
+    ffmpeg = ffmpeg or find_ffmpeg()
+    ffprobe = ffprobe or find_ffprobe(ffmpeg)
+    progress(0.0)
+    if ffprobe:
+        packets = _packets_ffprobe(ffprobe, video)
+    elif ffmpeg:
+        packets = _packets_ffmpeg(ffmpeg, video)
+    else:
+        raise RuntimeError("ffmpeg not found")
+    progress(0.8)
+    packets.sort(key=lambda packet: packet[0])
+    times = [round(time, 6) for time, pos, key in packets]
+    keyframes = [{'time': round(time, 6), 'frame': number, 'pos': pos}
+                 for number, (time, pos, key) in enumerate(packets) if key]
+    index = {
+        'version': SEEK_INDEX_VERSION,
+        'video': os.path.basename(video),
+        'size': os.path.getsize(video),
+        'frames': len(times),
+        'duration': round(times[-1] - times[0], 6) if times else 0.0,
+        'keyframes': keyframes,
+    }
+    steps = [later - earlier for earlier, later in zip(times, times[1:])]
+    if steps and max(steps) - min(steps) < 1e-3:
+        index['start'] = times[0]
+        index['fps'] = round(1.0 / (sum(steps) / len(steps)), 3)
+    else:
+        index['timestamps'] = times
+    temporary = output + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(temporary, output)
+    progress(1.0)
+    return output
+
+
+def load_seek_index(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def seek_point(index, seconds):
+    # The keyframe to start decoding from to show `seconds` (the last one at or before it)
+    times = [keyframe['time'] for keyframe in index['keyframes']]
+    if not times:
+        return None
+    return index['keyframes'][max(0, bisect.bisect_right(times, seconds) - 1)]
+
+
+def make_thumbnails(video, output, progress, count=10, width=240):
+    import cv2
+    import numpy as np
+
+    capture = cv2.VideoCapture(video)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 1.0
+        frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        tiles = []
+        for number in range(count):
+            # Middle of each of `count` equal parts, found by seeking, not by decoding everything
+            capture.set(cv2.CAP_PROP_POS_MSEC, (number + 0.5) * frames / count / fps * 1000.0)
+            ok, frame = capture.read()
+            if ok:
+                height = max(2, round(frame.shape[0] * width / frame.shape[1]))
+                tiles.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+            progress((number + 1) / count)
+    finally:
+        capture.release()
+    if not tiles:
+        raise RuntimeError(f"No frames could be read from {video}")
+    if not cv2.imwrite(output, np.hstack(tiles), [cv2.IMWRITE_JPEG_QUALITY, 85]):
+        raise RuntimeError(f"Cannot write {output}")
+    return output
+
+
+def make_share_copy(video, output, progress, height=720, crf=28, preset='veryfast', audio=None, ffmpeg=None):
+    # audio: a separate WAV (OpenCV recordings) to put into the copy
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg not found")
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', video]
+    if audio:
+        command += ['-i', audio, '-map', '0:v:0', '-map', '1:a:0']
+    else:
+        command += ['-map', '0:v:0', '-map', '0:a?']
+    # Only ever scaled down; -2 keeps the width even for 4:2:0
+    command += ['-vf', f"scale=-2:'min({height},ih)'", '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+                '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '96k', '-movflags', '+faststart', output]
+    progress(0.0)
+    _run_ffmpeg(command, _duration(video), progress)
+    progress(1.0)
+    return output
+
+
+JOBS = {
+    'index': build_seek_index,
+    'thumbnails': make_thumbnails,
+    'share': make_share_copy,
+}
+
+_progress_queue = None
+
+
+def _init_worker(queue):
+    global _progress_queue
+    _progress_queue = queue
+
+
+def _run_job(job_id, job, video, output, options):
+    def progress(fraction):
+        _progress_queue.put((job_id, fraction))
+    return JOBS[job](video, output, progress, **options)
+
+
+class PostProcessor:
+    # Process pool for the jobs above. submit() returns at once; the pool is
+    # started on the first submit. on_progress(job_id, job, video, fraction)
+    # and on_done(job_id, job, video, output, error) are called from
+    # background threads (the GUI forwards them through Qt signals).
+    def __init__(self, workers=None, on_progress=None, on_done=None):
+        self.workers = workers or max(1, min(3, (os.cpu_count() or 2) - 1))
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.jobs = {}  # job_id -> (job, video, output)
+        self._next_id = 0
+        self._pool = None
+        self._queue = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        ctx = multiprocessing.get_context('spawn')
+        self._queue = ctx.Queue()
+        self._pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=ctx,
+                                                            initializer=_init_worker, initargs=(self._queue,))
+        self._listener = threading.Thread(target=self._listen, name="greenrecord-postprocess", daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            job_id, fraction = message
+            job, video, output = self.jobs[job_id]
+            if self.on_progress is not None:
+                self.on_progress(job_id, job, video, fraction)
+
+    def submit(self, video, jobs=DEFAULT_JOBS, options=None):
+        # options: {job: {keyword: value}}; returns {job_id: future}
+        options = options or {}
+        futures = {}
+        with self._lock:
+            if self._pool is None:
+                self._start()
+            for job in jobs:
+                job_id = self._next_id
+                self._next_id += 1
+                output = job_output(job, video)
+                self.jobs[job_id] = (job, video, output)
+                future = self._pool.submit(_run_job, job_id, job, video, output, options.get(job, {}))
+                future.add_done_callback(lambda future, job_id=job_id: self._finished(job_id, future))
+                futures[job_id] = future
+        return futures
+
+    def _finished(self, job_id, future):
+        job, video, output = self.jobs[job_id]
+        # A cancelled job reports an error too, so callers never count it as done
+        if future.cancelled():
+            error = concurrent.futures.CancelledError("cancelled")
+        else:
+            error = future.exception()
+        if error is not None:
+            print(f"Ошибка обработки {os.path.basename(video)} ({job}): {error}")
+        if self.on_done is not None:
+            self.on_done(job_id, job, video, output, error)
+
+    def shutdown(self, wait=True, cancel=False):
+        with self._lock:
+            if self._pool is None:
+                return
+            self._pool.shutdown(wait=wait, cancel_futures=cancel)
+            self._queue.put(None)
+            if wait:
+                self._listener.join()
+            self._pool = None
@@ -0,0 +1,280 @@
+import asyncio
+import socket
+import threading
+import time
+
+import numpy as np
+
+# Live preview of a running recording over HTTP, for a browser or an <img>
+# tag in other tooling:
+#
+#   /              a page showing the stream
+#   /stream.mjpg   multipart MJPEG, every part the newest frame
+#   /snapshot.jpg  the next frame as one JPEG
+#
+# PreviewTap sits in front of the recording's sink and, only while someone
+# watches and at most preview fps times a second, copies the frame the
+# encoder is about to take into the server's buffer. Colour conversion,
+# downscaling and JPEG happen on the server's side. Every client is handed
+# the newest JPEG whenever its socket has taken the previous one, so a slow
+# client just sees fewer frames; nothing waits for it, least of all the
+# recording, which passes a frame over when the buffer is still busy.
+
+BOUNDARY = b'greenrecord-frame'
+SEND_BUFFER = 64 * 1024  # Socket send buffer per client, bytes
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><title>GreenRecord preview</title></head>
+<body style="margin:0;background:#111"><img src="/stream.mjpg" style="display:block;max-width:100%;margin:auto"></body>
+</html>
+"""
+
+
+class PreviewTap:
+    # Sink wrapper: every frame goes on to the recording, now and then a copy to the preview
+    def __init__(self, sink, server, pixel_format='bgr24'):
+        self.sink = sink
+        self.server = server
+        self.pixel_format = pixel_format
+
+    def write(self, frame, timestamp=None):
+        self.sink.write(frame, timestamp)
+        self.server.offer(frame, self.pixel_format)
+
+    def close(self):
+        self.sink.close()
+
+
+class PreviewServer:
+    # asyncio HTTP server on its own thread. fps and width (px, the height
+    # follows the aspect ratio) bound what the preview costs; the default
+    # host only accepts connections from this machine. port 0 picks a free
+    # port, self.port has the real one after start().
+    def __init__(self, host='127.0.0.1', port=0, fps=5.0, width=640, quality=70, send_timeout=30.0,
+                 metrics=None):
+        self.host = host
+        self.port = port
+        self.interval = 1.0 / fps
+        self.width = width
+        self.quality = quality
+        self.send_timeout = send_timeout
+        self.clients = 0
+        self.frames = 0  # Frames taken from the recording
+        self.busy = 0  # Frames passed over while the previous one was being converted
+        self.sent = 0
+        self.skipped = 0  # Frames a slow client did not get
+        self._buffer = None
+        self._format = None
+        self._lock = threading.Lock()
+        self._next = 0.0
+        self._jpeg = None
+        self._sequence = 0
+        self._closing = False
+        self._writers = set()
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+        if metrics is not None:
+            metrics.add_source(self.stats)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="greenrecord-preview", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            raise self._error
+
+    def stop(self):
+        if self._thread is None:
+            return
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._quit.set)
+        self._thread.join()
+        self._thread = None
+
+    def offer(self, frame, pixel_format='bgr24'):
+        # Encoder thread: copies the frame if one is due; never waits
+        now = time.monotonic()
+        if not self.clients or now < self._next or self._loop is None:
+            return False
+        if not self._lock.acquire(blocking=False):
+            self.busy += 1
+            return False
+        try:
+            if self._buffer is None or self._buffer.shape != frame.shape:
+                self._buffer = np.empty_like(frame)
+            np.copyto(self._buffer, frame)
+            self._format = pixel_format
+        finally:
+            self._lock.release()
+        self._next = now + self.interval
+        self.frames += 1
+        self._loop.call_soon_threadsafe(self._frame_ready.set)
+        return True
+
+    def _encode(self):
+        # Executor thread: buffer -> BGR -> preview size -> JPEG bytes
+        import cv2
+        conversions = {'bgra': cv2.COLOR_BGRA2BGR, 'yuv420p': cv2.COLOR_YUV2BGR_I420,
+                       'nv12': cv2.COLOR_YUV2BGR_NV12}
+        with self._lock:
+            image = self._buffer
+            if self._format in conversions:
+                image = cv2.cvtColor(image, conversions[self._format])
+            height, width = image.shape[:2]
+            if width > self.width:
+                size = (self.width, max(2, round(height * self.width / width)))
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise RuntimeError("JPEG encoding failed")
+        return jpeg.tobytes()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+            self._loop.run_until_complete(self._loop.shutdown_default_executor())
+        except Exception as e:
+            self._error = e
+        finally:
+            self._loop.close()
+            self._loop = None
+            self._ready.set()
+
+    async def _serve(self):
+        self._quit = asyncio.Event()
+        self._frame_ready = asyncio.Event()
+        self._changed = asyncio.Condition()
+        server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        encoder = asyncio.ensure_future(self._encode_loop())
+        try:
+            await self._quit.wait()
+        finally:
+            encoder.cancel()
+            server.close()
+            async with self._changed:
+                self._closing = True
+                self._changed.notify_all()
+            for writer in list(self._writers):
+                writer.close()
+            await server.wait_closed()
+
+    async def _encode_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._frame_ready.wait()
+            self._frame_ready.clear()
+            try:
+                jpeg = await loop.run_in_executor(None, self._encode)
+            except Exception as e:
+                print(f"Ошибка предпросмотра: {e}")
+                continue
+            async with self._changed:
+                self._jpeg = jpeg
+                self._sequence += 1
+                self._changed.notify_all()
+
+    async def _next_frame(self, seen, timeout=None):
+        # (sequence, jpeg) newer than seen; None when closing or after timeout
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self._sequence != seen or self._closing),
+                                       timeout)
+            except asyncio.TimeoutError:
+                return None
+            if self._closing:
+                return None
+            return self._sequence, self._jpeg
+
+    async def _client(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10.0)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        parts = request.split(b'\r\n', 1)[0].split()
+        path = parts[1].split(b'?', 1)[0] if len(parts) > 1 else None
+        # Nothing is kept in the transport beyond what the socket takes, and
+        # the socket takes little more than a frame, so drain() returns about
+        # when the client has it: a slow client skips frames instead of
+        # falling seconds behind in buffers
+        writer.transport.set_write_buffer_limits(0)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        self._writers.add(writer)
+        try:
+            if path is None:
+                await self._respond(writer, b'400 Bad Request', b'text/plain', b'Bad request\n')
+            elif parts[0] != b'GET':
+                await self._respond(writer, b'405 Method Not Allowed', b'text/plain', b'GET only\n')
+            elif path == b'/':
+                await self._respond(writer, b'200 OK', b'text/html; charset=utf-8', PAGE)
+            elif path == b'/stream.mjpg':
+                await self._stream(writer)
+            elif path == b'/snapshot.jpg':
+                await self._snapshot(writer)
+            else:
+                await self._respond(writer, b'404 Not Found', b'text/plain', b'Not found\n')
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, body):
+        writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: ' + content_type
+                     + b'\r\nContent-Length: ' + str(len(body)).encode()
+                     + b'\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n' + body)
+        await asyncio.wait_for(writer.drain(), self.send_timeout)
+
+    async def _snapshot(self, writer):
+        self.clients += 1
+        try:
+            frame = await self._next_frame(self._sequence, timeout=5.0)
+        finally:
+            self.clients -= 1
+        jpeg = frame[1] if frame else self._jpeg  # Paused: the last frame there is
+        if jpeg is None:
+            await self._respond(writer, b'503 Service Unavailable', b'text/plain', b'No frame yet\n')
+        else:
+            await self._respond(writer, b'200 OK', b'image/jpeg', jpeg)
+            self.sent += 1
+
+    async def _stream(self, writer):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=' + BOUNDARY
+                     + b'\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n')
+        self.clients += 1
+        try:
+            seen = self._sequence - 1 if self._jpeg is not None else self._sequence
+            while True:
+                frame = await self._next_frame(seen)
+                if frame is None:
+                    return
+                if seen:
+                    self.skipped += max(0, frame[0] - seen - 1)
+                seen, jpeg = frame
+                writer.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                             + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+                await asyncio.wait_for(writer.drain(), self.send_timeout)
+                self.sent += 1
+        finally:
+            self.clients -= 1
+
+    def stats(self):
+        return {
+            'preview_clients': self.clients,
+            'preview_frames': self.frames,
+            'preview_busy': self.busy,
+            'preview_sent': self.sent,
+            'preview_skipped': self.skipped,
+        }
@@ -0,0 +1,197 @@
+import collections
+import os
+import subprocess
+import threading
+import time
+
+from greenrecord.sinks import FFmpegMuxSink, find_ffmpeg
+
+# Instant replay: ffmpeg encodes into an MPEG transport stream on stdout and
+# the last N seconds of it stay in memory as whole GOPs, so a clip can be cut
+# at any moment without decoding or re-encoding. Memory is bounded by the
+# window (and max_bytes), however long replay mode runs.
+
+TS_PACKET = 188
+TS_SYNC = 0x47
+# PMT stream types that carry video (MPEG-1/2, MPEG-4 Part 2, H.264, HEVC)
+VIDEO_STREAM_TYPES = (0x01, 0x02, 0x10, 0x1b, 0x24)
+# Codecs ffmpeg can put in MPEG-TS (see EncoderSettings)
+REPLAY_CODECS = ('h264', 'mpeg4')
+
+
+def _section(packet):
+    # Payload of a PSI packet (PAT/PMT) starting at its table, None if it does not start one
+    if not packet[1] & 0x40:
+        return None
+    start = 4
+    if packet[3] & 0x20:
+        start += 1 + packet[4]
+    if start >= TS_PACKET:
+        return None
+    start += 1 + packet[start]  # pointer_field
+    return packet[start:]
+
+
+class ReplayBuffer:
+    # Rolling window of MPEG-TS packets, split into GOPs at video keyframes
+    # (random_access_indicator on the video PID). The PAT/PMT seen first are
+    # kept aside and put in front of every clip, so a clip that starts at any
+    # keyframe is a complete stream. Fed from one thread, saved from others.
+    def __init__(self, seconds, max_bytes=None):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.header = bytearray()
+        self.size = 0
+        self.high_water = 0
+        self._gops = collections.deque()  # [arrival time, bytearray]
+        self._rest = b''
+        self._pmt_pids = set()
+        self._video_pids = set()
+        self._lock = threading.Lock()
+
+    def feed(self, data, now=None):
+        now = time.monotonic() if now is None else now
+        data = self._rest + data
+        end = len(data) - len(data) % TS_PACKET
+        self._rest = data[end:]
+        with self._lock:
+            for offset in range(0, end, TS_PACKET):
+                packet = data[offset:offset + TS_PACKET]
+                if packet[0] != TS_SYNC:
+                    continue
+                self._packet(packet, now)
+            self._trim(now)
+
+    def _packet(self, packet, now):
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        if pid == 0 or pid in self._pmt_pids:
+            self._table(pid, packet)
+            if not self._gops:
+                self.header += packet
+                return
+        elif pid in self._video_pids and packet[3] & 0x20 and packet[4] and packet[5] & 0x40:
+            self._gops.append([now, bytearray()])
+        if self._gops:
+            self._gops[-1][1] += packet
+            self.size += TS_PACKET
+            self.high_water = max(self.high_water, self.size)
+
+    def _table(self, pid, packet):
+        section = _section(packet)
+        if section is None or len(section) < 12:
+            return
+        length = ((section[1] & 0x0f) << 8) | section[2]
+        body = section[8:3 + length - 4]  # Without the header and the CRC
+        if pid == 0:
+            for entry in range(0, len(body) - 3, 4):
+                if body[entry] or body[entry + 1]:  # program_number 0 is the network PID
+                    self._pmt_pids.add(((body[entry + 2] & 0x1f) << 8) | body[entry + 3])
+            return
+        info = ((body[2] & 0x0f) << 8) | body[3]
+        entry = 4 + info
+        while entry + 5 <= len(body):
+            if body[entry] in VIDEO_STREAM_TYPES:
+                self._video_pids.add(((body[entry + 1] & 0x1f) << 8) | body[entry + 2])
+            entry += 5 + (((body[entry + 3] & 0x0f) << 8) | body[entry + 4])
+
+    def _trim(self, now):
+        # The oldest GOP kept is the last one that starts before the window,
+        # so a clip always covers at least `seconds`
+        while len(self._gops) > 1 and (self._gops[1][0] <= now - self.seconds or
+                                       (self.max_bytes and self.size > self.max_bytes)):
+            self.size -= len(self._gops.popleft()[1])
+
+    def duration(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return now - self._gops[0][0] if self._gops else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return bytes(self.header) + b''.join(gop for _, gop in self._gops)
+
+    def stats(self):
+        return {
+            'replay_seconds': round(self.duration(), 3),
+            'replay_bytes': self.size,
+            'replay_high_water': self.high_water,
+            'replay_gops': len(self._gops),
+        }
+
+
+def save_clip(data, path, ffmpeg=None):
+    # .ts is written as is; other containers are remuxed by ffmpeg without
+    # re-encoding. If that fails the clip is kept as .ts next to `path`.
+    # Returns the path actually written.
+    if path.lower().endswith('.ts'):
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+    ffmpeg = ffmpeg or find_ffmpeg()
+    error = "ffmpeg not found"
+    if ffmpeg:
+        result = subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'mpegts',
+                                 '-i', 'pipe:0', '-map', '0', '-c', 'copy', '-movflags', '+faststart', path],
+                                input=data, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode == 0:
+            return path
+        error = result.stderr.decode(errors='replace').strip()[-2000:] or f"exit code {result.returncode}"
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"Ошибка перепаковки повтора: {error}")
+    return save_clip(data, os.path.splitext(path)[0] + '.ts')
+
+
+class ReplaySink:
+    # Pipeline sink for replay mode. Keyframes about once a second keep the
+    # clip start within a second of the requested window. save() copies the
+    # window and writes it on its own thread, so capture never waits.
+    def __init__(self, seconds, fps, size, samplerate=None, video_args=(), audio_args=('-c:a', 'aac'),
+                 max_bytes=None, ffmpeg=None, pix_fmt='bgr24', channels=1, audio_tracks=None):
+        self.buffer = ReplayBuffer(seconds, max_bytes)
+        self.ffmpeg = ffmpeg or find_ffmpeg()
+        gop = ['-g', str(max(1, round(fps)))]
+        self._mux = FFmpegMuxSink('pipe:1', fps, size, samplerate, video_args=list(video_args) + gop,
+                                  audio_args=audio_args, ffmpeg=self.ffmpeg, output_args=('-f', 'mpegts'),
+                                  stdout=subprocess.PIPE, pix_fmt=pix_fmt, channels=channels,
+                                  audio_tracks=audio_tracks)
+        self.audio = self._mux.audio
+        self._reader = threading.Thread(target=self._read, name="greenrecord-replay", daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            data = self._mux.stdout.read1(1 << 16)
+            if not data:
+                break
+            self.buffer.feed(data)
+
+    def write(self, frame, timestamp=None):
+        self._mux.write(frame, timestamp)
+
+    def close(self):
+        self._mux.close()
+        self._reader.join()
+
+    def save(self, path, on_done=None):
+        # on_done(path written, error) is called from the saving thread
+        data = self.buffer.snapshot()
+
+        def run():
+            written, error = None, None
+            try:
+                directory = os.path.dirname(os.path.abspath(path))
+                os.makedirs(directory, exist_ok=True)
+                written = save_clip(data, path, self.ffmpeg)
+            except Exception as e:
+                error = e
+                print(f"Ошибка сохранения повтора: {e}")
+            if on_done is not None:
+                on_done(written, error)
+
+        thread = threading.Thread(target=run, name="greenrecord-replay-save", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        return self.buffer.stats()
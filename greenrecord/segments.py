@@ -0,0 +1,334 @@
+import collections
+import functools
+import json
+import os
+import subprocess
+import threading
+import time
+
+
+class Manifest:
+    # Append-only JSON lines index of a segmented session. Every line is
+    # flushed and fsynced, so after a crash it is intact up to the last event.
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def append(self, **event):
+        event.setdefault('wall', time.time())
+        with self._lock:
+            self._file.write(json.dumps(event) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class ManifestLock:
+    # Held next to a manifest (path + '.lock') by whoever writes or recovers
+    # that session, so recovery never touches a session another process (a
+    # second instance, the control server) is still recording. The lock is
+    # the OS's and goes away with a crashed process; the file may stay.
+    def __init__(self, manifest_path):
+        self.path = manifest_path + '.lock'
+        self._file = None
+
+    def acquire(self):
+        # False when someone else holds it
+        f = open(self.path, 'a+')
+        try:
+            try:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except ImportError:
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def in_use(self):
+        if self._file is not None or not os.path.exists(self.path):
+            return False
+        if not self.acquire():
+            return True
+        self.release()
+        return False
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            try:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            except ImportError:
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def read_manifest(path):
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break  # torn last line from a crash
+    return events
+
+
+class _SegmentAudio:
+    # Routes the audio stream to the segment it belongs to. A rotation at
+    # media time T ends the old segment's audio at sample T * rate, so both
+    # tracks of every segment cover the same span; if the audio writer is
+    # already past that point the old segment keeps the few extra samples.
+    # on_closed runs once a segment's audio input is closed, i.e. once ffmpeg
+    # has finished that file.
+    def __init__(self, samplerate):
+        self.samplerate = samplerate
+        self.samples = 0
+        self._targets = collections.deque()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def add(self, audio, start_time, on_closed=None):
+        with self._lock:
+            if self._targets:
+                boundary = max(int(round(start_time * self.samplerate)), self.samples)
+                last, _, last_closed = self._targets.pop()
+                self._targets.append((last, boundary, last_closed))
+            self._targets.append((audio, None, on_closed))
+            closed = self._closed
+        if closed:
+            self._close_finished()
+
+    def write(self, block):
+        while len(block):
+            with self._lock:
+                if not self._targets:
+                    return  # the video has ended
+                target, end, _ = self._targets[0]
+                count = len(block) if end is None else min(len(block), end - self.samples)
+            if count > 0:
+                target.write(block[:count])
+                block = block[count:]
+                with self._lock:
+                    self.samples += count
+            self._close_finished()
+
+    def _close_finished(self):
+        # Closes every target whose end was reached (all of them once closed)
+        finished = []
+        with self._lock:
+            while self._targets:
+                _, end, _ = self._targets[0]
+                if self._closed or (end is not None and self.samples >= end):
+                    finished.append(self._targets.popleft())
+                else:
+                    break
+        for target, _, on_closed in finished:
+            target.close()
+            if on_closed is not None:
+                on_closed()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._close_finished()
+
+
+class SegmentedSink:
+    # Rotates the output to a new file every segment_seconds of recording
+    # and/or segment_bytes of output. Each segment is closed cleanly before
+    # the next takes over and is recorded in an append-only manifest, so a
+    # crash only loses the segment in progress and finished segments can be
+    # uploaded while recording continues. segment_factory(filename) returns
+    # the sink for one segment; with samplerate set, each segment sink must
+    # offer an .audio input (FFmpegMuxSink) and self.audio splits the audio
+    # stream at the same points as the video.
+    def __init__(self, segment_factory, base, extension, av_clock=None, segment_seconds=None,
+                 segment_bytes=None, samplerate=None):
+        self.segment_factory = segment_factory
+        self.base = base
+        self.extension = extension
+        self.av_clock = av_clock
+        self.segment_seconds = segment_seconds or None
+        self.segment_bytes = segment_bytes or None
+        self.manifest_path = base + '.manifest.jsonl'
+        self.writer_lock = ManifestLock(self.manifest_path)
+        if not self.writer_lock.acquire():
+            raise RuntimeError(f"{os.path.basename(self.manifest_path)} is in use by another recording or recovery")
+        self.manifest = Manifest(self.manifest_path)
+        self.audio = _SegmentAudio(samplerate) if samplerate else None
+        self.index = -1
+        self.filename = None
+        self._sink = None
+        self._segment = None
+        self._lock = threading.Lock()
+        self._next_size_check = 0.0
+        self._last_time = 0.0
+        self._rotate_requested = False
+        self.manifest.append(event='session', base=os.path.basename(base),
+                             segment_seconds=self.segment_seconds, segment_bytes=self.segment_bytes)
+        # Opened up front: audio may arrive before the first video frame
+        self._open(0.0)
+
+    def _open(self, start):
+        self.index += 1
+        self.filename = f"{self.base}_{self.index:03d}{self.extension}"
+        self._sink = self.segment_factory(self.filename)
+        # The segment is complete once all its inputs (video, audio) are closed
+        self._segment = {'segment': self.index, 'file': self.filename, 'start': start, 'frames': 0,
+                         'inputs': 2 if self.audio is not None else 1}
+        self.manifest.append(event='open', segment=self.index, file=os.path.basename(self.filename), start=start)
+        if self.audio is not None:
+            self.audio.add(self._sink.audio, start, functools.partial(self._input_closed, self._segment))
+
+    def _close_current(self, end):
+        segment = self._segment
+        segment['end'] = end
+        self._sink.close()
+        self._sink = None
+        self._input_closed(segment)
+
+    def _input_closed(self, segment):
+        with self._lock:
+            segment['inputs'] -= 1
+            if segment['inputs']:
+                return
+        path = segment['file']
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.manifest.append(event='close', segment=segment['segment'], file=os.path.basename(path),
+                             start=segment['start'], end=segment['end'], frames=segment['frames'], bytes=size)
+
+    def rotate(self):
+        # Starts a new segment at the next frame, e.g. so that new encoder
+        # settings (picked up by segment_factory) take effect
+        self._rotate_requested = True
+
+    def _should_rotate(self, media_time):
+        if not self._segment['frames']:
+            return False
+        if self._rotate_requested:
+            self._rotate_requested = False
+            return True
+        if self.segment_seconds and media_time - self._segment['start'] >= self.segment_seconds:
+            return True
+        if self.segment_bytes and time.monotonic() >= self._next_size_check:
+            # ffmpeg and cv2 write progressively; a stat once a second is enough
+            self._next_size_check = time.monotonic() + 1.0
+            try:
+                return os.path.getsize(self.filename) >= self.segment_bytes
+            except OSError:
+                return False
+        return False
+
+    def write(self, frame, timestamp=None):
+        media_time = self._last_time
+        if timestamp is not None and self.av_clock is not None:
+            media_time = max(0.0, self.av_clock.media_time(timestamp))
+        if self._should_rotate(media_time):
+            self._close_current(media_time)
+            self._open(media_time)
+        self._sink.write(frame, timestamp)
+        self._segment['frames'] += 1
+        self._last_time = media_time
+
+    def close(self):
+        if self._sink is None:
+            return
+        # 'end' in the manifest marks a finished session; audio past the end
+        # of the video is cut off so the last segment can complete
+        self._close_current(self._last_time)
+        if self.audio is not None:
+            self.audio.close()
+        self.manifest.append(event='end', segments=self.index + 1)
+        self.manifest.close()
+        self.writer_lock.release()
+
+
+def recover_session(manifest_path, output=None, ffmpeg=None):
+    # Rebuilds a session from its manifest, e.g. after a crash. Returns the
+    # segments in order; segments that were never closed are kept when their
+    # file exists and is not empty (containers like .mkv/.avi/.ts stay mostly
+    # playable). With output set the segments are joined into one file by
+    # ffmpeg's concat demuxer without re-encoding. Every attempt, even one
+    # that found nothing, ends with a 'recovered' event, so a scan for
+    # unfinished sessions does not pick the session up again. Raises
+    # RuntimeError while the session is still being recorded.
+    lock = ManifestLock(manifest_path)
+    if not lock.acquire():
+        raise RuntimeError(f"{os.path.basename(manifest_path)} is still being recorded")
+    try:
+        result = _recover_segments(manifest_path)
+        error = None
+        try:
+            if output and result:
+                _join_segments(manifest_path, result, output, ffmpeg)
+        except Exception as e:
+            error = e
+        manifest = Manifest(manifest_path)
+        manifest.append(event='recovered', segments=[segment['segment'] for segment in result],
+                        output=os.path.basename(output) if output and result and error is None else None,
+                        error=str(error) if error is not None else None)
+        manifest.close()
+        if error is not None:
+            raise error
+        return result
+    finally:
+        lock.release()
+
+
+def _recover_segments(manifest_path):
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    segments = {}
+    for event in read_manifest(manifest_path):
+        if event.get('event') == 'open':
+            segments[event['segment']] = dict(event, closed=False)
+        elif event.get('event') == 'close' and event['segment'] in segments:
+            segments[event['segment']].update(event, closed=True)
+
+    result = []
+    for index in sorted(segments):
+        segment = segments[index]
+        path = os.path.join(directory, segment['file'])
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if not size:
+            continue
+        segment['path'] = path
+        segment['recovered'] = not segment['closed']
+        result.append(segment)
+    return result
+
+
+def _join_segments(manifest_path, segments, output, ffmpeg=None):
+    from greenrecord.sinks import find_ffmpeg
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg not found")
+    listing = os.path.splitext(manifest_path)[0] + '.ffconcat'
+    with open(listing, 'w', encoding='utf-8') as f:
+        f.write('ffconcat version 1.0\n')
+        for segment in segments:
+            f.write("file '" + segment['path'].replace("'", "'\\''") + "'\n")
+    try:
+        subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0',
+                        '-i', listing, '-c', 'copy', output], check=True)
+    finally:
+        os.remove(listing)
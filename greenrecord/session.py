@@ -0,0 +1,581 @@
+import functools
+import os
+import re
+import time
+
+from greenrecord.encoders import SEGMENT_CONTAINER, EncoderSettings
+from greenrecord.pacing import AVClock
+from greenrecord.segments import Manifest
+
+
+class OutputSpec:
+    # An extra output of a RecordingSession. region is in screen coordinates
+    # (None = everything the session captures), size None keeps the region's
+    # size, fps and encoder None take the session's. Written to
+    # <base>_<name>.<ext>, video only.
+    def __init__(self, name, region=None, size=None, fps=None, encoder=None):
+        if not re.fullmatch(r'[A-Za-z][A-Za-z0-9_]*', name):
+            raise ValueError(f"Output name must be a letter followed by letters, digits or '_': {name!r}")
+        self.name = name
+        self.region = region
+        self.size = size
+        self.fps = fps
+        self.encoder = encoder
+
+
+class RecordingSession:
+    # One recording, wired the same way for the GUI and the command line:
+    # capture backend -> (crop/scale) -> engine -> sink, plus the microphone,
+    # segmenting, metrics and the pause/resume event log. Files are named
+    # from `base` (<base>.mp4, <base>.wav, <base>.events.jsonl, ...).
+    # `outputs` (OutputSpec) are extra video-only outputs fed by the
+    # same capture pass, written to <base>_<name>.<ext>. With replay_seconds
+    # nothing is written until save_replay(): the main output only keeps the
+    # last replay_seconds of encoded audio and video in memory.
+    # adaptive lowers the encoder preset, frame rate (down to min_fps) and
+    # resolution (down to min_scale) while the machine cannot keep up and
+    # raises them again when it can; frame rate changes at once, preset and
+    # resolution at the next segment (ffmpeg segmenting only). Every step is
+    # written to the event log.
+    # pixel_format 'auto' hands the encoder frames in its own 4:2:0 format
+    # when the sink takes them (ffmpeg does, cv2.VideoWriter only reads
+    # bgr24); the thread engine converts them straight from the backend's
+    # BGRA memory. See pixfmt.negotiate.
+    # spool_bytes lets frames the encoder cannot take in time overflow into
+    # a memory-mapped file in spool_dir (thread engine with one output).
+    # audio_sources adds input devices (e.g. a monitor of the system output)
+    # to audio_device, each at its own rate, resampled and drift-locked to
+    # it; they are mixed, or with audio_tracks kept as separate audio tracks.
+    # preview_port serves a live MJPEG preview of the frames being recorded
+    # (thread engine; see preview.PreviewServer), port 0 = any free port.
+    # capture (a capturepool.CapturePool) shares screen grabs with the other
+    # sessions of the process instead of opening a backend of its own.
+    # numpy, cv2 and the backend modules are only imported by start().
+    def __init__(self, base, encoder=None, region=None, size=None, fps=20.0, backend=None,
+                 backend_options=None, engine='threads', live_mux=True, audio=True, samplerate=44100,
+                 audio_device=None, audio_blocksize=1024, audio_latency='low', audio_buffer_seconds=2.0,
+                 queue_size=4, policy=None, vfr=False, change_tile=32, segment_seconds=0,
+                 segment_bytes=0, metrics=None, sd_module=None, outputs=None, replay_seconds=0,
+                 replay_max_bytes=None, adaptive=False, min_fps=None, min_scale=1.0, pixel_format='auto',
+                 spool_bytes=0, spool_dir=None, audio_sources=(), audio_tracks=False, preview_port=None,
+                 preview_host='127.0.0.1', preview_fps=5.0, preview_width=640, capture=None):
+        self.base = base
+        self.encoder = encoder or EncoderSettings()
+        self.region = region
+        self.size = size
+        self.fps = fps
+        self.backend = backend
+        self.backend_options = dict(backend_options or {})
+        self.engine_type = engine
+        self.live_mux = live_mux
+        self.audio = audio
+        self.samplerate = samplerate
+        self.audio_device = audio_device
+        self.audio_blocksize = audio_blocksize
+        self.audio_latency = audio_latency
+        self.audio_buffer_seconds = audio_buffer_seconds
+        self.audio_sources = list(audio_sources or [])
+        self.audio_tracks = audio_tracks
+        self.audio_inputs = None
+        self.audio_channels = 1
+        self.audio_track_layout = None
+        self.queue_size = queue_size
+        self.policy = policy
+        self.vfr = vfr
+        self.change_tile = change_tile
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.replay_seconds = replay_seconds
+        self.replay_max_bytes = replay_max_bytes
+        self.replay = None
+        self.adaptive = adaptive
+        self.min_fps = min_fps
+        self.min_scale = min_scale
+        self.adaptive_controller = None
+        self.adaptive_level = None
+        self._segment_sink = None
+        self.pixel_format = pixel_format
+        self.frame_format = None
+        self.spool_bytes = spool_bytes
+        self.spool_dir = spool_dir
+        self.preview_port = preview_port
+        self.preview_host = preview_host
+        self.preview_fps = preview_fps
+        self.preview_width = preview_width
+        self.preview = None
+        self.capture = capture
+        self.metrics = metrics
+        self.sd_module = sd_module
+        self.outputs = list(outputs or [])
+        if len({output.name for output in self.outputs}) != len(self.outputs):
+            raise ValueError("Output names must be unique")
+        self.video_filename = self.encoder.filename(base)
+        self.audio_filename = base + ".wav"
+        self.timecodes_filename = base + ".timecodes.txt"
+        self.output_filenames = {output.name: (output.encoder or self.encoder).filename(f"{base}_{output.name}")
+                                 for output in self.outputs}
+        self.av_clock = AVClock()
+        self.engine = None
+        self.audio_recorder = None
+        self.event_log = None
+        self.transform = None
+        self.started_at = None
+
+    @property
+    def segmenting(self):
+        return bool(self.segment_seconds or self.segment_bytes)
+
+    @property
+    def is_paused(self):
+        return self.engine is not None and self.engine.is_paused
+
+    @property
+    def is_running(self):
+        return self.engine is not None
+
+    def start(self):
+        from greenrecord.metrics import Metrics
+        from greenrecord.pipeline import BLOCK
+        from greenrecord.pixfmt import negotiate
+        from greenrecord.sinks import FFmpegMuxSink, VideoWriterSink, find_ffmpeg
+        from greenrecord.transform import FrameTransform
+
+        if self.metrics is None:
+            self.metrics = Metrics()
+        if self.policy is None:
+            self.policy = BLOCK
+        # Only the selected region is grabbed; the transform scales it to the output size.
+        # With extra outputs the grab covers all of their regions and each one crops its own
+        crop = None
+        if self.outputs:
+            from greenrecord.fanout import relative_region, union_region
+            source = self._open_source(union_region([self.region] + [output.region for output in self.outputs]))
+            crop = relative_region(self.region, source.region)
+        else:
+            source = self._open_source(self.region)
+        use_mux = bool(self.live_mux and find_ffmpeg())
+        if self.vfr and use_mux:
+            # ffmpeg читает rawvideo с постоянной частотой: каждый пропущенный кадр
+            # укоротил бы видео относительно звука, а файл timecodes уже сведённый файл не исправит
+            print("VFR не используется с живым сведением ffmpeg: кадры пишутся с постоянной частотой")
+            self.vfr = False
+        # Кадры сразу в формате кодировщика (yuv420p), если его принимает вывод
+        sink_formats = FFmpegMuxSink.pixel_formats if use_mux else VideoWriterSink.pixel_formats
+        self.frame_format = negotiate(self.encoder.pix_fmt, sink_formats, self.pixel_format)
+        # Native BGRA only where the grabbing thread also converts: one output, no capture process
+        in_format = 'bgr24'
+        if not self.outputs and (self.engine_type != 'processes' or self.replay_seconds) \
+                and hasattr(source, 'grab_native'):
+            in_format = source.native_format
+        self.transform = FrameTransform(source.shape, self.size or self._crop_size(crop, source),
+                                        crop=crop, in_format=in_format, out_format=self.frame_format)
+
+        self._resolve_audio()
+        # Общие часы для аудио и видео: обе дорожки отсчитываются от одного момента
+        self.av_clock.begin()
+        self.started_at = time.time()
+        # Журнал пауз рядом с записью: где на шкале записи был стык
+        self.event_log = Manifest(self.base + ".events.jsonl")
+        self.event_log.append(event='start', video=os.path.basename(self.video_filename),
+                              pixel_format=self.frame_format)
+        try:
+            if self.engine_type == 'processes' and self.capture is not None:
+                # Общий захват живёт в этом процессе, процесс захвата его не увидит
+                print("Общий захват записывается движком на потоках")
+                self._start_threads(source, use_mux)
+            elif self.engine_type == 'processes' and (self.outputs or self.replay_seconds):
+                # Кадры делятся между выходами (и буфер повтора живёт) в памяти одного процесса
+                print("Несколько выходов и повтор записываются движком на потоках")
+                self._start_threads(source, use_mux)
+            elif self.engine_type == 'processes':
+                self._start_processes(source, use_mux)
+            else:
+                self._start_threads(source, use_mux)
+        except Exception:
+            self._stop_audio()
+            self._stop_preview()
+            source.close()
+            self.event_log.close()
+            raise
+        if self.adaptive:
+            self._start_adaptive()
+
+    def _open_source(self, region):
+        from greenrecord.capture import create_backend
+        if self.capture is not None:
+            return self.capture.source(region, self.fps)
+        return create_backend(self.backend, region=region, **self.backend_options)
+
+    @staticmethod
+    def _crop_size(crop, source):
+        from greenrecord.transform import clamp_region
+        return clamp_region(crop, (source.shape[1], source.shape[0]))[2:]
+
+    def _resolve_audio(self):
+        # Native rate and channels of every extra device; the main one is
+        # recorded at samplerate, mono, as without extra sources
+        self.audio_inputs = None
+        self.audio_channels = 1
+        self.audio_track_layout = None
+        if not (self.audio and self.audio_sources):
+            return
+        from greenrecord.mixer import AudioInputSpec, output_channels, resolve_inputs
+        try:
+            extra = resolve_inputs([AudioInputSpec(device) for device in self.audio_sources], self.sd_module,
+                                   self.samplerate)
+        except Exception as e:
+            print(f"Ошибка дополнительных источников звука: {e}")
+            return
+        self.audio_inputs = [AudioInputSpec(self.audio_device, self.samplerate, 1)] + extra
+        self.audio_channels = output_channels(self.audio_inputs, self.audio_tracks)
+        if self.audio_tracks:
+            self.audio_track_layout = [spec.channels for spec in self.audio_inputs]
+
+    def _audio_format(self):
+        # FFmpegMuxSink / ReplaySink options for the audio stream's layout
+        return {'channels': self.audio_channels, 'audio_tracks': self.audio_track_layout}
+
+    def _segment_options(self, use_mux):
+        return {
+            'base': self.base,
+            'extension': SEGMENT_CONTAINER if use_mux else self.encoder.container,
+            'segment_seconds': self.segment_seconds,
+            'segment_bytes': self.segment_bytes,
+        }
+
+    def _start_threads(self, source, use_mux):
+        # Capture and encoding run on the engine's worker threads, so this
+        # returns immediately
+        from greenrecord.dirty import ChangeDetector
+        from greenrecord.pipeline import RecordingEngine
+        from greenrecord.segments import SegmentedSink
+        from greenrecord.sinks import FFmpegMuxSink, TimecodeSink, VideoWriterSink
+
+        samplerate = self.samplerate if self.audio else None
+        out_size = self.transform.out_size
+        vfr = self.vfr
+        if self.replay_seconds:
+            # Повтор: сжатые пакеты последних N секунд в памяти, файл — только по запросу
+            sink = self._replay_sink(use_mux, samplerate, out_size)
+            self._start_audio(sink.audio)
+            vfr = False
+        elif use_mux and self.segmenting:
+            # Сегменты по очереди: каждый закрывается целиком, звук делится в тех же точках
+            segment_factory = functools.partial(self._mux_segment, size=out_size, samplerate=samplerate)
+            sink = SegmentedSink(segment_factory, av_clock=self.av_clock, samplerate=samplerate,
+                                 **self._segment_options(True))
+            self._segment_sink = sink
+            self._start_audio(sink.audio)
+        elif use_mux:
+            # Один проход: ffmpeg кодирует и сводит аудио и видео в один файл во время записи
+            sink = FFmpegMuxSink(self.video_filename, self.fps, out_size, samplerate=samplerate,
+                                 video_args=self.encoder.video_args(), audio_args=self.encoder.audio_args(),
+                                 pix_fmt=self.frame_format, **self._audio_format())
+            self._start_audio(sink.audio)
+        elif self.segmenting:
+            segment_factory = functools.partial(VideoWriterSink, fps=self.fps, fourcc=self.encoder.fourcc,
+                                                params=self.encoder.opencv_params(),
+                                                fallback_fourcc=self.encoder.fallback_fourcc)
+            sink = SegmentedSink(segment_factory, av_clock=self.av_clock, **self._segment_options(False))
+            self._start_audio()
+        else:
+            sink = VideoWriterSink(self.video_filename, self.fps, self.encoder.fourcc,
+                                   self.encoder.opencv_params(), self.encoder.fallback_fourcc)
+            self._start_audio()
+        detector = None
+        if vfr:
+            # Static screens: only changed frames are encoded, with their real timestamps
+            detector = ChangeDetector(self.transform.out_shape, tile=self.change_tile)
+            sink = TimecodeSink(sink, self.timecodes_filename, self.av_clock)
+        if self.preview_port is not None:
+            # Предпросмотр берёт кадры, которые и так идут в кодировщик: второго захвата нет
+            sink = self._preview_tap(sink)
+        if self.outputs:
+            if self.spool_bytes:
+                print("Спул на диске не используется с несколькими выходами")
+            self.engine = self._fan_out(source, sink, detector, vfr, use_mux)
+        else:
+            # Спул: кадры, которые кодировщик не успел взять, ждут в файле, а не теряются
+            self.engine = RecordingEngine(source, sink, fps=self.fps, queue_size=self.queue_size,
+                                          policy=self.policy, av_clock=self.av_clock, detector=detector,
+                                          vfr=vfr, transform=self.transform, metrics=self.metrics,
+                                          spool_bytes=self.spool_bytes, spool_dir=self.spool_dir)
+        self.engine.start()
+
+    def _preview_tap(self, sink):
+        from greenrecord.preview import PreviewServer, PreviewTap
+
+        self.preview = PreviewServer(self.preview_host, self.preview_port, fps=self.preview_fps,
+                                     width=self.preview_width, metrics=self.metrics)
+        try:
+            self.preview.start()
+        except OSError as e:
+            print(f"Ошибка сервера предпросмотра: {e}")
+            self.preview = None
+            return sink
+        print(f"Предпросмотр: {self.preview.url}")
+        return PreviewTap(sink, self.preview, self.frame_format)
+
+    def _stop_preview(self):
+        if self.preview is not None:
+            self.preview.stop()
+            self.preview = None
+
+    def _mux_segment(self, filename, size, samplerate):
+        # One ffmpeg segment at the current adaptive level
+        from greenrecord.sinks import FFmpegMuxSink
+
+        encoder, video_args = self.encoder, None
+        level = self.adaptive_level
+        if level is not None:
+            encoder = EncoderSettings(self.encoder.codec.name, level.preset, self.encoder.crf, self.encoder.bitrate,
+                                      self.encoder.threads)
+            if level.scale < 1.0:
+                from greenrecord.adaptive import scale_filter
+                video_args = ['-vf', scale_filter(level.scale)]
+        video_args = (video_args or []) + encoder.video_args(SEGMENT_CONTAINER)
+        return FFmpegMuxSink(filename, fps=self.fps, size=size, samplerate=samplerate, video_args=video_args,
+                             audio_args=encoder.audio_args(), pix_fmt=self.frame_format, **self._audio_format())
+
+    def _start_adaptive(self):
+        # Preset and resolution only change with ffmpeg segments of the thread engine
+        from greenrecord.adaptive import AdaptiveController, build_ladder
+
+        per_segment = self._segment_sink is not None
+        ladder = build_ladder(self.fps, self.encoder.preset, self.min_fps,
+                              self.min_scale if per_segment else 1.0, presets=per_segment)
+        if len(ladder) == 1:
+            print("Адаптивное качество: менять нечего (проверьте минимальные fps и масштаб)")
+            return
+        self.adaptive_level = ladder[0]
+        self.adaptive_controller = AdaptiveController(self.engine, ladder, self._apply_level, self.metrics,
+                                                      queue_size=self.queue_size, on_change=self._level_changed)
+        self.adaptive_controller.start()
+
+    def _apply_level(self, level):
+        old, self.adaptive_level = self.adaptive_level, level
+        if level.fps != old.fps:
+            self.engine.set_fps(level.fps)
+        if self._segment_sink is not None and (level.scale != old.scale or level.preset != old.preset):
+            self._segment_sink.rotate()
+
+    def _level_changed(self, old, new, reasons):
+        print(f"Адаптивное качество: {old.fps:.1f} fps, x{old.scale:.2f}, {old.preset} -> "
+              f"{new.fps:.1f} fps, x{new.scale:.2f}, {new.preset} ({', '.join(reasons)})")
+        self.event_log.append(event='adapt', media=self.av_clock.media_time(time.monotonic()),
+                              level=self.adaptive_controller.index, reason=reasons,
+                              sample=self.adaptive_controller.last_sample, **new.as_dict())
+
+    def _fan_out(self, source, sink, detector, vfr, use_mux):
+        # Один захват на все выходы: у каждого своя обрезка, масштаб, частота кадров и кодек
+        from greenrecord.fanout import FanOutEngine, OutputPipeline, relative_region
+        from greenrecord.pixfmt import negotiate
+        from greenrecord.sinks import FFmpegMuxSink, VideoWriterSink
+        from greenrecord.transform import FrameTransform
+
+        pipelines = [OutputPipeline('main', sink, self.fps, self.transform, detector, vfr,
+                                    self.queue_size, self.policy)]
+        try:
+            for output in self.outputs:
+                encoder = output.encoder or self.encoder
+                fps = output.fps or self.fps
+                crop = relative_region(output.region, source.region)
+                sink_formats = FFmpegMuxSink.pixel_formats if use_mux else VideoWriterSink.pixel_formats
+                pixel_format = negotiate(encoder.pix_fmt, sink_formats, self.pixel_format)
+                transform = FrameTransform(source.shape, output.size or self._crop_size(crop, source), crop=crop,
+                                           out_format=pixel_format)
+                filename = self.output_filenames[output.name]
+                if use_mux:
+                    output_sink = FFmpegMuxSink(filename, fps, transform.out_size, video_args=encoder.video_args(),
+                                                pix_fmt=pixel_format)
+                else:
+                    output_sink = VideoWriterSink(filename, fps, encoder.fourcc, encoder.opencv_params(),
+                                                  encoder.fallback_fourcc)
+                pipelines.append(OutputPipeline(output.name, output_sink, fps, transform,
+                                                queue_size=self.queue_size, policy=self.policy))
+        except Exception:
+            for pipeline in pipelines:
+                pipeline.sink.close()
+            raise
+        return FanOutEngine(source, pipelines, queue_size=self.queue_size, av_clock=self.av_clock,
+                            metrics=self.metrics)
+
+    def _replay_sink(self, use_mux, samplerate, out_size):
+        from greenrecord.replay import REPLAY_CODECS, ReplaySink
+
+        if not use_mux:
+            raise RuntimeError("Instant replay needs ffmpeg")
+        encoder = self.encoder
+        if encoder.codec.name not in REPLAY_CODECS:
+            # MJPEG/FFV1 do not go into MPEG-TS; replay clips are H.264 then
+            encoder = EncoderSettings('h264', encoder.preset, threads=encoder.threads)
+        self.replay = ReplaySink(self.replay_seconds, self.fps, out_size, samplerate,
+                                 video_args=encoder.video_args('.ts'), audio_args=encoder.audio_args(),
+                                 max_bytes=self.replay_max_bytes, pix_fmt=self.frame_format,
+                                 **self._audio_format())
+        self.metrics.add_source(self.replay.stats)
+        return self.replay
+
+    def save_replay(self, path=None, on_done=None):
+        # Writes the replay window to `path` (default <base>_replay_<time>.mp4)
+        # on a background thread; capture goes on. on_done(path, error) is
+        # called from that thread.
+        if self.replay is None:
+            raise RuntimeError("Not in replay mode")
+        path = path or f"{self.base}_replay_{time.strftime('%Y%m%d_%H%M%S')}.mp4"
+        self.event_log.append(event='replay', file=os.path.basename(path),
+                              media=self.av_clock.media_time(time.monotonic()),
+                              seconds=self.replay.buffer.duration())
+        return self.replay.save(path, on_done)
+
+    def _start_processes(self, source, use_mux):
+        # Захват, преобразование и кодирование — в отдельных процессах, кадры
+        # передаются через общую память. Здесь остаются только управление и статус.
+        from greenrecord.mp_engine import MultiProcessEngine
+        from greenrecord.sinks import AudioSocketInput, FFmpegMuxSink, VideoWriterSink
+
+        if self.spool_bytes:
+            print("Спул на диске используется только движком на потоках")
+        if self.preview_port is not None:
+            print("Предпросмотр доступен только движку на потоках")
+        backend, shape = source.name, source.shape
+        source.close()  # Процесс захвата откроет источник сам
+        out_size = self.transform.out_size
+        segments = None
+        if self.segmenting:
+            segments = self._segment_options(use_mux)
+            if use_mux:
+                sink_factory = functools.partial(FFmpegMuxSink, fps=self.fps, size=out_size,
+                                                 video_args=self.encoder.video_args(SEGMENT_CONTAINER),
+                                                 pix_fmt=self.frame_format)
+            else:
+                sink_factory = functools.partial(VideoWriterSink, fps=self.fps, fourcc=self.encoder.fourcc,
+                                                 params=self.encoder.opencv_params(),
+                                                 fallback_fourcc=self.encoder.fallback_fourcc)
+            self._start_audio()  # Звук отдельным WAV: между процессами он на сегменты не делится
+        elif use_mux:
+            audio_input = AudioSocketInput() if self.audio else None
+            sink_factory = functools.partial(FFmpegMuxSink, self.video_filename, self.fps, out_size,
+                                             samplerate=self.samplerate if self.audio else None,
+                                             video_args=self.encoder.video_args(),
+                                             audio_args=self.encoder.audio_args(),
+                                             audio_port=audio_input.port if audio_input else None,
+                                             pix_fmt=self.frame_format, **self._audio_format())
+            self._start_audio(audio_input)
+        else:
+            sink_factory = functools.partial(VideoWriterSink, self.video_filename, self.fps, self.encoder.fourcc,
+                                             self.encoder.opencv_params(), self.encoder.fallback_fourcc)
+            self._start_audio()
+        options = dict(self.backend_options, region=self.region)
+        self.engine = MultiProcessEngine(backend, options, shape, sink_factory, fps=self.fps,
+                                         queue_size=self.queue_size, policy=self.policy, av_clock=self.av_clock,
+                                         transform=self.transform, vfr=self.vfr,
+                                         timecodes=self.timecodes_filename if self.vfr else None,
+                                         change_tile=self.change_tile if self.vfr else None,
+                                         segments=segments, metrics=self.metrics)
+        self.engine.start()
+
+    def _start_audio(self, sink=None):
+        # Аудио пишется потоково: колбэк sounddevice -> кольцевой буфер -> WAV (или ffmpeg)
+        if not self.audio:
+            return
+        from greenrecord.audio import AudioRecorder
+        try:
+            if self.audio_inputs:
+                # Несколько устройств: пересэмплирование и сведение (или дорожки) в одном потоке
+                from greenrecord.mixer import MultiSourceRecorder
+                self.audio_recorder = MultiSourceRecorder(self.audio_filename, self.samplerate, self.audio_inputs,
+                                                          tracks=self.audio_tracks,
+                                                          blocksize=self.audio_blocksize,
+                                                          latency=self.audio_latency,
+                                                          buffer_seconds=self.audio_buffer_seconds,
+                                                          av_clock=self.av_clock,
+                                                          sd_module=self.sd_module,
+                                                          sink=sink,
+                                                          metrics=self.metrics)
+            else:
+                self.audio_recorder = AudioRecorder(self.audio_filename, self.samplerate,
+                                                    blocksize=self.audio_blocksize,
+                                                    latency=self.audio_latency,
+                                                    device=self.audio_device,
+                                                    buffer_seconds=self.audio_buffer_seconds,
+                                                    av_clock=self.av_clock,
+                                                    sd_module=self.sd_module,
+                                                    sink=sink,
+                                                    metrics=self.metrics)
+            self.audio_recorder.start()
+        except Exception as e:
+            print(f"Ошибка записи аудио: {e}")
+            self.audio_recorder = None
+            if sink is not None:
+                sink.close()  # Видео запишется без звука
+
+    def pause(self):
+        # Аудио и видео встают на паузу в один и тот же момент AVClock, и этот
+        # отрезок вырезается из обеих дорожек; потоки захвата спят без нагрузки
+        if self.engine is None or self.engine.is_paused:
+            return
+        paused_at = self.av_clock.pause()
+        self.engine.pause()
+        if self.audio_recorder is not None:
+            self.audio_recorder.pause(paused_at)
+        self.event_log.append(event='pause', media=self.av_clock.media_time(paused_at))
+
+    def resume(self):
+        if self.engine is None or not self.engine.is_paused:
+            return
+        if self.audio_recorder is not None:
+            self.audio_recorder.resume()
+        paused = self.av_clock.resume()
+        self.engine.resume()
+        self.event_log.append(event='resume', media=self.av_clock.media_time(time.monotonic()), paused=paused)
+
+    def _stop_audio(self):
+        if self.audio_recorder is not None:
+            self.audio_recorder.stop()
+
+    def stop(self):
+        # Returns the final stats. Audio is closed first, otherwise ffmpeg
+        # (possibly in the encoder process) would wait for the end of the sound.
+        if self.engine is None:
+            return {}
+        paused = self.engine.is_paused
+        if self.adaptive_controller is not None:
+            self.adaptive_controller.stop()
+        self._stop_audio()
+        # Захват завершается, кодировщик дописывает очередь
+        self.engine.stop()
+        stats = self.stats()
+        self._stop_preview()
+        if paused:
+            self.av_clock.resume()  # Остановка во время паузы: пауза заканчивается здесь
+        self.event_log.append(event='stop', media=self.av_clock.media_time(time.monotonic()),
+                              paused_total=self.av_clock.paused_total)
+        self.event_log.close()
+        self.engine = None
+        self.replay = None
+        self.adaptive_controller = None
+        self._segment_sink = None
+        return stats
+
+    def recorded_files(self):
+        # Finished video files of the session (after stop), e.g. for post-processing
+        if self.replay_seconds:
+            return []
+        if self.segmenting:
+            from greenrecord.segments import read_manifest
+            directory = os.path.dirname(os.path.abspath(self.base))
+            files = [os.path.join(directory, event['file']) for event in read_manifest(self.base + '.manifest.jsonl')
+                     if event.get('event') == 'close']
+        else:
+            files = [self.video_filename]
+        files += list(self.output_filenames.values())
+        return [path for path in files if os.path.exists(path)]
+
+    def stats(self):
+        # May run while stop() clears these on another thread: each is read once
+        stats = {}
+        for part in (self.engine, self.audio_recorder, self.replay, self.preview):
+            if part is not None:
+                stats.update(part.stats())
+        return stats
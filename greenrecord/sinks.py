@@ -0,0 +1,236 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+
+from greenrecord.pixfmt import PIXEL_FORMATS
+
+
+def find_ffmpeg():
+    return os.environ.get('GREENRECORD_FFMPEG') or shutil.which('ffmpeg')
+
+
+class VideoWriterSink:
+    # Writes BGR frames with cv2.VideoWriter. The writer is opened on the
+    # first frame so its size always matches what the pipeline delivers.
+    pixel_formats = ('bgr24',)
+
+    def __init__(self, filename, fps, fourcc="mp4v", params=None, fallback_fourcc=None):
+        self.filename = filename
+        self.fps = fps
+        self.fourcc = fourcc
+        self.params = params or []
+        self.fallback_fourcc = fallback_fourcc
+        self._writer = None
+
+    def _open(self, fourcc, size):
+        import cv2
+        codec = cv2.VideoWriter_fourcc(*fourcc)
+        if self.params:
+            writer = cv2.VideoWriter(self.filename, codec, self.fps, size, self.params)
+        else:
+            writer = cv2.VideoWriter(self.filename, codec, self.fps, size)
+        return writer if writer.isOpened() else None
+
+    def write(self, frame, timestamp=None):
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._writer = self._open(self.fourcc, (width, height))
+            if self._writer is None and self.fallback_fourcc:
+                print(f"cv2.VideoWriter has no {self.fourcc} encoder, using {self.fallback_fourcc}")
+                self._writer = self._open(self.fallback_fourcc, (width, height))
+            if self._writer is None:
+                raise RuntimeError(f"cv2.VideoWriter cannot write {self.fourcc} to {self.filename}")
+        self._writer.write(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+class TimecodeSink:
+    # Variable-frame-rate wrapper: frames go to the inner sink once each and
+    # their presentation times (ms) are streamed to a "timecode format v2"
+    # file, which mkvmerge (--timestamps) and x264 (--tcfile-in) apply when
+    # remuxing. Needed because cv2.VideoWriter only knows a constant rate.
+    def __init__(self, sink, path, av_clock):
+        self.sink = sink
+        self.path = path
+        self.av_clock = av_clock
+        self._file = open(path, 'w')
+        self._file.write("# timestamp format v2\n")
+        self._last_ms = None
+
+    def write(self, frame, timestamp=None):
+        ms = max(0.0, self.av_clock.media_time(timestamp) * 1000.0)
+        if self._last_ms is not None and ms <= self._last_ms:
+            ms = self._last_ms + 0.001  # timecodes must be strictly increasing
+        self._last_ms = ms
+        self.sink.write(frame, timestamp)
+        self._file.write(f"{ms:.3f}\n")
+
+    def close(self):
+        self.sink.close()
+        if not self._file.closed:
+            self._file.close()
+
+
+class AudioSocketInput:
+    # Audio side of FFmpegMuxSink. ffmpeg connects to a localhost socket we
+    # listen on (works the same on Windows and POSIX, unlike extra pipe fds)
+    # and reads raw PCM from it. It can live in another process than the
+    # sink: only the port has to be passed on.
+    def __init__(self, connect_timeout=10.0, on_close=None):
+        self.connect_timeout = connect_timeout
+        self._on_close = on_close
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self._server.settimeout(connect_timeout)
+        self.port = self._server.getsockname()[1]
+        self._conn = None
+        self._connected = threading.Event()
+        self._closed = False
+        threading.Thread(target=self._accept, name="greenrecord-mux-audio", daemon=True).start()
+
+    def _accept(self):
+        try:
+            self._conn, _ = self._server.accept()
+        except OSError:
+            pass
+        finally:
+            self._server.close()
+            self._connected.set()
+
+    def write(self, block):
+        if self._conn is None:
+            self._connected.wait(self.connect_timeout)
+            if self._conn is None:
+                raise RuntimeError("ffmpeg did not open the audio input")
+        self._conn.sendall(memoryview(block).cast('B'))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._conn is None:
+            # Let ffmpeg see an empty audio stream instead of waiting for one
+            self._connected.wait(self.connect_timeout)
+        if self._conn is not None:
+            self._conn.close()
+        else:
+            self._server.close()
+        if self._on_close is not None:
+            self._on_close()
+
+
+def track_filter(tracks):
+    # ffmpeg filter graph splitting input 0's interleaved audio into one
+    # labelled stream per track: [1, 2] -> [t0] = channel 0, [t1] = channels 1-2
+    splits = ''.join(f'[s{index}]' for index in range(len(tracks)))
+    graph = [f'[0:a]asplit={len(tracks)}{splits}']
+    offset = 0
+    for index, channels in enumerate(tracks):
+        layout = {1: 'mono', 2: 'stereo'}.get(channels, f'{channels}c')
+        mapping = '|'.join(f'c{channel}=c{offset + channel}' for channel in range(channels))
+        graph.append(f'[s{index}]pan={layout}|{mapping}[t{index}]')
+        offset += channels
+    return ';'.join(graph)
+
+
+class FFmpegMuxSink:
+    # Single-pass recording: raw frames (bgr24, or pix_fmt, see pixfmt) go to
+    # ffmpeg's stdin and PCM audio over a socket, and ffmpeg encodes and muxes
+    # both into one file while we record. The file is finished as soon as both inputs are closed, with no
+    # second decode/encode pass to merge separate audio and video files.
+    # With audio_port the audio input belongs to an AudioSocketInput created
+    # elsewhere (e.g. in the parent of an encoder process) and self.audio is None.
+    # With stdout=subprocess.PIPE (filename 'pipe:1' plus a streamable format
+    # in output_args) the encoded stream is read from self.stdout instead.
+    # audio_tracks (channel counts, e.g. [1, 2]) splits the interleaved audio
+    # input into that many audio tracks of the file (see mixer.MultiSourceRecorder).
+    pixel_formats = PIXEL_FORMATS
+
+    def __init__(self, filename, fps, size, samplerate=None, channels=1,
+                 video_args=('-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'),
+                 audio_args=('-c:a', 'aac', '-b:a', '160k'),
+                 ffmpeg=None, connect_timeout=10.0, audio_port=None, output_args=(), stdout=None,
+                 pix_fmt='bgr24', audio_tracks=None):
+        ffmpeg = ffmpeg or find_ffmpeg()
+        if not ffmpeg:
+            raise RuntimeError("ffmpeg not found")
+        self.filename = filename
+        self.connect_timeout = connect_timeout
+        self.returncode = None
+        self._lock = threading.Lock()
+        self._open_inputs = 1
+        width, height = size
+
+        # Audio is opened first: ffmpeg opens its inputs one after another and
+        # probing the video pipe blocks until frames arrive, which must not
+        # hold up the audio connection. Probing is kept to the minimum since
+        # both formats are fully described on the command line.
+        probe = ['-thread_queue_size', '512', '-probesize', '32', '-analyzeduration', '0']
+        command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y']
+        self.audio = None
+        if samplerate:
+            if audio_port is None:
+                self.audio = AudioSocketInput(connect_timeout, on_close=self._input_closed)
+                audio_port = self.audio.port
+                self._open_inputs += 1
+            command += probe + ['-f', 's16le', '-ar', str(int(samplerate)), '-ac', str(channels),
+                                '-i', f'tcp://127.0.0.1:{audio_port}']
+        video_input = 1 if samplerate else 0
+        command += probe + ['-f', 'rawvideo', '-pix_fmt', pix_fmt, '-video_size', f'{width}x{height}',
+                            '-framerate', str(fps), '-i', 'pipe:0']
+        command += ['-map', f'{video_input}:v']
+        if samplerate and audio_tracks and len(audio_tracks) > 1:
+            command += ['-filter_complex', track_filter(audio_tracks)]
+            for index in range(len(audio_tracks)):
+                command += ['-map', f'[t{index}]']
+        elif samplerate:
+            command += ['-map', '0:a']
+        command += list(video_args)
+        if samplerate:
+            command += list(audio_args)
+        command += list(output_args)
+        command.append(filename)
+
+        self._log = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=stdout or subprocess.DEVNULL,
+                                         stderr=self._log)
+        self.stdout = self._process.stdout
+        self._video_closed = False
+
+    def write(self, frame, timestamp=None):
+        try:
+            self._process.stdin.write(memoryview(frame).cast('B'))
+        except BrokenPipeError:
+            raise RuntimeError("ffmpeg exited: " + self._error_output())
+
+    def close(self):
+        if self._video_closed:
+            return
+        self._video_closed = True
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._input_closed()
+
+    def _input_closed(self):
+        with self._lock:
+            self._open_inputs -= 1
+            finished = self._open_inputs == 0
+        if finished:
+            self.returncode = self._process.wait()
+            if self.returncode != 0:
+                print(f"Ошибка ffmpeg: {self._error_output()}")
+            self._log.close()
+
+    def _error_output(self):
+        self._log.seek(0)
+        return self._log.read().decode(errors='replace').strip()[-2000:]
@@ -0,0 +1,85 @@
+import mmap
+import tempfile
+
+import numpy as np
+
+from greenrecord.pipeline import FrameQueue
+
+
+class SpoolingFrameQueue(FrameQueue):
+    # FrameQueue with an overflow spool: when every in-memory buffer is
+    # taken, capture fills a frame record of a memory-mapped file instead of
+    # waiting or dropping. The records are extra buffer slots, so capture
+    # writes into them and the encoder reads from them in place, in the
+    # same order as every other frame; the kernel writes the pages back to
+    # disk and can evict them, so a burst costs disk space rather than RAM.
+    # The file lives in spool_dir (default: the system temp directory, i.e.
+    # local disk even when recordings go to a network share), is unlinked
+    # right away and holds spool_bytes at most; when it is full too the
+    # queue's own policy applies.
+    def __init__(self, shape, size=4, policy='block', spool_bytes=1 << 30, spool_dir=None, dtype=np.uint8):
+        super().__init__(shape, size, policy, dtype)
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        records = int(spool_bytes // frame_bytes)
+        if records < 1:
+            raise ValueError(f"Spool of {spool_bytes} bytes cannot hold a {frame_bytes} byte frame")
+        self.memory_slots = size
+        self.frame_bytes = frame_bytes
+        self.spool_records = records
+        self.spooled = 0
+        self.spool_full = 0
+        self.spool_high_water = 0
+        self._file = tempfile.TemporaryFile(prefix='greenrecord-spool-', dir=spool_dir)
+        try:
+            self._file.truncate(records * frame_bytes)  # Sparse: disk is only used once written
+            self._map = mmap.mmap(self._file.fileno(), records * frame_bytes)
+        except Exception:
+            self._file.close()
+            raise
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        records_array = np.frombuffer(self._map, dtype).reshape((records,) + tuple(shape))
+        self.buffers += list(records_array)
+        self._spool_free = list(range(size, size + records))
+        self._spool_free.reverse()  # pop() hands out the records front to back
+
+    def acquire(self):
+        with self._cond:
+            if not self._free and self._spool_free:
+                slot = self._spool_free.pop()
+                self.spooled += 1
+                self.spool_high_water = max(self.spool_high_water, self.spool_depth())
+                return slot
+            if not self._free and not self._closed:
+                self.spool_full += 1
+        return super().acquire()
+
+    def release(self, slot):
+        if slot < self.memory_slots:
+            super().release(slot)
+            return
+        with self._cond:
+            self._spool_free.append(slot)
+            self._cond.notify_all()
+
+    def spool_depth(self):
+        # Records in use (queued or being encoded)
+        return self.spool_records - len(self._spool_free)
+
+    def dispose(self):
+        # After the encoder is done with every frame
+        self.buffers = self.buffers[:self.memory_slots]
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # A view is still alive somewhere; the mapping goes with it
+        self._file.close()
+
+    def stats(self):
+        return {
+            'spooled': self.spooled,
+            'spool_depth': self.spool_depth(),
+            'spool_high_water': self.spool_high_water,
+            'spool_high_water_bytes': self.spool_high_water * self.frame_bytes,
+            'spool_full': self.spool_full,
+        }
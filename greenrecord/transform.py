@@ -0,0 +1,74 @@
+import numpy as np
+
+from greenrecord.pixfmt import PACKED, ColorConverter, frame_shape
+
+
+def clamp_region(region, screen_size):
+    # (x, y, w, h) limited to the screen; None or a zero size means full screen
+    screen_w, screen_h = screen_size
+    if not region or region[2] <= 0 or region[3] <= 0:
+        return (0, 0, screen_w, screen_h)
+    x, y, w, h = (int(v) for v in region)
+    x = min(max(x, 0), screen_w - 1)
+    y = min(max(y, 0), screen_h - 1)
+    return (x, y, min(w, screen_w - x), min(h, screen_h - y))
+
+
+class FrameTransform:
+    # Crop + scale + pixel format stage between capture and encode. Everything
+    # that does not depend on pixel data (crop slices, interpolation, the path
+    # taken) is decided once here; apply() then writes straight into the
+    # caller's preallocated output buffer. in_format is what apply() gets
+    # (bgr24, or the backend's native bgra), out_format what the sink reads
+    # (see pixfmt.negotiate); a scaled frame is converted from one reused
+    # buffer at the output size.
+    def __init__(self, in_shape, out_size, crop=None, interpolation=None, in_format='bgr24', out_format='bgr24'):
+        import cv2
+        self._cv2 = cv2
+        in_h, in_w = in_shape[:2]
+        x, y, w, h = clamp_region(crop, (in_w, in_h))
+        out_w, out_h = (int(v) for v in out_size)
+        # Most encoders need even dimensions for 4:2:0 chroma subsampling
+        out_w -= out_w % 2
+        out_h -= out_h % 2
+        if out_w <= 0 or out_h <= 0:
+            raise ValueError(f"Invalid output size: {out_size}")
+        if (w - w % 2, h - h % 2) == (out_w, out_h):
+            # Odd-sized source: drop the last column/row instead of rescaling
+            w, h = out_w, out_h
+        self.crop = (x, y, w, h)
+        self._rows = slice(y, y + h)
+        self._cols = slice(x, x + w)
+        self.out_size = (out_w, out_h)
+        self.in_format = in_format
+        self.out_format = out_format
+        self.out_shape = frame_shape(out_format, out_w, out_h)
+        self.scaled = (w, h) != (out_w, out_h)
+        self._converter = None
+        self._scaled_frame = None
+        if in_format != out_format:
+            self._converter = ColorConverter(in_format, out_format, self.out_size)
+            if self.scaled:
+                self._scaled_frame = np.empty((out_h, out_w, PACKED[in_format]), np.uint8)
+        if interpolation is None:
+            # INTER_AREA averages source pixels when shrinking (no aliasing on
+            # text), INTER_LINEAR is the cheap choice when enlarging
+            shrinking = out_w * out_h < w * h
+            interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+        self.interpolation = interpolation
+
+    def is_identity(self, in_shape):
+        return not self.scaled and self._converter is None and self.out_shape == tuple(in_shape)
+
+    def apply(self, frame, out):
+        view = frame[self._rows, self._cols]
+        if self._converter is not None:
+            if self.scaled:
+                view = self._cv2.resize(view, self.out_size, dst=self._scaled_frame,
+                                        interpolation=self.interpolation)
+            self._converter.apply(view, out)
+        elif self.scaled:
+            self._cv2.resize(view, self.out_size, dst=out, interpolation=self.interpolation)
+        else:
+            np.copyto(out, view)
+        return out